@@ -24,8 +24,13 @@ import numpy as np
 from config import TEMP_DIR, EXTRACT_DIR, LOG_PATH, S3_CONFIG
 from database import init_db, get_task_stats, get_file_entities
 from models_loader import load_models_cached, get_lancedb_tables
-from etl import batch_process_local_files, sftp_task, get_s3_client, delete_file_by_hash
-from stats_service import get_dashboard_stats, get_task_trend
+from etl import batch_process_local_files, sftp_task, delete_file_by_hash
+from s3_utils import get_s3_client
+from s3_sync import sync_s3_prefix
+from ingest_retry import start_retry_loop
+from ingest_journal import start_resume
+from scheduler import get_controller
+from stats_service import get_dashboard_stats, get_task_trend, get_stage_breakdown
 from ui.styles import GLOBAL_CSS, render_kpi_html
 
 # ---------- 初始化 ----------
@@ -94,6 +99,11 @@ def _get_all():
     return models, tbl_text, tbl_image, tbl_files
 
 
+# 失败入库的后台重试（有到期记录时才触发懒加载）；续跑上次中断的上传批次
+start_retry_loop(_get_all)
+start_resume(_get_all)
+
+
 def build_highlight_html(full_text: str, snippet: str, max_len: int = 100000) -> str:
     if not full_text:
         return ""
@@ -604,19 +614,28 @@ def _build_similarity_graph(models, files_df_kg):
 
 
 def _build_ingest(models, tbl_text, tbl_image, tbl_files):
-    mode = ui.toggle(['本地上传', 'SFTP 采集'], value='本地上传').classes('q-mb-md')
+    with ui.row().classes('items-center q-gutter-md q-mb-md'):
+        mode = ui.toggle(['本地上传', 'SFTP 采集', 'S3 采集'], value='本地上传')
+        # 入库优先级通道：本地上传默认交互优先，远端采集默认批量
+        priority = ui.select(
+            {'interactive': '交互（优先）', 'bulk': '批量', 'backfill': '回填（最低）'},
+            value='interactive', label='优先级',
+        ).props('dense outlined').style('min-width: 140px')
 
     # --- 本地上传区 ---
     local_container = ui.column().classes('w-full')
     # --- SFTP 区 ---
     sftp_container = ui.column().classes('w-full')
+    # --- S3 区 ---
+    s3_container = ui.column().classes('w-full')
 
     upload_holder = {'files': []}  # 存放已上传的临时文件路径
 
     def on_mode_change():
-        is_local = mode.value == '本地上传'
-        local_container.set_visibility(is_local)
-        sftp_container.set_visibility(not is_local)
+        local_container.set_visibility(mode.value == '本地上传')
+        sftp_container.set_visibility(mode.value == 'SFTP 采集')
+        s3_container.set_visibility(mode.value == 'S3 采集')
+        priority.value = 'interactive' if mode.value == '本地上传' else 'bulk'
 
     mode.on_value_change(on_mode_change)
 
@@ -669,7 +688,7 @@ def _build_ingest(models, tbl_text, tbl_image, tbl_files):
                     None,
                     lambda: batch_process_local_files(
                         upload_holder['files'], models, tbl_text, tbl_image, tbl_files,
-                        progress_callback=progress_cb,
+                        progress_callback=progress_cb, lane=priority.value,
                     ),
                 )
                 prog_state['done'] = True
@@ -739,7 +758,7 @@ def _build_ingest(models, tbl_text, tbl_image, tbl_files):
                         sftp_host.value, sftp_port.value, sftp_user.value,
                         sftp_pw.value, sftp_path.value,
                         models, tbl_text, tbl_image, tbl_files,
-                        progress_callback=sftp_progress_cb,
+                        progress_callback=sftp_progress_cb, lane=priority.value,
                     ),
                 )
                 sftp_prog_state['done'] = True
@@ -753,6 +772,76 @@ def _build_ingest(models, tbl_text, tbl_image, tbl_files):
 
             ui.button('开始采集', on_click=do_sftp, color='blue').props('unelevated')
 
+    # S3 桶/前缀采集
+    with s3_container:
+        s3_container.set_visibility(False)
+        with ui.element('div').classes('glass-card w-full'):
+            ui.label('增量同步：只处理新增或 ETag 变化的对象，中断后从断点继续').classes('text-caption text-grey-7 q-mb-sm')
+            with ui.row().classes('w-full q-gutter-md'):
+                s3_bucket = ui.input('Bucket').classes('flex-grow')
+                s3_prefix = ui.input('前缀（Prefix）').classes('flex-grow')
+            with ui.row().classes('w-full q-gutter-md'):
+                s3_endpoint = ui.input('Endpoint（留空使用系统配置）').classes('flex-grow')
+                s3_ak = ui.input('Access Key').classes('flex-grow')
+                s3_sk = ui.input('Secret Key', password=True).classes('flex-grow')
+            s3_force = ui.checkbox('忽略清单，全部重新处理')
+
+            s3_log = ui.log(max_lines=50).classes('w-full q-mt-sm').style('height: 200px')
+            s3_progress_label = ui.label('').classes('text-caption text-grey-7 q-mt-sm')
+            s3_progress_bar = ui.linear_progress(value=0, color='blue').classes('w-full q-mt-xs')
+            s3_progress_bar.set_visibility(False)
+
+            async def do_s3():
+                if not s3_bucket.value:
+                    ui.notify('请填写 Bucket', type='warning')
+                    return
+                s3_log.clear()
+                s3_progress_bar.set_visibility(True)
+                s3_progress_bar.value = 0
+
+                s3_prog_state = {'i': 0, 't': 1, 'msg': '', 'done': False}
+
+                def s3_progress_cb(i, t, msg):
+                    s3_prog_state['i'] = i
+                    s3_prog_state['t'] = t
+                    s3_prog_state['msg'] = msg
+
+                def s3_poll():
+                    if s3_prog_state['done']:
+                        s3_poll_timer.deactivate()
+                        return
+                    t = s3_prog_state['t'] or 1
+                    s3_progress_bar.value = s3_prog_state['i'] / t if t > 0 else 0
+                    s3_progress_label.text = f"{s3_prog_state['i']}/{t} — {s3_prog_state['msg']}"
+
+                s3_poll_timer = ui.timer(0.3, s3_poll)
+
+                loop = asyncio.get_running_loop()
+                stats = await loop.run_in_executor(
+                    None,
+                    lambda: sync_s3_prefix(
+                        s3_bucket.value, s3_prefix.value, models, tbl_text, tbl_image, tbl_files,
+                        endpoint_url=s3_endpoint.value or None,
+                        access_key_id=s3_ak.value or None,
+                        secret_access_key=s3_sk.value or None,
+                        progress_callback=s3_progress_cb,
+                        force=s3_force.value,
+                        lane=priority.value,
+                    ),
+                )
+                s3_prog_state['done'] = True
+                s3_poll_timer.deactivate()
+                s3_progress_bar.value = 1.0
+                s3_progress_label.text = ''
+                s3_log.push(f"🔗 列举 {stats['listed']} 个对象，{stats['unchanged']} 个未变化已跳过")
+                for err in stats['errors'][:20]:
+                    s3_log.push(f'⚠️ {err}')
+                s3_log.push(f"🎉 入库 {stats['count']} 条（{stats['ingested']} 个对象，耗时 {stats['duration']:.1f}s）")
+                if stats['skipped_names']:
+                    s3_log.push(f"⏭️ 跳过 {len(stats['skipped_names'])} 个文件: {', '.join(stats['skipped_names'])}")
+
+            ui.button('开始采集', on_click=do_s3, color='blue').props('unelevated')
+
 
 async def _handle_upload(e: events.UploadEventArguments, holder: dict):
     """将 NiceGUI 上传的文件保存到临时目录"""
@@ -1077,6 +1166,8 @@ def _build_monitor():
                             '文件数': r[3],
                             '成功数': r[4],
                             '耗时(s)': round(r[5], 2) if r[5] else 0,
+                            '向量缓存命中率': f'{r[7] / (r[7] + r[8]):.0%}' if (r[7] or 0) + (r[8] or 0) else '—',
+                            '上传吞吐(MB/s)': round(r[9] / 1024 / 1024 / r[10], 1) if r[9] and r[10] else '—',
                         }
                         for r in rows
                     ]
@@ -1085,11 +1176,56 @@ def _build_monitor():
                         {'name': '文件数', 'label': '文件数', 'field': '文件数'},
                         {'name': '成功数', 'label': '成功数', 'field': '成功数'},
                         {'name': '耗时(s)', 'label': '耗时(s)', 'field': '耗时(s)'},
+                        {'name': '向量缓存命中率', 'label': '向量缓存命中率', 'field': '向量缓存命中率'},
+                        {'name': '上传吞吐(MB/s)', 'label': '上传吞吐(MB/s)', 'field': '上传吞吐(MB/s)'},
                     ]
                     ui.table(columns=columns, rows=table_rows).classes('w-full')
                 else:
                     ui.label('暂无任务记录').classes('text-grey-6')
 
+            with ui.element('div').classes('glass-card w-full q-mt-md'):
+                ui.label('近 7 天各阶段单文件耗时（* 为全部类型汇总，按总耗时排序）').classes('text-caption text-grey-7 q-mb-sm')
+                stages = get_stage_breakdown(7)
+                if stages:
+                    stage_columns = [
+                        {'name': 'stage', 'label': '阶段', 'field': 'stage', 'align': 'left'},
+                        {'name': 'doc_type', 'label': '类型', 'field': 'doc_type', 'align': 'left'},
+                        {'name': 'files', 'label': '文件数', 'field': 'files'},
+                        {'name': 'p50_sec', 'label': 'p50(s)', 'field': 'p50_sec'},
+                        {'name': 'p95_sec', 'label': 'p95(s)', 'field': 'p95_sec'},
+                        {'name': 'total_sec', 'label': '总耗时(s)', 'field': 'total_sec'},
+                        {'name': 'mb_per_sec', 'label': 'MB/s', 'field': 'mb_per_sec'},
+                        {'name': 'rows_per_sec', 'label': '行/s', 'field': 'rows_per_sec'},
+                    ]
+                    ui.table(columns=stage_columns, rows=stages, pagination=20).classes('w-full')
+                else:
+                    ui.label('暂无分阶段记录').classes('text-grey-6')
+
+            with ui.element('div').classes('glass-card w-full q-mt-md'):
+                ctl = get_controller().snapshot()
+                sched = ctl['scheduler']
+                ui.label(
+                    f"入库并发：文件 {sched['running']}/{sched['max_workers']}，排队 {sched['pending']}，"
+                    f"内存 {sched['used_mb']}/{sched['budget_mb']}MB（自适应{'开启' if ctl['adaptive'] else '关闭'}）"
+                ).classes('text-caption text-grey-7')
+                ui.label('通道：' + '，'.join(
+                    f"{k} 运行 {v['running']} / 排队 {v['pending']}" for k, v in sched['lanes'].items()
+                ) + f"（interactive 预留 {sched['reserved_interactive']}）").classes('text-caption text-grey-7 q-mb-sm')
+                gate_rows = [
+                    {'stage': k, 'limit': v['limit'], 'active': v['active'], 'waiting': v['waiting'],
+                     'range': '{}–{}'.format(*ctl['bounds'][k])}
+                    for k, v in ctl['stages'].items()
+                ]
+                ui.table(columns=[
+                    {'name': 'stage', 'label': '阶段', 'field': 'stage', 'align': 'left'},
+                    {'name': 'limit', 'label': '并发上限', 'field': 'limit'},
+                    {'name': 'active', 'label': '进行中', 'field': 'active'},
+                    {'name': 'waiting', 'label': '排队', 'field': 'waiting'},
+                    {'name': 'range', 'label': '调整范围', 'field': 'range'},
+                ], rows=gate_rows).classes('w-full')
+                for d in reversed(ctl['decisions'][-5:]):
+                    ui.label(f"{d['target']}: {d['from']} → {d['to']}（{d['reason']}）").classes('text-caption text-grey-6')
+
     load_tasks()
     ui.button('刷新', icon='refresh', on_click=load_tasks, color='blue').props('flat dense').classes('q-mt-sm')
 
@@ -6,7 +6,7 @@ from typing import List, Dict
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 
-from stats_service import get_dashboard_stats, get_task_trend
+from stats_service import get_dashboard_stats, get_task_trend, get_stage_breakdown
 from models_loader import get_lancedb_tables
 from database import get_file_entities
 
@@ -29,6 +29,16 @@ class TrendData(BaseModel):
     file_count: int
     success_count: int
 
+class StageStat(BaseModel):
+    stage: str
+    doc_type: str
+    files: int
+    p50_sec: float
+    p95_sec: float
+    total_sec: float
+    mb_per_sec: float
+    rows_per_sec: float
+
 class FileTypeCount(BaseModel):
     doc_type: str
     count: int
@@ -72,6 +82,17 @@ async def get_trend(days: int = 7):
         logger.error(f"获取趋势数据失败: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"获取趋势数据失败: {str(e)}")
 
+@router.get("/stages", response_model=List[StageStat])
+async def get_stages(days: int = 7, by_doc_type: bool = True):
+    """获取近N天入库各阶段（hash/upload/extract/transcribe/embed/commit 等）的单文件耗时 p50/p95；
+    doc_type 为 "*" 的行是该阶段的全类型汇总"""
+    try:
+        return [StageStat(**item) for item in get_stage_breakdown(days, by_doc_type)]
+
+    except Exception as e:
+        logger.error(f"获取分阶段统计失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"获取分阶段统计失败: {str(e)}")
+
 @router.get("/file-types", response_model=List[FileTypeCount])
 async def get_file_types():
     """获取文件类型分布"""
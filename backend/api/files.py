@@ -10,7 +10,7 @@ from pydantic import BaseModel
 
 from models_loader import get_lancedb_tables
 from database import get_file_registry_count, delete_file_from_registry
-from s3_utils import delete_from_s3
+from s3_utils import delete_raw_objects
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -180,13 +180,12 @@ async def delete_file(file_hash: str):
         tbl_image.delete(f"file_hash = '{file_hash}'")
         tbl_files.delete(f"file_hash = '{file_hash}'")
 
+        # 从 S3 删除内容对象及全部日期/类型索引标记（需在清理 SQLite 登记前）
+        delete_raw_objects(file_hash, source_uri)
+
         # 从 SQLite 删除
         delete_file_from_registry(file_hash)
 
-        # 从 S3 删除
-        if source_uri.startswith("s3://"):
-            delete_from_s3(source_uri)
-
         logger.info(f"文件已删除: {file_hash}")
         return DeleteResponse(success=True, message="文件删除成功")
 
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""入库 API：失败重试 / 死信、并发调度状态"""
+
+import logging
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, BackgroundTasks
+from pydantic import BaseModel
+
+from models_loader import load_models_cached, get_lancedb_tables
+from database import get_ingest_failures, get_ingest_failure
+from ingest_retry import redrive_failure, redrive_all_dead, discard_failure
+from scheduler import get_controller
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+class FailureItem(BaseModel):
+    id: int
+    local_path: Optional[str] = None
+    original_filename: str
+    source: Optional[str] = None
+    error_class: Optional[str] = None
+    error_type: Optional[str] = None
+    error_msg: Optional[str] = None
+    attempts: int
+    status: str
+    next_retry_at: Optional[float] = None
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+
+class FailuresResponse(BaseModel):
+    success: bool
+    failures: List[FailureItem]
+    total: int
+
+class ActionResponse(BaseModel):
+    success: bool
+    message: str
+
+def _resources():
+    return (load_models_cached(), *get_lancedb_tables())
+
+def _redrive_task(failure_id: int):
+    try:
+        redrive_failure(failure_id, _resources)
+    except Exception as e:
+        logger.error(f"重新投递失败: id={failure_id}, {e}", exc_info=True)
+
+@router.get("/failures", response_model=FailuresResponse)
+async def list_failures(status: str = None, limit: int = 100):
+    """失败记录列表；status: retrying（等待自动重试）/ dead（死信）/ resolved（已恢复）"""
+    rows = get_ingest_failures(status=status, limit=limit)
+    return FailuresResponse(success=True, failures=[FailureItem(**r) for r in rows], total=len(rows))
+
+@router.post("/failures/{failure_id}/retry", response_model=ActionResponse)
+async def retry_failure(failure_id: int, background_tasks: BackgroundTasks):
+    """立即重新投递一条失败记录（含死信），后台执行"""
+    row = get_ingest_failure(failure_id)
+    if not row:
+        raise HTTPException(status_code=404, detail="记录不存在")
+    if row["status"] == "resolved":
+        return ActionResponse(success=False, message="该文件已入库成功")
+    background_tasks.add_task(_redrive_task, failure_id)
+    return ActionResponse(success=True, message=f"已重新投递: {row['original_filename']}")
+
+@router.post("/failures/retry-dead", response_model=ActionResponse)
+async def retry_all_dead():
+    """把全部死信放回重试队列，由后台重试线程处理"""
+    n = redrive_all_dead()
+    return ActionResponse(success=True, message=f"已重新投递 {n} 条死信")
+
+@router.delete("/failures/{failure_id}", response_model=ActionResponse)
+async def delete_failure(failure_id: int):
+    """放弃一条失败记录（同时删除保留的失败文件）"""
+    if not discard_failure(failure_id):
+        raise HTTPException(status_code=404, detail="记录不存在")
+    return ActionResponse(success=True, message="已删除")
+
+@router.get("/concurrency")
+async def get_concurrency():
+    """入库并发调度状态：当前文件级/各阶段并发上限、排队数、吞吐、CPU/内存采样及最近的调整决策"""
+    return {"success": True, **get_controller().snapshot()}
@@ -24,6 +24,7 @@ class SearchResult(BaseModel):
     source_uri: str
     distance: float
     file_hash: str
+    meta_info: Optional[str] = None
 
 class SearchResponse(BaseModel):
     success: bool
@@ -57,7 +58,8 @@ async def search(req: SearchRequest):
                     doc_type=row["doc_type"],
                     source_uri=row["source_uri"],
                     distance=float(row.get("_distance", 0)),
-                    file_hash=row.get("file_hash", "")
+                    file_hash=row.get("file_hash", ""),
+                    meta_info=row.get("meta_info") if isinstance(row.get("meta_info"), str) else None
                 ))
 
             return SearchResponse(
@@ -4,45 +4,74 @@
 import os
 import uuid
 import logging
-from typing import List
-from fastapi import APIRouter, UploadFile, File, BackgroundTasks
+from typing import List, Optional
+from fastapi import APIRouter, UploadFile, File, Form, BackgroundTasks
 from pydantic import BaseModel
 
 from config import TEMP_DIR
 from etl import batch_process_local_files
+from ingest_retry import record_failure
+from database import create_ingest_job
 from models_loader import load_models_cached, get_lancedb_tables
+from scheduler import check_lane
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+class S3SyncRequest(BaseModel):
+    bucket: str
+    prefix: str = ""
+    endpoint_url: Optional[str] = None
+    access_key_id: Optional[str] = None
+    secret_access_key: Optional[str] = None
+    force: bool = False
+    priority: str = "bulk"
+
 class UploadResponse(BaseModel):
     success: bool
     message: str
     file_count: int
     task_id: str = None
 
-def _process_files_task(temp_files):
+def _process_files_task(temp_files, task_id, priority):
     """后台任务：处理上传的文件
     temp_files: list of (local_path, original_filename) 元组
+    task_id: 入库日志批次号（接收时已登记，进程中断后启动时续跑）
+    priority: 入库优先级通道
     """
     try:
         models = load_models_cached()
         tbl_text, tbl_image, tbl_files = get_lancedb_tables()
 
-        batch_process_local_files(temp_files, models, tbl_text, tbl_image, tbl_files)
+        batch_process_local_files(temp_files, models, tbl_text, tbl_image, tbl_files, job_id=task_id, lane=priority)
 
         logger.info(f"批量处理完成: {len(temp_files)} 个文件")
     except Exception as e:
         logger.error(f"批量处理失败: {e}", exc_info=True)
+        # 模型/存储不可用等整批失败：登记到重试队列，文件移入 FAILED_DIR 保留
+        res = {"msg": str(e), "error_type": type(e).__name__}
+        for temp_path, name in temp_files:
+            if os.path.exists(temp_path):
+                record_failure(temp_path, name, res, source="upload")
+    finally:
+        # 失败文件已移入 FAILED_DIR 等待重试，剩下的临时文件全部清理
+        for temp_path, _ in temp_files:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
 
 @router.post("/batch", response_model=UploadResponse)
 async def upload_files(
     background_tasks: BackgroundTasks,
-    files: List[UploadFile] = File(...)
+    files: List[UploadFile] = File(...),
+    priority: str = Form("interactive"),
 ):
-    """批量上传文件并后台处理"""
+    """批量上传文件并后台处理；priority: interactive（默认，优先处理）/ bulk / backfill"""
     if not files:
         return UploadResponse(success=False, message="未选择文件", file_count=0)
+    try:
+        check_lane(priority)
+    except ValueError as e:
+        return UploadResponse(success=False, message=str(e), file_count=0)
 
     # 保存上传的文件到临时目录
     os.makedirs(TEMP_DIR, exist_ok=True)
@@ -57,9 +86,10 @@ async def upload_files(
             temp_files.append((temp_path, file.filename))
             logger.info(f"文件已保存: {file.filename} -> {temp_path}")
 
-        # 后台任务处理文件（temp_files 已是 (path, filename) 元组列表）
+        # 先写入库日志再交给后台任务，任务未跑完就重启也能续跑
         task_id = uuid.uuid4().hex[:12]
-        background_tasks.add_task(_process_files_task, temp_files)
+        create_ingest_job(task_id, "upload", temp_files, lane=priority)
+        background_tasks.add_task(_process_files_task, temp_files, task_id, priority)
 
         return UploadResponse(
             success=True,
@@ -79,3 +109,40 @@ async def upload_files(
             message=f"上传失败: {str(e)}",
             file_count=0
         )
+
+
+def _s3_sync_task(req: S3SyncRequest):
+    """后台任务：同步 S3 桶/前缀"""
+    try:
+        from s3_sync import sync_s3_prefix
+
+        models = load_models_cached()
+        tbl_text, tbl_image, tbl_files = get_lancedb_tables()
+        sync_s3_prefix(
+            req.bucket, req.prefix, models, tbl_text, tbl_image, tbl_files,
+            endpoint_url=req.endpoint_url,
+            access_key_id=req.access_key_id,
+            secret_access_key=req.secret_access_key,
+            force=req.force,
+            lane=req.priority,
+        )
+    except Exception as e:
+        logger.error(f"S3 同步失败: {e}", exc_info=True)
+
+@router.post("/s3", response_model=UploadResponse)
+async def sync_s3(req: S3SyncRequest, background_tasks: BackgroundTasks):
+    """从 S3 桶/前缀增量采集（后台执行，只处理新增或 ETag 变化的对象）"""
+    if not req.bucket:
+        return UploadResponse(success=False, message="未指定 bucket", file_count=0)
+    try:
+        check_lane(req.priority)
+    except ValueError as e:
+        return UploadResponse(success=False, message=str(e), file_count=0)
+    task_id = uuid.uuid4().hex[:12]
+    background_tasks.add_task(_s3_sync_task, req)
+    return UploadResponse(
+        success=True,
+        message=f"已开始同步 s3://{req.bucket}/{req.prefix}",
+        file_count=0,
+        task_id=task_id,
+    )
@@ -14,7 +14,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
-from api import upload, search, files, dashboard, system
+from api import upload, search, files, dashboard, system, ingest
 
 # 配置日志
 logging.basicConfig(
@@ -49,6 +49,7 @@ app.include_router(search.router, prefix="/api/search", tags=["向量搜索"])
 app.include_router(files.router, prefix="/api/files", tags=["文件管理"])
 app.include_router(dashboard.router, prefix="/api/dashboard", tags=["仪表盘"])
 app.include_router(system.router, prefix="/api/system", tags=["系统监控"])
+app.include_router(ingest.router, prefix="/api/ingest", tags=["失败重试"])
 
 @app.get("/api/health")
 async def health_check():
@@ -88,6 +89,13 @@ async def startup_event():
 
     threading.Thread(target=load_resources, daemon=True).start()
 
+    # 失败入库的后台重试（有到期记录时才加载模型）；续跑上次中断的上传批次
+    from ingest_retry import start_retry_loop
+    from ingest_journal import start_resume
+    from models_loader import load_models_cached, get_lancedb_tables
+    start_retry_loop(lambda: (load_models_cached(), *get_lancedb_tables()))
+    start_resume(lambda: (load_models_cached(), *get_lancedb_tables()))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
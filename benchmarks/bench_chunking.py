@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""分块基准：对比按字符 / 按 token 分块的切片数、截断切片数与每 MB 编码耗时
+
+同时检查增量切片（iter_split_segments，入库实际使用）与整体 split_text 的一致性：
+报告两者的切片数、切片长度分布与不一致切片数，不一致比例超过 --max-mismatch 时以非零状态退出。
+
+用法:
+    python benchmarks/bench_chunking.py                       # 合成中/英/代码混合语料（默认 2MB）
+    python benchmarks/bench_chunking.py a.log b.md --out r.json
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_TOKEN_OVERLAP
+from models_loader import (
+    TEXT_MODEL_NAME,
+    load_sentence_transformer,
+    get_model_text_splitter,
+    iter_split_segments,
+)
+from extractors import iter_text_blocks
+
+
+def synth_corpus(size_mb, seed=0):
+    """中文段落、英文段落、代码片段按比例混合"""
+    rnd = random.Random(seed)
+    zh = "数据湖统一接入多模态文件，向量化后支持语义检索与整篇预览。系统按文件哈希去重，失败任务可重试。"
+    en = "The ingest pipeline hashes each file, uploads the raw bytes, extracts text and writes vectors to Lance. "
+    code = "def process(item):\n    if not item:\n        return None\n    return {'id': item.id, 'size': len(item.data)}\n"
+    target = int(size_mb * 1024 * 1024)
+    parts, size = [], 0
+    while size < target:
+        kind = rnd.random()
+        piece = (zh * rnd.randint(2, 8)) if kind < 0.45 else (en * rnd.randint(2, 6)) if kind < 0.8 else (code * rnd.randint(1, 4))
+        piece += "\n\n"
+        parts.append(piece)
+        size += len(piece.encode("utf-8"))
+    return "".join(parts)
+
+
+def parity(splitter, blocks, streamed):
+    """增量切片与整体切分对比：切片数、长度分布、逐位置不一致的切片数"""
+    whole = splitter.split_text("".join(blocks))
+    lens_s, lens_w = [len(c) for c in streamed], [len(c) for c in whole]
+    return {
+        "chunks_stream": len(streamed),
+        "chunks_whole": len(whole),
+        "mismatched": sum(1 for a, b in zip(streamed, whole) if a != b) + abs(len(streamed) - len(whole)),
+        "len_p50": [statistics.median(lens_s) if lens_s else 0, statistics.median(lens_w) if lens_w else 0],
+        "len_max": [max(lens_s, default=0), max(lens_w, default=0)],
+    }
+
+
+def run_mode(model, mode, sources, total_mb):
+    splitter = get_model_text_splitter(model, mode, CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_TOKEN_OVERLAP)
+    tokenizer = model.tokenizer
+    limit = model.max_seq_length
+
+    t0 = time.perf_counter()
+    chunks, per_source = [], []
+    for src in sources:
+        blocks = iter_text_blocks(src) if isinstance(src, str) else src
+        streamed = [c for c, _ in iter_split_segments(splitter, ((b, "") for b in blocks))]
+        per_source.append(streamed)
+        chunks.extend(streamed)
+    split_sec = time.perf_counter() - t0
+
+    checks = [parity(splitter, list(iter_text_blocks(src)) if isinstance(src, str) else src, streamed)
+              for src, streamed in zip(sources, per_source)]
+    stream_vs_whole = {
+        "chunks_stream": sum(c["chunks_stream"] for c in checks),
+        "chunks_whole": sum(c["chunks_whole"] for c in checks),
+        "mismatched": sum(c["mismatched"] for c in checks),
+        "sources": checks,
+    }
+
+    token_lens = [len(tokenizer.encode(c)) for c in chunks]
+    truncated = sum(1 for n in token_lens if n > limit)
+
+    t0 = time.perf_counter()
+    model.encode(chunks, batch_size=64)
+    encode_sec = time.perf_counter() - t0
+
+    return {
+        "mode": mode,
+        "chunks": len(chunks),
+        "chunks_per_mb": round(len(chunks) / total_mb, 1),
+        "avg_tokens": round(sum(token_lens) / max(len(token_lens), 1), 1),
+        "max_tokens": max(token_lens) if token_lens else 0,
+        "truncated_chunks": truncated,
+        "split_sec_per_mb": round(split_sec / total_mb, 3),
+        "encode_sec_per_mb": round(encode_sec / total_mb, 3),
+        "stream_vs_whole": stream_vs_whole,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="字符分块 vs token 分块基准")
+    parser.add_argument("files", nargs="*", help="文本文件；不传则使用合成语料")
+    parser.add_argument("--synth-mb", type=float, default=2.0, help="合成语料大小（MB）")
+    parser.add_argument("--out", help="JSON 结果输出路径")
+    parser.add_argument("--max-mismatch", type=float, default=0.01,
+                        help="增量切片与整体切分不一致的切片比例上限")
+    args = parser.parse_args()
+
+    if args.files:
+        sources = args.files
+        total_mb = sum(Path(f).stat().st_size for f in args.files) / 1024 / 1024
+    else:
+        text = synth_corpus(args.synth_mb)
+        sources = [[text[i:i + 65536] for i in range(0, len(text), 65536)]]
+        total_mb = len(text.encode("utf-8")) / 1024 / 1024
+
+    model = load_sentence_transformer(TEXT_MODEL_NAME)
+    result = {
+        "model": TEXT_MODEL_NAME,
+        "max_seq_length": model.max_seq_length,
+        "input_mb": round(total_mb, 3),
+        "runs": [run_mode(model, mode, sources, total_mb) for mode in ("char", "token")],
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    failed = [r["mode"] for r in result["runs"]
+              if r["stream_vs_whole"]["mismatched"] > args.max_mismatch * max(r["stream_vs_whole"]["chunks_whole"], 1)]
+    if failed:
+        print(f"增量切片与整体切分不一致（比例 > {args.max_mismatch}）: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""入库吞吐基准：合成混合语料 → batch_process_local_files → 本地 Lance 目录 + 本地 S3 替身
+
+报告 files/s、chunks/s、MB/s、峰值 RSS 与各阶段耗时（task_stage_stats 的 p50/p95），输出 JSON 便于跨提交对比。
+每次运行使用独立工作目录（SQLite、向量缓存、Lance 表都在其中），不会碰生产数据。
+
+- --models stub（默认）：确定性的小型桩模型（哈希随机向量、固定转录文本），CI 可跑，测的是管道本身的开销
+- --models real：加载真实模型（bge / CLIP / Whisper），用于完整评估
+- S3 替身：--s3-endpoint 或环境变量 BENCH_S3_ENDPOINT（如 `moto_server -p 5000`）；
+  都未指定时若装了 moto 则进程内启动 ThreadedMotoServer，否则跳过上传阶段
+
+用法:
+    python benchmarks/bench_ingest.py --per-type 20 --out bench.json
+    python benchmarks/bench_ingest.py --models real --per-type 5 --s3-endpoint http://127.0.0.1:5000
+"""
+
+import os
+import sys
+import json
+import time
+import wave
+import math
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+CORPUS_TYPES = ("txt", "md", "pdf", "docx", "xlsx", "png", "jpg", "wav")
+STUB_DIM = 512
+
+
+# ---------- 合成语料 ----------
+
+_EN_LINES = [
+    "The ingest pipeline hashes each file and uploads the raw bytes to object storage.",
+    "Vectors are written to Lance tables in batches to keep commits cheap.",
+    "Quarterly revenue grew in the APAC region while logistics costs declined.",
+    "Meeting notes: migrate the search cluster and review the retention policy.",
+    "Sensor 42 reported an anomaly at the north gate during the night shift.",
+]
+
+
+def _pdf_escape(s):
+    return s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, pages):
+    """最小可解析的文本 PDF（Helvetica，ASCII 文本），pages: list[list[str]]"""
+    objs = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        body = "BT /F1 11 Tf 50 780 Td 14 TL " + " ".join(f"({_pdf_escape(l)}) Tj T*" for l in lines) + " ET"
+        objs.append(f"<< /Length {len(body)} >>\nstream\n{body}\nendstream")
+        content_no = len(objs)
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                    f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_no} 0 R >>")
+        kids.append(len(objs))
+    objs[1] = f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(kids)} >>"
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets).encode()
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    Path(path).write_bytes(bytes(out))
+
+
+def write_wav(path, seconds, rnd, rate=16000):
+    """单声道 16kHz 正弦扫频 + 噪声"""
+    f0, f1 = rnd.uniform(200, 400), rnd.uniform(600, 1200)
+    n = int(seconds * rate)
+    frames = bytearray()
+    for i in range(n):
+        t = i / rate
+        f = f0 + (f1 - f0) * t / seconds
+        v = 0.4 * math.sin(2 * math.pi * f * t) + rnd.uniform(-0.05, 0.05)
+        frames += int(max(-1.0, min(1.0, v)) * 32767).to_bytes(2, "little", signed=True)
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(bytes(frames))
+
+
+def make_corpus(out_dir, per_type, text_kb, seed=0):
+    """生成混合语料，返回 [(path, name)]。内容带序号，保证 hash 互不相同"""
+    from PIL import Image
+    import docx
+    import pandas as pd
+    from bench_chunking import synth_corpus
+
+    rnd = random.Random(seed)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    text = synth_corpus(max(text_kb, 1) * per_type / 1024, seed=seed)
+    step = max(len(text) // per_type, 1)
+    files = []
+    for i in range(per_type):
+        tag = f"[bench seed={seed} #{i}]\n"
+        chunk = tag + text[i * step:(i + 1) * step]
+        for ext in ("txt", "md"):
+            p = out_dir / f"doc_{i:04d}.{ext}"
+            p.write_text(chunk, encoding="utf-8")
+            files.append(p)
+
+        p = out_dir / f"report_{i:04d}.pdf"
+        write_pdf(p, [[tag.strip()] + rnd.sample(_EN_LINES, 4) * 3 for _ in range(rnd.randint(1, 4))])
+        files.append(p)
+
+        d = docx.Document()
+        d.add_paragraph(tag)
+        for _ in range(rnd.randint(5, 20)):
+            d.add_paragraph(" ".join(rnd.sample(_EN_LINES, 3)))
+        p = out_dir / f"memo_{i:04d}.docx"
+        d.save(str(p))
+        files.append(p)
+
+        rows = rnd.randint(50, 300)
+        df = pd.DataFrame({
+            "id": [f"{i}-{r}" for r in range(rows)],
+            "region": [rnd.choice(["APAC", "EMEA", "AMER"]) for _ in range(rows)],
+            "amount": [round(rnd.uniform(10, 5000), 2) for _ in range(rows)],
+            "note": [rnd.choice(_EN_LINES) for _ in range(rows)],
+        })
+        p = out_dir / f"sheet_{i:04d}.xlsx"
+        df.to_excel(p, index=False)
+        files.append(p)
+
+        for ext in ("png", "jpg"):
+            w, h = rnd.choice([(320, 240), (640, 480), (1024, 768)])
+            img = Image.new("RGB", (w, h), tuple(rnd.randrange(256) for _ in range(3)))
+            img.putpixel((i % w, 0), (i % 256, 0, 0))  # 像素级差异，避免内容去重
+            p = out_dir / f"img_{i:04d}.{ext}"
+            img.save(p)
+            files.append(p)
+
+        p = out_dir / f"clip_{i:04d}.wav"
+        write_wav(p, rnd.uniform(2, 6), rnd)
+        files.append(p)
+    return [(str(p), p.name) for p in files]
+
+
+# ---------- 桩模型 ----------
+
+class _StubEncoder:
+    """SentenceTransformer 接口的确定性桩：按输入哈希生成单位向量"""
+
+    tokenizer = None
+    max_seq_length = 512
+
+    def __init__(self, name):
+        self.name = name
+
+    def _vec(self, item):
+        import numpy as np
+
+        key = item if isinstance(item, str) else getattr(item, "tobytes", lambda: repr(item).encode())()
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        seed = int.from_bytes(hashlib.md5(key[:65536]).digest()[:4], "little")
+        v = np.random.default_rng(seed).standard_normal(STUB_DIM).astype("float32")
+        return v / np.linalg.norm(v)
+
+    def encode(self, items, batch_size=32, **kwargs):
+        import numpy as np
+
+        if isinstance(items, (list, tuple)):
+            return np.stack([self._vec(x) for x in items]) if items else np.zeros((0, STUB_DIM), "float32")
+        return self._vec(items)
+
+
+class _StubWhisper:
+    """transcribe 接受文件路径（整段转录）或 16kHz float32 PCM 数组（VAD 分段转录）"""
+
+    def transcribe(self, audio, **kwargs):
+        dur = 0.0
+        if isinstance(audio, str):
+            name = os.path.basename(audio)
+            try:
+                with wave.open(audio, "rb") as w:
+                    dur = w.getnframes() / w.getframerate()
+            except Exception:
+                pass
+        else:
+            name = "segment"
+            dur = len(audio) / 16000
+        return {"text": f"Synthetic transcript of {name} lasting {dur:.1f} seconds. "
+                        + " ".join(_EN_LINES), "segments": []}
+
+
+def stub_models():
+    return {
+        "text": _StubEncoder("stub-text"),
+        "clip_text": _StubEncoder("stub-clip-text"),
+        "clip_vision": _StubEncoder("stub-clip-vision"),
+        "whisper": _StubWhisper(),
+    }
+
+
+# ---------- 运行 ----------
+
+class _RssSampler(threading.Thread):
+    def __init__(self, interval=0.1):
+        super().__init__(daemon=True)
+        import psutil
+
+        self._proc = psutil.Process()
+        self._interval = interval
+        self._halt = threading.Event()
+        self.peak = self._proc.memory_info().rss
+
+    def run(self):
+        while not self._halt.wait(self._interval):
+            self.peak = max(self.peak, self._proc.memory_info().rss)
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+        self.peak = max(self.peak, self._proc.memory_info().rss)
+        return self.peak
+
+
+def _start_moto():
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        return None, None
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    return server, f"http://{host}:{port}"
+
+
+def _git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="入库吞吐基准（合成语料 + 本地 Lance + 本地 S3 替身）")
+    parser.add_argument("--per-type", type=int, default=10, help=f"每种类型生成的文件数（{', '.join(CORPUS_TYPES)}）")
+    parser.add_argument("--text-kb", type=int, default=64, help="每个文本文件的大致大小（KB）")
+    parser.add_argument("--models", choices=["stub", "real"], default="stub")
+    parser.add_argument("--s3-endpoint", default=os.getenv("BENCH_S3_ENDPOINT"), help="S3 替身地址（如 moto server）")
+    parser.add_argument("--workdir", help="工作目录（默认新建临时目录）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="JSON 结果输出路径")
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="bench_ingest_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    # 必须在导入项目模块之前设置：config 在导入时读取这些环境变量
+    os.environ["DB_PATH"] = str(workdir / "bench.db")
+    os.environ["EMBED_CACHE_PATH"] = str(workdir / "embed_cache.db")
+    os.environ["LANCE_DB_URI"] = str(workdir / "lance")
+    os.environ.setdefault("DEEPSEEK_API_KEY", "")  # 不触发实体抽取
+    moto = None
+    if not args.s3_endpoint:
+        moto, args.s3_endpoint = _start_moto()
+    if args.s3_endpoint:
+        os.environ["S3_ENDPOINT_URL"] = args.s3_endpoint
+        os.environ.setdefault("S3_ACCESS_KEY", "bench")
+        os.environ.setdefault("S3_SECRET_KEY", "bench")
+        os.environ.setdefault("S3_BUCKET_NAME", "bench-raw")
+
+    import s3_utils
+    from database import init_db
+    from models_loader import get_lancedb_tables, load_models_cached
+    from etl import batch_process_local_files
+    from stats_service import get_stage_breakdown
+
+    if not args.s3_endpoint:
+        s3_utils._s3_client = False  # 无 S3 替身：跳过上传阶段（source_uri 记为 local://）
+
+    t0 = time.perf_counter()
+    corpus = make_corpus(workdir / "corpus", args.per_type, args.text_kb, seed=args.seed)
+    gen_sec = time.perf_counter() - t0
+    corpus_bytes = sum(os.path.getsize(p) for p, _ in corpus)
+
+    init_db()
+    t0 = time.perf_counter()
+    models = stub_models() if args.models == "stub" else load_models_cached()
+    load_sec = time.perf_counter() - t0
+    tbl_text, tbl_image, tbl_files = get_lancedb_tables()
+
+    sampler = _RssSampler()
+    sampler.start()
+    t0 = time.perf_counter()
+    succ, skip, _, skipped_names = batch_process_local_files(corpus, models, tbl_text, tbl_image, tbl_files,
+                                                             source="bench")
+    dur = time.perf_counter() - t0
+    peak_rss = sampler.stop()
+
+    chunks = tbl_text.count_rows()
+    image_rows = tbl_image.count_rows()
+    by_type = {}
+    for p, name in corpus:
+        ext = name.rsplit(".", 1)[-1]
+        t = by_type.setdefault(ext, {"files": 0, "bytes": 0})
+        t["files"] += 1
+        t["bytes"] += os.path.getsize(p)
+
+    result = {
+        "git_rev": _git_rev(),
+        "models": args.models,
+        "s3": "moto(in-process)" if moto else (args.s3_endpoint or "disabled"),
+        "seed": args.seed,
+        "corpus": {"files": len(corpus), "mb": round(corpus_bytes / 1024 / 1024, 3), "by_type": by_type,
+                   "generate_sec": round(gen_sec, 2)},
+        "model_load_sec": round(load_sec, 2),
+        "ingest": {
+            "duration_sec": round(dur, 3),
+            "succeeded": succ,
+            "skipped": skip,
+            "failed": len(corpus) - succ - skip,
+            "skipped_names": skipped_names,
+            "files_per_sec": round(len(corpus) / dur, 2) if dur else 0.0,
+            "text_chunks": chunks,
+            "image_rows": image_rows,
+            "chunks_per_sec": round(chunks / dur, 1) if dur else 0.0,
+            "mb_per_sec": round(corpus_bytes / 1024 / 1024 / dur, 3) if dur else 0.0,
+            "peak_rss_mb": round(peak_rss / 1024 / 1024, 1),
+        },
+        "stages": get_stage_breakdown(days=1),
+        "workdir": str(workdir),
+    }
+    if moto:
+        moto.stop()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""检索基准：百万/千万级合成向量下 text_chunks 的延迟、并发 QPS 与 recall@k
+
+按 text_chunks 表结构（models_loader.TEXT_SCHEMA）向本地 Lance 目录写入合成 512 维向量
+（高斯簇混合后归一化，比均匀随机更接近真实嵌入的分布），然后：
+1. 无索引暴力检索得到每个查询的真值 top-k，同时记为 flat 基线
+2. 依次构建各索引配置（IVF_PQ / IVF_HNSW_SQ 等），扫 nprobes / refine_factor
+3. 每个配置测串行 p50/p99 延迟、不同并发下的 QPS 与 p99、recall@k
+结果写 JSON，并按"recall 达标（--target-recall）中 p99 最低"给出推荐配置。
+
+同一 --rows/--seed 的数据表会复用，重复运行只重建索引。
+
+用法:
+    python benchmarks/bench_search.py --rows 1000000 --out search_1m.json
+    python benchmarks/bench_search.py --rows 10000000 --queries 500 --concurrency 1,8,32 --out search_10m.json
+    python benchmarks/bench_search.py --rows 200000 --configs flat,ivf_pq  # 快速试跑
+"""
+
+import sys
+import json
+import math
+import time
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import numpy as np
+import pyarrow as pa
+import lancedb
+
+from models_loader import TEXT_SCHEMA
+
+DIM = TEXT_SCHEMA.field("vector").type.list_size
+WRITE_BATCH = 100_000
+DOC_TYPES = ["pdf", "docx", "txt", "xlsx", "mp4", "mp3"]
+
+
+# ---------- 数据 ----------
+
+class ClusteredVectors:
+    """高斯簇混合：簇心单位向量 + 各向同性噪声，再归一化"""
+
+    def __init__(self, dim, n_clusters, spread, seed):
+        rng = np.random.default_rng(seed)
+        centers = rng.standard_normal((n_clusters, dim)).astype("float32")
+        self.centers = centers / np.linalg.norm(centers, axis=1, keepdims=True)
+        self.sigma = spread / math.sqrt(dim)
+
+    def sample(self, n, rng):
+        labels = rng.integers(len(self.centers), size=n)
+        x = self.centers[labels] + rng.standard_normal((n, self.centers.shape[1])).astype("float32") * self.sigma
+        return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def fill_table(db, name, rows, gen, seed):
+    if name in db.table_names():
+        tbl = db.open_table(name)
+        if tbl.count_rows() == rows:
+            print(f"复用已有数据表 {name}（{rows} 行）")
+            return tbl, 0.0
+        db.drop_table(name)
+    tbl = db.create_table(name, schema=TEXT_SCHEMA)
+    rng = np.random.default_rng(seed + 1)
+    t0 = time.perf_counter()
+    for start in range(0, rows, WRITE_BATCH):
+        n = min(WRITE_BATCH, rows - start)
+        vecs = gen.sample(n, rng)
+        ids = [f"c{start + i}" for i in range(n)]
+        file_ids = [f"{(start + i) // 40:032x}" for i in range(n)]  # 每个文件约 40 个切片
+        batch = pa.table({
+            "id": ids,
+            "vector": pa.FixedSizeListArray.from_arrays(pa.array(vecs.reshape(-1), pa.float32()), vecs.shape[1]),
+            "text": [f"synthetic chunk {start + i}" for i in range(n)],
+            "source_uri": [f"s3://bench/raw/{f}" for f in file_ids],
+            "doc_name": [f"doc_{f[-8:]}" for f in file_ids],
+            "doc_type": [DOC_TYPES[(start + i) // 40 % len(DOC_TYPES)] for i in range(n)],
+            "file_hash": file_ids,
+            "meta_info": [""] * n,
+        }, schema=TEXT_SCHEMA)
+        tbl.add(batch)
+        print(f"  写入 {start + n}/{rows}", end="\r", flush=True)
+    print()
+    return tbl, time.perf_counter() - t0
+
+
+# ---------- 测量 ----------
+
+def _percentile(vals, q):
+    s = sorted(vals)
+    k = (len(s) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def run_query(tbl, vec, k, params, metric, flat=False):
+    q = tbl.search(vec).metric(metric).limit(k).select(["id"])
+    if flat and hasattr(q, "bypass_vector_index"):
+        q = q.bypass_vector_index()
+    if params.get("nprobes"):
+        q = q.nprobes(params["nprobes"])
+    if params.get("refine_factor"):
+        q = q.refine_factor(params["refine_factor"])
+    if params.get("ef") and hasattr(q, "ef"):
+        q = q.ef(params["ef"])
+    return q.to_arrow()["id"].to_pylist()
+
+
+def measure(tbl, queries, k, params, metric, concurrency, truth=None, flat=False):
+    # 预热：打开索引文件、填充页缓存
+    for v in queries[: min(10, len(queries))]:
+        run_query(tbl, v, k, params, metric, flat)
+
+    lat, results = [], []
+    for v in queries:
+        t0 = time.perf_counter()
+        results.append(run_query(tbl, v, k, params, metric, flat))
+        lat.append((time.perf_counter() - t0) * 1000)
+    out = {
+        "p50_ms": round(_percentile(lat, 0.5), 3),
+        "p99_ms": round(_percentile(lat, 0.99), 3),
+        "mean_ms": round(statistics.fmean(lat), 3),
+    }
+    if truth is not None:
+        out[f"recall@{k}"] = round(
+            statistics.fmean(len(set(r) & set(t)) / max(len(t), 1) for r, t in zip(results, truth)), 4)
+
+    out["concurrency"] = {}
+    for c in concurrency:
+        def timed(v):
+            t0 = time.perf_counter()
+            run_query(tbl, v, k, params, metric, flat)
+            return (time.perf_counter() - t0) * 1000
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=c) as ex:
+            clat = list(ex.map(timed, queries))
+        elapsed = time.perf_counter() - t0
+        out["concurrency"][str(c)] = {"qps": round(len(queries) / elapsed, 1),
+                                      "p99_ms": round(_percentile(clat, 0.99), 3)}
+    return out, results
+
+
+def index_configs(rows, dim, names):
+    """待测索引配置：(名称, create_index 参数, 查询参数列表)"""
+    parts = max(1, min(4096, int(math.sqrt(rows))))
+    configs = {
+        "ivf_pq": ("IVF_PQ", {"num_partitions": parts, "num_sub_vectors": dim // 8},
+                   [{"nprobes": n, "refine_factor": r} for n in (10, 20, 50) for r in (None, 10)]),
+        "ivf_pq_fine": ("IVF_PQ", {"num_partitions": parts, "num_sub_vectors": dim // 4},
+                        [{"nprobes": n, "refine_factor": r} for n in (20, 50) for r in (None, 10)]),
+        "ivf_hnsw_sq": ("IVF_HNSW_SQ", {"num_partitions": max(1, parts // 16)},
+                        [{"nprobes": n, "ef": ef} for n in (5, 10) for ef in (64, 200)]),
+    }
+    return [(n, *configs[n]) for n in names if n in configs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="text_chunks 检索延迟 / QPS / recall 基准")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--clusters", type=int, default=1024, help="合成数据的簇数")
+    parser.add_argument("--spread", type=float, default=0.7, help="簇内噪声相对簇心的幅度")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--metric", default="l2", choices=["l2", "cosine", "dot"])
+    parser.add_argument("--concurrency", default="1,8,32", help="并发线程数列表，逗号分隔")
+    parser.add_argument("--configs", default="flat,ivf_pq,ivf_pq_fine,ivf_hnsw_sq",
+                        help="待测配置：flat, ivf_pq, ivf_pq_fine, ivf_hnsw_sq")
+    parser.add_argument("--target-recall", type=float, default=0.95, help="推荐配置要求的最低 recall")
+    parser.add_argument("--workdir", default=str(Path(tempfile.gettempdir()) / "bench_search"))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="JSON 结果输出路径")
+    args = parser.parse_args()
+
+    names = [c.strip() for c in args.configs.split(",") if c.strip()]
+    concurrency = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    db = lancedb.connect(args.workdir)
+    gen = ClusteredVectors(DIM, args.clusters, args.spread, args.seed)
+    tbl, fill_sec = fill_table(db, f"bench_{args.rows}_{DIM}_s{args.seed}", args.rows, gen, args.seed)
+    queries = gen.sample(args.queries, np.random.default_rng(args.seed + 2))
+
+    report = {
+        "rows": args.rows, "dim": DIM, "k": args.k, "metric": args.metric,
+        "queries": args.queries, "clusters": args.clusters, "fill_sec": round(fill_sec, 1),
+        "lancedb": getattr(lancedb, "__version__", None), "runs": [],
+    }
+
+    # 真值：暴力检索（bypass_vector_index 跳过复用表上残留的索引）
+    print("计算暴力检索真值 ...")
+    t0 = time.perf_counter()
+    truth = [run_query(tbl, v, args.k, {}, args.metric, flat=True) for v in queries]
+    print(f"  完成，用时 {time.perf_counter() - t0:.1f}s")
+    if "flat" in names:
+        stats, _ = measure(tbl, queries, args.k, {}, args.metric, concurrency, truth, flat=True)
+        report["runs"].append({"config": "flat", "index": None, "params": {}, "build_sec": 0.0, **stats})
+        print(f"flat: p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms")
+
+    for name, index_type, index_kwargs, param_grid in index_configs(args.rows, DIM, names):
+        print(f"构建索引 {name}（{index_type} {index_kwargs}）...")
+        t0 = time.perf_counter()
+        try:
+            tbl.create_index(metric=args.metric, vector_column_name="vector", index_type=index_type,
+                             replace=True, **index_kwargs)
+        except Exception as e:
+            print(f"  跳过：{e}")
+            report["runs"].append({"config": name, "index": index_type, "params": index_kwargs, "error": str(e)})
+            continue
+        build_sec = time.perf_counter() - t0
+        print(f"  用时 {build_sec:.1f}s")
+        for params in param_grid:
+            params = {k: v for k, v in params.items() if v}
+            stats, _ = measure(tbl, queries, args.k, params, args.metric, concurrency, truth)
+            report["runs"].append({"config": name, "index": index_type, "index_params": index_kwargs,
+                                   "params": params, "build_sec": round(build_sec, 1), **stats})
+            print(f"  {params}: p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms "
+                  f"recall@{args.k}={stats[f'recall@{args.k}']}")
+
+    ok = [r for r in report["runs"] if r.get(f"recall@{args.k}", 0) >= args.target_recall]
+    best = min(ok, key=lambda r: r["p99_ms"]) if ok else None
+    report["recommended"] = (
+        {"config": best["config"], "index_params": best.get("index_params"), "params": best["params"],
+         "p99_ms": best["p99_ms"], f"recall@{args.k}": best[f"recall@{args.k}"]} if best else None
+    )
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
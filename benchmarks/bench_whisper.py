@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""语音转录后端对比：openai-whisper（float32）与 faster-whisper（int8）的一致性与实时率
+
+对 --clips 目录下的样例音视频逐个转录，报告：
+- RTF（real-time factor）= 转录耗时 / 音频时长，越小越快；含解码，与入库时的实际开销一致
+- 一致性：各后端转录结果相对基准后端（--backends 中的第一个）的字错误率 CER；
+  若样例旁有同名 .txt 参考文本，另报告相对参考文本的 CER
+CER 按去除标点、空白并小写后的字符计算（中英文混合语料比 WER 更稳定）。
+任一后端相对基准的平均 CER 超过 --max-cer 时以非零状态退出，可作为切换后端前的一致性检查。
+
+用法:
+    python benchmarks/bench_whisper.py --clips samples/audio --out whisper.json
+    python benchmarks/bench_whisper.py --clips samples/audio --backends openai,faster --size small --max-cer 0.08
+"""
+
+import sys
+import json
+import time
+import argparse
+import statistics
+import unicodedata
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from models_loader import load_transcriber
+
+AUDIO_EXTS = {".mp3", ".wav", ".m4a", ".flac", ".ogg", ".mp4", ".avi", ".mov", ".mkv", ".webm"}
+SAMPLE_RATE = 16000
+
+
+def _normalize(text):
+    return "".join(c for c in unicodedata.normalize("NFKC", text or "").lower()
+                   if not unicodedata.category(c).startswith(("P", "Z", "C", "S")))
+
+
+def cer(hyp, ref):
+    """字错误率：编辑距离 / 参考长度"""
+    h, r = _normalize(hyp), _normalize(ref)
+    if not r:
+        return 0.0 if not h else 1.0
+    prev = list(range(len(h) + 1))
+    for i, rc in enumerate(r, 1):
+        cur = [i] + [0] * len(h)
+        for j, hc in enumerate(h, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (rc != hc))
+        prev = cur
+    return prev[-1] / len(r)
+
+
+def audio_duration(path):
+    """解码为 16kHz 单声道后的时长（秒）"""
+    try:
+        from whisper.audio import load_audio
+    except ImportError:
+        from faster_whisper import decode_audio as load_audio
+    return len(load_audio(str(path))) / SAMPLE_RATE
+
+
+def run_backend(backend, size, clips):
+    t0 = time.perf_counter()
+    model = load_transcriber(backend, size)
+    load_sec = time.perf_counter() - t0
+    if model.backend != backend:
+        raise RuntimeError(f"后端 {backend} 不可用（已回退为 {model.backend}）")
+    model.transcribe(str(clips[0][0]))  # 预热：首次调用含算子初始化
+    out = []
+    for path, dur in clips:
+        t0 = time.perf_counter()
+        text = model.transcribe(str(path)).get("text", "")
+        secs = time.perf_counter() - t0
+        out.append({"clip": path.name, "duration_sec": round(dur, 2), "secs": round(secs, 3),
+                    "rtf": round(secs / dur, 4) if dur else None, "text": text.strip()})
+        print(f"  {path.name}: {secs:.2f}s / {dur:.1f}s 音频，RTF={out[-1]['rtf']}")
+    return load_sec, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Whisper 转录后端一致性与实时率对比")
+    parser.add_argument("--clips", required=True, help="样例音视频目录（可放同名 .txt 作为参考文本）")
+    parser.add_argument("--backends", default="openai,faster", help="逗号分隔，第一个作为一致性基准")
+    parser.add_argument("--size", default=None, help="模型规格，缺省取 WHISPER_MODEL_SIZE")
+    parser.add_argument("--max-cer", type=float, default=0.1, help="相对基准的平均 CER 上限")
+    parser.add_argument("--out", help="JSON 结果输出路径")
+    args = parser.parse_args()
+
+    clip_paths = sorted(p for p in Path(args.clips).iterdir() if p.suffix.lower() in AUDIO_EXTS)
+    if not clip_paths:
+        parser.error(f"{args.clips} 下没有音视频文件")
+    clips = [(p, audio_duration(p)) for p in clip_paths]
+    refs = {p.name: p.with_suffix(".txt").read_text(encoding="utf-8")
+            for p, _ in clips if p.with_suffix(".txt").exists()}
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+
+    report = {"clips": len(clips), "audio_sec": round(sum(d for _, d in clips), 1), "size": args.size,
+              "backends": {}}
+    for backend in backends:
+        print(f"后端 {backend} ...")
+        load_sec, results = run_backend(backend, args.size, clips)
+        total = sum(r["secs"] for r in results)
+        entry = {"load_sec": round(load_sec, 2), "total_sec": round(total, 2),
+                 "rtf": round(total / report["audio_sec"], 4) if report["audio_sec"] else None,
+                 "rtf_p50": round(statistics.median(r["rtf"] for r in results if r["rtf"] is not None), 4),
+                 "clips": results}
+        if refs:
+            entry["cer_vs_reference"] = round(statistics.fmean(
+                cer(r["text"], refs[r["clip"]]) for r in results if r["clip"] in refs), 4)
+        report["backends"][backend] = entry
+
+    base = backends[0]
+    failed = []
+    for backend in backends[1:]:
+        pairs = zip(report["backends"][backend]["clips"], report["backends"][base]["clips"])
+        per_clip = [cer(a["text"], b["text"]) for a, b in pairs]
+        entry = report["backends"][backend]
+        entry[f"cer_vs_{base}"] = round(statistics.fmean(per_clip), 4)
+        entry[f"cer_vs_{base}_max"] = round(max(per_clip), 4)
+        entry["speedup"] = round(report["backends"][base]["total_sec"] / entry["total_sec"], 2) if entry["total_sec"] else None
+        if entry[f"cer_vs_{base}"] > args.max_cer:
+            failed.append(backend)
+    report["parity_ok"] = not failed
+
+    summary = {b: {k: v for k, v in e.items() if k != "clips"} for b, e in report["backends"].items()}
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    if failed:
+        print(f"一致性检查未通过（平均 CER > {args.max_cer}）: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
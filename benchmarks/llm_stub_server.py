@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""本地 LLM 桩服务：模拟 OpenAI 兼容的 /v1/chat/completions，用于实体抽取的联调与压测
+
+按规则（英文大写词、引号内短语）从文本中"抽取"实体，结果可复现；
+可配置延迟与故障率（随机返回 429/503），验证并发、长连接复用与退避重试。
+
+用法:
+    python benchmarks/llm_stub_server.py --port 8765 --latency 0.5 --fail-rate 0.1
+    DEEPSEEK_BASE_URL=http://127.0.0.1:8765 DEEPSEEK_API_KEY=stub python app_nicegui.py
+"""
+
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_DOC_RE = re.compile(r"\[\[DOC (\d+)\]\]\n")
+_WORD_RE = re.compile(r"\b[A-Z][A-Za-z0-9_]{2,}\b")
+_QUOTE_RE = re.compile(r"[“「《]([^”」》]{2,20})[”」》]")
+
+_stats = {"requests": 0, "failed": 0, "connections": 0}
+_stats_lock = threading.Lock()
+
+
+def _entities(text):
+    seen = {}
+    for m in _WORD_RE.findall(text):
+        seen.setdefault(m, "TERM")
+    for m in _QUOTE_RE.findall(text):
+        seen.setdefault(m, "NAME")
+    return [{"name": n, "type": t} for n, t in list(seen.items())[:20]]
+
+
+def _answer(prompt):
+    parts = _DOC_RE.split(prompt)
+    if len(parts) > 1:
+        # 多文档提示：parts = [头, 编号, 正文, 编号, 正文, ...]
+        docs = dict(zip(parts[1::2], parts[2::2]))
+        return json.dumps({k: _entities(v) for k, v in docs.items()}, ensure_ascii=False)
+    return json.dumps(_entities(prompt.split("文本：", 1)[-1]), ensure_ascii=False)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持 keep-alive
+    latency = 0.0
+    fail_rate = 0.0
+
+    def setup(self):
+        super().setup()
+        with _stats_lock:
+            _stats["connections"] += 1
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with _stats_lock:
+                self._send(200, dict(_stats))
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        with _stats_lock:
+            _stats["requests"] += 1
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send(404, {"error": "not found"})
+            return
+        if self.latency:
+            time.sleep(self.latency * random.uniform(0.5, 1.5))
+        if random.random() < self.fail_rate:
+            with _stats_lock:
+                _stats["failed"] += 1
+            status = random.choice([429, 503])
+            self._send(status, {"error": "stub failure"}, {"Retry-After": "0.2"} if status == 429 else None)
+            return
+        prompt = payload.get("messages", [{}])[-1].get("content", "")
+        self._send(200, {
+            "id": "stub",
+            "object": "chat.completion",
+            "model": payload.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": _answer(prompt)}}],
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 LLM 桩服务（实体抽取联调）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="平均响应延迟（秒）")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="随机返回 429/503 的比例")
+    args = parser.parse_args()
+
+    Handler.latency = args.latency
+    Handler.fail_rate = args.fail_rate
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"LLM stub listening on http://{args.host}:{args.port}  (GET /stats 查看请求/连接计数)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -11,7 +11,10 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 LANCE_DB_URI = None  # 运行时由下方根据 S3_CONFIG 自动生成
 TEMP_DIR = os.path.join(BASE_DIR, "temp_uploads")
 EXTRACT_DIR = os.path.join(BASE_DIR, "temp_extracted")
-DB_PATH = os.path.join(BASE_DIR, "user_data.db")
+# 以下两个路径可用同名环境变量覆盖（基准/测试时指向隔离目录）
+DB_PATH = os.getenv("DB_PATH", os.path.join(BASE_DIR, "user_data.db"))
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", os.path.join(BASE_DIR, "embed_cache.db"))
+FAILED_DIR = os.path.join(BASE_DIR, "failed_uploads")  # 入库失败文件的保留目录（待重试/死信）
 LOG_PATH = os.path.join(BASE_DIR, "app.log")
 
 # --- S3 ---
@@ -44,27 +47,188 @@ if "lance_bucket" not in S3_CONFIG:
     # 默认：如果没显式给第二个桶，就用 bucket_name 派生一个（避免和原文件混在一起）
     S3_CONFIG["lance_bucket"] = (f"{base_bucket}-lance" if base_bucket else "demo-lance")
 
-# 默认使用方式B：把 LanceDB 表存在 SeaweedFS(S3) 上
-LANCE_DB_URI = f"s3://{S3_CONFIG['lance_bucket']}/{S3_CONFIG.get('lance_prefix','lance_lake')}"
+# 共享客户端与分片上传参数（s3_utils.get_s3_client / S3_TRANSFER_CONFIG）
+S3_MAX_POOL_CONNECTIONS = 32  # 连接池大小，需不小于同时上传的线程数 × 分片并发
+S3_MAX_RETRIES = 5  # botocore adaptive 重试次数
+S3_MULTIPART_THRESHOLD_MB = 16  # 超过该大小走分片上传
+S3_MULTIPART_PART_MB = 8  # 分片大小，S3 要求除最后一片外不小于 5MB
+S3_TRANSFER_CONCURRENCY = 8  # 单个文件分片上传并发数
+
+# 默认使用方式B：把 LanceDB 表存在 SeaweedFS(S3) 上；环境变量 LANCE_DB_URI 可改为本地目录（方式A）
+LANCE_DB_URI = os.getenv("LANCE_DB_URI") or f"s3://{S3_CONFIG['lance_bucket']}/{S3_CONFIG.get('lance_prefix','lance_lake')}"
 
 # --- LLM / 知识图谱 ---
 # 建议在环境变量中配置 DEEPSEEK_API_KEY；如需本地测试，可临时在此处填入测试密钥
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "sk-db6292d5ea9d470889b63392c4a4abde")
 DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
 DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+# 实体抽取在独立队列中异步执行，不阻塞入库线程
+ENTITY_WORKERS = int(os.getenv("ENTITY_WORKERS", "4"))  # 并发请求数（每个线程一条长连接）
+ENTITY_QUEUE_MAX = 10_000  # 待抽取队列上限，满时丢弃新任务并告警
+ENTITY_SNIPPET_CHARS = 3000  # 每篇文档送入 LLM 的前缀字符数
+ENTITY_BATCH_DOCS = int(os.getenv("ENTITY_BATCH_DOCS", "1"))  # >1 时把多篇短文档合并到一次请求
+ENTITY_BATCH_WAIT = 0.5  # 合并请求时等待凑批的最长秒数
+ENTITY_TIMEOUT = 30  # 单次请求超时（秒）
+ENTITY_MAX_RETRIES = 3  # 429/5xx/网络错误的重试次数
+ENTITY_BACKOFF_BASE = 1.0  # 指数退避基数（秒）
+ENTITY_BACKOFF_MAX = 30.0
 
 # --- 文本分块 ---
 CHUNK_SIZE = 500
 CHUNK_OVERLAP = 50
+# 分块计长方式：char=按字符（CHUNK_SIZE/CHUNK_OVERLAP）；
+# token=按文本模型分词器计 token，切片填满模型序列上限（max_seq_length 减去 [CLS]/[SEP]）而不截断
+CHUNK_MODE = os.getenv("CHUNK_MODE", "char")
+CHUNK_TOKEN_OVERLAP = 32
+TOKEN_LENGTH_CACHE_SIZE = 200_000  # 分词长度缓存条数（切分时同一片段会被反复计长；只缓存不超过 8×chunk_size 字符的片段）
+
+# --- 向量化写入 ---
+EMBED_BATCH_SIZE = 64  # 每次送入文本模型 encode 的切片数
+TEXT_WRITE_BATCH = 1024  # text_chunks 表每次 add 的行数（边解析边写入）
+TEXT_FULL_MAX_CHARS = 2_000_000  # files 表 text_full 最多保留的字符数，避免超大文档全文驻留内存
+TEXT_READ_BLOCK_CHARS = 64 * 1024  # 纯文本/日志按块流式读取的块大小（字符）
+EMBED_CACHE_ENABLED = True  # 切片向量缓存：相同切片（页眉、免责声明、重复日志行）只编码一次
+EMBED_CACHE_MAX_ENTRIES = 2_000_000  # 缓存条数上限（512 维约 2KB/条），超出按 LRU 淘汰
+
+# --- PDF 解析 ---
+PDF_PARALLEL_MIN_PAGES = 50  # 页数达到该值才启用多进程按页并行提取
+PDF_PAGES_PER_TASK = 25  # 每个子进程任务处理的页数
+PDF_EXTRACT_WORKERS = max(1, min(4, (os.cpu_count() or 1) - 1))
+# PDF 页面渲染（供 CLIP 图像向量化）：CLIP 输入仅 224px，72 DPI 已足够
+PDF_RENDER_DPI = 72
+PDF_RENDER_BATCH = 8  # 每批渲染/编码的页数，内存中最多同时保留一批页面图像
+PDF_RENDER_THREADS = 2  # pdf2image thread_count
+PDF_RENDER_MAX_PAGES = 200  # 每份 PDF 最多渲染的页数，0 表示不限
+PDF_RENDER_SAMPLING = "uniform"  # 超过上限时的取页策略：head=取前 N 页，uniform=全文均匀抽样
+
+# --- 语音转录（models_loader.load_transcriber）---
+# openai：openai-whisper，PyTorch float32；faster：faster-whisper（CTranslate2），CPU 上 int8 量化，速度快数倍
+WHISPER_BACKEND = os.getenv("WHISPER_BACKEND", "openai")
+WHISPER_MODEL_SIZE = os.getenv("WHISPER_MODEL_SIZE", "base")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")  # 仅 faster 后端：int8 / int8_float32 / float32
+WHISPER_CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", "0"))  # 仅 faster 后端，0 表示由 CTranslate2 自行决定
+WHISPER_BEAM_SIZE = 5  # faster 后端的束搜索宽度，与 openai-whisper 默认解码（温度回退 + best_of 5）质量相当
+# 长音频：ffmpeg 流式解码 → 能量 VAD 切出语音段（跳过静音）→ 多进程并行转录 → 按段顺序交给切片/向量化
+AUDIO_SAMPLE_RATE = 16000
+AUDIO_READ_BLOCK_SEC = 30  # 每次从 ffmpeg 读取的音频时长
+AUDIO_VAD_FRAME_MS = 30
+AUDIO_VAD_MIN_DB = -50  # 低于该能量（dBFS）的帧一律视为静音
+AUDIO_VAD_MARGIN_DB = 12  # 高出估计底噪多少 dB 的帧视为语音
+AUDIO_VAD_MIN_SILENCE_SEC = 0.6  # 静音持续超过该时长才切段
+AUDIO_VAD_MIN_SPEECH_SEC = 0.3  # 语音帧累计不足该时长的段丢弃（咔哒声、短噪声）
+AUDIO_VAD_PAD_SEC = 0.2  # 段首尾保留的余量，避免切掉弱起音/尾音
+AUDIO_SEGMENT_MAX_SEC = 30  # 单段上限（Whisper 单窗口 30s），超出时在段尾能量最低处切开
+AUDIO_TRANSCRIBE_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 4))  # 转录进程数，每个进程各加载一份模型；1 表示在当前进程顺序转录
+AUDIO_WORKER_MEM_MB = 1024  # 每个转录进程的常驻内存（模型 + 运行时），从入库内存预算中预先扣除
+
+# --- 表格解析（csv/xlsx/xls/parquet）---
+TABLE_READ_ROWS = 5000  # 每次从文件读取的行数，内存只保留这一批
+
+# --- 压缩包（流式读取成员，不解压落盘）---
+ARCHIVE_WORKERS = 3  # 单个压缩包内成员并行处理数
+ARCHIVE_MAX_DEPTH = 3  # 嵌套压缩包最大层数
+ARCHIVE_MAX_MEMBERS = 10000  # 单个压缩包最多处理的成员数
+ARCHIVE_MAX_TOTAL_MB = 4096  # 单个压缩包解压后总大小上限（防压缩炸弹）
+# 成员不超过该大小时直接在内存中处理，更大的写入 TEMP_DIR 临时文件、处理完即删。
+# 这是有意保留的限制：tar 流式读取时成员句柄在读下一个成员后即失效，无法与后续成员并行处理；
+# 入库管道对同一文件要读多遍（hash、上传、files 表、解析），PDF 渲染与 Whisper 只接受文件路径。
+# 临时文件总量受 ARCHIVE_MAX_TOTAL_MB 与在途成员数（ARCHIVE_WORKERS * 2）约束
+ARCHIVE_INMEMORY_MAX_MB = 64
+
+# --- SFTP 增量同步 ---
+SFTP_CONNECTIONS = 4  # 并行下载的 SFTP 连接数（每个连接独立 Transport）
+SFTP_MAX_PENDING = 8  # 已下载待入库的文件数上限，控制内存/临时目录占用
+SFTP_SKIP_HIDDEN = True  # 跳过以 . 开头的文件和目录
+SFTP_INMEMORY_MAX_MB = 64  # 不超过该大小的文件边读边留在内存中直接入库，更大的或音视频才落盘
+SFTP_READ_CHUNK = 1024 * 1024  # 远端文件读取块大小（配合 prefetch 流水线预取）
+
+# --- S3 桶/前缀同步 ---
+S3_SYNC_WORKERS = 8  # 同时提交给入库调度器、尚未完成的对象数上限
+S3_SYNC_PAGE_SIZE = 1000  # list_objects_v2 每页条数（每页处理完写一次断点）
+S3_SYNC_INMEMORY_MAX_MB = 64  # 不超过该大小的对象直接读入内存入库，更大的下载到临时文件
+
+# --- 目录监听入库（watcher.py）---
+WATCH_DIR = os.getenv("WATCH_DIR", "")  # 监听的共享目录，为空不启用
+WATCH_DEBOUNCE_SEC = 3.0  # 文件大小/mtime 持续不变这么久才视为写完
+WATCH_POLL_INTERVAL = 2.0  # 无 inotify 时的轮询间隔，也是去抖检查周期（秒）
+WATCH_BATCH_MAX = 50  # 每批最多文件数
+WATCH_BATCH_WAIT = 2.0  # 首个文件就绪后最多再等这么久凑批（秒）
+WATCH_MAX_INFLIGHT_BATCHES = 4  # 同时在后台处理的批次上限，达到后新就绪文件先排队（事件照常读取）
+WATCH_RESCAN_INTERVAL = 600  # inotify 模式下的兜底全量扫描周期（秒），补上事件队列溢出等漏掉的文件
+WATCH_IGNORE_SUFFIXES = (".part", ".tmp", ".crdownload", ".swp", "~")  # 写入中的临时文件
+
+# --- 失败重试与死信 ---
+INGEST_MAX_RETRIES = 5  # 瞬时错误最多自动重试次数，超过转入死信
+INGEST_RETRY_BASE_SEC = 30  # 指数退避基数：30s, 60s, 120s, ...
+INGEST_RETRY_MAX_SEC = 3600
+INGEST_RETRY_INTERVAL = 15  # 后台重试线程的检查周期（秒）
+INGEST_TEMP_MAX_AGE_SEC = 24 * 3600  # TEMP_DIR 中超过此时长的残留文件视为孤儿并清理
+INGEST_LEASE_SEC = 120  # 续跑批次/重试失败记录的认领租约，持有进程每 1/3 周期续租，崩溃后过期由其他进程接手
+
+# --- 入库调度：内存预算准入（scheduler.py）---
+INGEST_WORKERS = 3  # 批量入库初始并发；启用自适应时由控制器在 [MIN, MAX] 内调整
+INGEST_MEM_BUDGET_MB = int(os.getenv("INGEST_MEM_BUDGET_MB", "0"))  # 入库可用内存，0 表示物理内存的一半；扣除转录进程池常驻内存后为同时在处理文件的预估内存上限
+INGEST_MEM_MAX_OVERTAKE = 20  # 队首大文件等内存时最多被后面的小文件插队几次，之后停止插队、为它预留内存
+# 单文件内存估算：固定开销(MB) + 文件大小 × 系数；另加整文件读入 files 表的字节（不超过 MAX_FILE_SIZE_MB 时）
+INGEST_MEM_BASE_MB = 64
+INGEST_MEM_FIXED_MB = {"audio": 1024, "video": 1024, "pdf": 256, "archive": 512}  # Whisper 工作集 / 页面渲染批 / 并行成员
+INGEST_MEM_FACTORS = {
+    "audio": 0.5,  # 流式解码 + VAD 分段，只驻留当前段与在途段的 PCM
+    "video": 0.05,  # 只取音轨
+    "pdf": 2.0,
+    "office": 8.0,  # docx/pptx/xlsx 为 zip 压缩的 XML，整体解析
+    "image": 12.0,  # 压缩图片解码为 RGB 位图
+    "table": 0.5,  # csv/parquet 按行块流式读取
+    "text": 0.0,  # 纯文本按块流式读取
+    "archive": 0.0,
+}
+
+# --- 入库自适应并发（scheduler.ConcurrencyController）---
+# 按周期观察各环节的排队数、吞吐与 CPU/内存占用，逐步加减文件级并发和各阶段并发（爬山法），决策可经 /api/ingest/concurrency 查看
+INGEST_ADAPTIVE = os.getenv("INGEST_ADAPTIVE", "1") == "1"
+INGEST_ADAPT_INTERVAL = 10  # 调整周期（秒）
+INGEST_WORKERS_MIN = 1
+INGEST_WORKERS_MAX = int(os.getenv("INGEST_WORKERS_MAX", str(max(4, os.cpu_count() or 1))))
+INGEST_CPU_HIGH = 90  # CPU 占用（%）达到此值时收缩 CPU 密集阶段
+INGEST_MEM_HIGH = 85  # 内存占用（%）达到此值时收缩文件级并发
+INGEST_ADAPT_TOLERANCE = 0.1  # 加并发后吞吐下降超过该比例则回退
+# 各阶段并发 (下限, 初始, 上限)；未列出的阶段不限流
+_cpus = os.cpu_count() or 1
+INGEST_STAGE_LIMITS = {
+    "extract": (1, max(2, _cpus // 4), max(2, _cpus)),  # 文档解析，CPU 密集
+    "transcribe": (1, 1, max(1, _cpus // 16)),  # 同一 Whisper 实例，内部已多线程
+    "embed": (1, 2, max(2, _cpus // 8)),  # 文本向量化，torch 算子内部已多线程
+    "image_embed": (1, 2, max(2, _cpus // 8)),
+    "store": (1, 4, 16),  # LanceDB files 表写入（含原始文件字节）
+    "commit": (1, 4, 16),  # LanceDB text/image 切片表追加
+}
+INGEST_CPU_STAGES = {"extract", "transcribe", "embed", "image_embed"}
+
+# --- 入库优先级通道（scheduler.IngestScheduler）---
+INGEST_LANES = {"interactive": 6, "bulk": 3, "backfill": 1}  # 通道 -> 加权公平调度权重
+INGEST_DEFAULT_LANE = "bulk"
+INGEST_SOURCE_LANES = {"upload": "interactive", "watch": "bulk", "sftp": "bulk", "s3": "bulk", "retry": "backfill"}
+INGEST_INTERACTIVE_RESERVED = 0.25  # 文件级并发中只留给 interactive 的比例（至少 1 个，单并发时不预留）
+
+# --- 近重复文档检测（MinHash-LSH）---
+NEAR_DUP_ENABLED = True
+NEAR_DUP_THRESHOLD = 0.85  # 估计 Jaccard 相似度达到该值视为近重复（向量复用走切片向量缓存，不再整篇预加载）
+NEAR_DUP_NUM_PERM = 128  # MinHash 置换数
+NEAR_DUP_BANDS = 32  # LSH 分桶数（每桶 NUM_PERM / BANDS 行）
+NEAR_DUP_SHINGLE = 5  # 字符 n-gram 长度
+NEAR_DUP_SAMPLE_CHARS = 200_000  # 参与签名的文本前缀长度（入库前需预读的上限）
 
 # --- 文件大小限制 ---
 MAX_FILE_SIZE_MB = 100  # 单个文件最大 100MB（超过此大小不存储到 files 表）
 MAX_UPLOAD_SIZE_MB = 500  # 单次上传总大小限制
 
 # --- 支持格式 ---
+AUDIO_EXTS = ["mp3", "wav", "m4a", "flac", "ogg"]
+VIDEO_EXTS = ["mp4", "webm", "mov", "avi", "mkv"]
+MEDIA_EXTS = AUDIO_EXTS + VIDEO_EXTS  # 走语音转录（ffmpeg 解码），只接受文件路径
 CONTENT_EXTS = [
     "txt", "md", "docx", "pdf", "pptx", "log", "csv", "xlsx", "xls",
-    "py", "sh", "js", "json", "sql", "mp3", "wav", "mp4", "avi", "mov", "m4a",
-]
+    "py", "sh", "js", "json", "sql", "parquet",
+] + MEDIA_EXTS
 IMAGE_EXTS = ["jpg", "jpeg", "png", "gif", "bmp", "webp"]
 ARCHIVE_EXTS = ["zip", "tar", "gz", "tgz"]
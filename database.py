@@ -12,6 +12,14 @@ def _ensure_dir():
     Path(DB_PATH).parent.mkdir(parents=True, exist_ok=True)
 
 
+def _ensure_columns(c, table, columns):
+    """旧库补列：columns 为 {列名: 类型定义}，已存在的列跳过"""
+    existing = {r[1] for r in c.execute(f"PRAGMA table_info({table})").fetchall()}
+    for name, ddl in columns.items():
+        if name not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+
+
 def init_db():
     _ensure_dir()
     conn = sqlite3.connect(DB_PATH, check_same_thread=False)
@@ -36,6 +44,12 @@ def init_db():
            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )"""
     )
+    _ensure_columns(c, "task_stats", {
+        "embed_cache_hits": "INTEGER DEFAULT 0",
+        "embed_cache_misses": "INTEGER DEFAULT 0",
+        "upload_bytes": "INTEGER DEFAULT 0",
+        "upload_secs": "REAL DEFAULT 0",
+    })
     c.execute(
         """CREATE TABLE IF NOT EXISTS file_entities (
            id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -45,6 +59,135 @@ def init_db():
            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )"""
     )
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS entity_cache (
+           text_hash TEXT PRIMARY KEY,
+           entities TEXT NOT NULL,
+           created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS sftp_manifest (
+           source TEXT NOT NULL,
+           remote_path TEXT NOT NULL,
+           size INTEGER,
+           mtime INTEGER,
+           file_hash TEXT,
+           synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+           PRIMARY KEY (source, remote_path)
+        )"""
+    )
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS s3_sync_manifest (
+           source TEXT NOT NULL,
+           object_key TEXT NOT NULL,
+           etag TEXT,
+           size INTEGER,
+           file_hash TEXT,
+           synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+           PRIMARY KEY (source, object_key)
+        )"""
+    )
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS s3_sync_checkpoint (
+           source TEXT PRIMARY KEY,
+           start_after TEXT,
+           updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS watch_state (
+           path TEXT PRIMARY KEY,
+           size INTEGER,
+           mtime REAL,
+           file_hash TEXT,
+           processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS ingest_failures (
+           id INTEGER PRIMARY KEY AUTOINCREMENT,
+           local_path TEXT,
+           original_filename TEXT NOT NULL,
+           source TEXT,
+           error_class TEXT,
+           error_type TEXT,
+           error_msg TEXT,
+           attempts INTEGER DEFAULT 1,
+           status TEXT DEFAULT 'retrying',
+           next_retry_at REAL,
+           created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+           updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+    _ensure_columns(c, "ingest_failures", {"owner": "TEXT", "lease_until": "REAL"})
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ingest_failures_due ON ingest_failures (status, next_retry_at)")
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS raw_object_index (
+           file_hash TEXT NOT NULL,
+           object_key TEXT NOT NULL,
+           marker_key TEXT NOT NULL,
+           created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+           PRIMARY KEY (file_hash, marker_key)
+        )"""
+    )
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS doc_minhash (
+           file_hash TEXT PRIMARY KEY,
+           signature BLOB NOT NULL,
+           created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS doc_minhash_bands (
+           band INTEGER NOT NULL,
+           bucket TEXT NOT NULL,
+           file_hash TEXT NOT NULL
+        )"""
+    )
+    c.execute("CREATE INDEX IF NOT EXISTS idx_minhash_bands ON doc_minhash_bands (band, bucket)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_minhash_bands_hash ON doc_minhash_bands (file_hash)")
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS ingest_jobs (
+           job_id TEXT PRIMARY KEY,
+           source TEXT,
+           total INTEGER,
+           status TEXT DEFAULT 'running',
+           created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+           updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+    _ensure_columns(c, "ingest_jobs", {"lane": "TEXT", "owner": "TEXT", "lease_until": "REAL"})
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS ingest_journal (
+           job_id TEXT NOT NULL,
+           local_path TEXT NOT NULL,
+           original_filename TEXT,
+           stage TEXT NOT NULL,
+           file_hash TEXT,
+           s3_uri TEXT,
+           error_msg TEXT,
+           updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+           PRIMARY KEY (job_id, local_path)
+        )"""
+    )
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS task_stage_stats (
+           id INTEGER PRIMARY KEY AUTOINCREMENT,
+           task_id INTEGER,
+           file_hash TEXT,
+           doc_type TEXT,
+           stage TEXT NOT NULL,
+           duration REAL,
+           bytes INTEGER DEFAULT 0,
+           rows INTEGER DEFAULT 0,
+           created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+    c.execute("CREATE INDEX IF NOT EXISTS idx_task_stage_stats_task ON task_stage_stats (task_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_task_stage_stats_time ON task_stage_stats (created_at)")
+    # WAL：入库线程并发写日志/统计时读者不被阻塞，且提交即落盘，崩溃后日志可用于续跑
+    c.execute("PRAGMA journal_mode=WAL")
     conn.commit()
     conn.close()
 
@@ -114,7 +257,8 @@ def get_task_stats(limit=50):
     try:
         conn = sqlite3.connect(DB_PATH)
         rows = conn.execute(
-            "SELECT id, user_id, task_type, file_count, success_count, processing_time, created_at "
+            "SELECT id, user_id, task_type, file_count, success_count, processing_time, created_at, "
+            "embed_cache_hits, embed_cache_misses, upload_bytes, upload_secs "
             "FROM task_stats ORDER BY id DESC LIMIT ?",
             (limit,),
         ).fetchall()
@@ -136,6 +280,8 @@ def delete_file_from_registry(file_hash):
         c = conn.cursor()
         c.execute("DELETE FROM file_registry WHERE file_hash=?", (file_hash,))
         c.execute("DELETE FROM file_entities WHERE file_hash=?", (file_hash,))
+        c.execute("DELETE FROM doc_minhash WHERE file_hash=?", (file_hash,))
+        c.execute("DELETE FROM doc_minhash_bands WHERE file_hash=?", (file_hash,))
         conn.commit()
         return True
     except Exception as e:
@@ -171,11 +317,13 @@ def get_file_entities(file_hash=None):
             conn.close()
 
 
-def insert_file_entities(file_hash, entities):
-    """批量插入实体。entities: list of (entity_name, entity_type)"""
+def insert_file_entities(file_hash, entities, replace=False):
+    """批量插入实体。entities: list of (entity_name, entity_type)；replace=True 时先清掉该文件的旧实体"""
     conn = None
     try:
         conn = sqlite3.connect(DB_PATH)
+        if replace:
+            conn.execute("DELETE FROM file_entities WHERE file_hash=?", (file_hash,))
         conn.executemany(
             "INSERT INTO file_entities (file_hash, entity_name, entity_type) VALUES (?, ?, ?)",
             [(file_hash, name, etype) for name, etype in entities],
@@ -189,18 +337,659 @@ def insert_file_entities(file_hash, entities):
             conn.close()
 
 
-def insert_task_stat(task_type, file_count, success_count, processing_time, user_id=0):
+def get_cached_entities(text_hashes):
+    """按文本哈希批量查实体抽取缓存，返回 {text_hash: entities_json}"""
+    if not text_hashes:
+        return {}
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        marks = ",".join("?" * len(text_hashes))
+        rows = conn.execute(
+            f"SELECT text_hash, entities FROM entity_cache WHERE text_hash IN ({marks})",
+            list(text_hashes),
+        ).fetchall()
+        return dict(rows)
+    except Exception as e:
+        import logging
+        logging.error(f"读取实体缓存失败: {e}")
+        return {}
+    finally:
+        if conn:
+            conn.close()
+
+
+def put_cached_entities(items):
+    """写入实体抽取缓存。items: list of (text_hash, entities_json)"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        conn.executemany(
+            "INSERT OR REPLACE INTO entity_cache (text_hash, entities) VALUES (?, ?)",
+            items,
+        )
+        conn.commit()
+    except Exception as e:
+        import logging
+        logging.error(f"写入实体缓存失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_sftp_manifest(source):
+    """读取某个 SFTP 源的同步清单，返回 {remote_path: (size, mtime)}"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        rows = conn.execute(
+            "SELECT remote_path, size, mtime FROM sftp_manifest WHERE source=?", (source,)
+        ).fetchall()
+        return {r[0]: (r[1], r[2]) for r in rows}
+    except Exception as e:
+        import logging
+        logging.error(f"读取 SFTP 同步清单失败: {e}")
+        return {}
+    finally:
+        if conn:
+            conn.close()
+
+
+def upsert_sftp_manifest(source, remote_path, size, mtime, file_hash=None):
     conn = None
     try:
         conn = sqlite3.connect(DB_PATH)
         conn.execute(
-            "INSERT INTO task_stats (user_id, task_type, file_count, success_count, processing_time) VALUES (?, ?, ?, ?, ?)",
-            (user_id, task_type, file_count, success_count, processing_time),
+            "INSERT OR REPLACE INTO sftp_manifest (source, remote_path, size, mtime, file_hash, synced_at) "
+            "VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)",
+            (source, remote_path, size, mtime, file_hash),
         )
         conn.commit()
+    except Exception as e:
+        import logging
+        logging.error(f"更新 SFTP 同步清单失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_s3_sync_etags(source, keys):
+    """批量读取已同步对象的 ETag，返回 {object_key: etag}"""
+    if not keys:
+        return {}
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        out = {}
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            marks = ",".join("?" * len(part))
+            out.update(conn.execute(
+                f"SELECT object_key, etag FROM s3_sync_manifest WHERE source=? AND object_key IN ({marks})",
+                [source] + part,
+            ).fetchall())
+        return out
+    except Exception as e:
+        import logging
+        logging.error(f"读取 S3 同步清单失败: {e}")
+        return {}
+    finally:
+        if conn:
+            conn.close()
+
+
+def upsert_s3_sync_manifest(source, object_key, etag, size, file_hash=None):
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute(
+            "INSERT OR REPLACE INTO s3_sync_manifest (source, object_key, etag, size, file_hash, synced_at) "
+            "VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)",
+            (source, object_key, etag, size, file_hash),
+        )
+        conn.commit()
+    except Exception as e:
+        import logging
+        logging.error(f"更新 S3 同步清单失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_s3_sync_checkpoint(source):
+    """上次未完成的列举断点（最后一个已处理完的 key），没有返回 None"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        row = conn.execute("SELECT start_after FROM s3_sync_checkpoint WHERE source=?", (source,)).fetchone()
+        return row[0] if row else None
+    except Exception as e:
+        import logging
+        logging.error(f"读取 S3 同步断点失败: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
+def set_s3_sync_checkpoint(source, start_after):
+    """写入断点；start_after 为 None 表示整轮列举完成，清除断点"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        if start_after is None:
+            conn.execute("DELETE FROM s3_sync_checkpoint WHERE source=?", (source,))
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO s3_sync_checkpoint (source, start_after, updated_at) "
+                "VALUES (?, ?, CURRENT_TIMESTAMP)",
+                (source, start_after),
+            )
+        conn.commit()
+    except Exception as e:
+        import logging
+        logging.error(f"写入 S3 同步断点失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_watch_state(root):
+    """读取监听目录下已处理文件的状态，返回 {path: (size, mtime, file_hash)}"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        rows = conn.execute(
+            "SELECT path, size, mtime, file_hash FROM watch_state WHERE substr(path, 1, ?) = ?",
+            (len(root), root),
+        ).fetchall()
+        return {r[0]: (r[1], r[2], r[3]) for r in rows}
+    except Exception as e:
+        import logging
+        logging.error(f"读取监听状态失败: {e}")
+        return {}
+    finally:
+        if conn:
+            conn.close()
+
+
+def upsert_watch_state(path, size, mtime, file_hash=None):
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute(
+            "INSERT OR REPLACE INTO watch_state (path, size, mtime, file_hash, processed_at) "
+            "VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)",
+            (path, size, mtime, file_hash),
+        )
+        conn.commit()
+    except Exception as e:
+        import logging
+        logging.error(f"更新监听状态失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+_FAILURE_COLUMNS = [
+    "id", "local_path", "original_filename", "source", "error_class", "error_type", "error_msg",
+    "attempts", "status", "next_retry_at", "created_at", "updated_at",
+]
+
+
+def insert_ingest_failure(local_path, original_filename, source, error_class, error_type, error_msg,
+                          status, next_retry_at):
+    """登记一条入库失败记录，返回 id"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cur = conn.execute(
+            "INSERT INTO ingest_failures (local_path, original_filename, source, error_class, error_type, "
+            "error_msg, status, next_retry_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (local_path, original_filename, source, error_class, error_type, error_msg, status, next_retry_at),
+        )
+        conn.commit()
+        return cur.lastrowid
+    except Exception as e:
+        import logging
+        logging.error(f"登记入库失败记录失败: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
+def update_ingest_failure(failure_id, **fields):
+    fields = {k: v for k, v in fields.items() if k in _FAILURE_COLUMNS and k != "id"}
+    if not fields:
+        return
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        sets = ", ".join(f"{k}=?" for k in fields)
+        conn.execute(
+            f"UPDATE ingest_failures SET {sets}, updated_at=CURRENT_TIMESTAMP WHERE id=?",
+            list(fields.values()) + [failure_id],
+        )
+        conn.commit()
+    except Exception as e:
+        import logging
+        logging.error(f"更新入库失败记录失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_ingest_failures(status=None, limit=100, due_before=None, local_path=None):
+    """查询失败记录（新的在前）。status: retrying/dead/resolved；due_before: 只取到期待重试的"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        where, args = [], []
+        if status:
+            where.append("status=?")
+            args.append(status)
+        if due_before is not None:
+            where.append("next_retry_at<=?")
+            args.append(due_before)
+        if local_path:
+            where.append("local_path=?")
+            args.append(local_path)
+        sql = f"SELECT {', '.join(_FAILURE_COLUMNS)} FROM ingest_failures"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        rows = conn.execute(sql, args + [limit]).fetchall()
+        return [dict(zip(_FAILURE_COLUMNS, r)) for r in rows]
+    except Exception as e:
+        import logging
+        logging.error(f"查询入库失败记录失败: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_ingest_failure(failure_id):
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        row = conn.execute(
+            f"SELECT {', '.join(_FAILURE_COLUMNS)} FROM ingest_failures WHERE id=?", (failure_id,)
+        ).fetchone()
+        return dict(zip(_FAILURE_COLUMNS, row)) if row else None
+    except Exception as e:
+        import logging
+        logging.error(f"查询入库失败记录失败: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
+def delete_ingest_failure(failure_id):
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute("DELETE FROM ingest_failures WHERE id=?", (failure_id,))
+        conn.commit()
+        return True
+    except Exception as e:
+        import logging
+        logging.error(f"删除入库失败记录失败: {e}")
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def create_ingest_job(job_id, source, items, lane=None, owner=None, lease_until=None):
+    """登记一个入库批次及其文件（均为 queued）；已存在则忽略，续跑时可重复调用。owner / lease_until: 创建进程的认领租约"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute(
+            "INSERT OR IGNORE INTO ingest_jobs (job_id, source, total, lane, owner, lease_until) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, source, len(items), lane, owner, lease_until),
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO ingest_journal (job_id, local_path, original_filename, stage) "
+            "VALUES (?, ?, ?, 'queued')",
+            [(job_id, p, name) for p, name in items],
+        )
+        conn.commit()
+    except Exception as e:
+        import logging
+        logging.error(f"登记入库批次失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def add_journal_entries(job_id, items):
+    """向已登记的批次追加文件（queued），用于边列举边入库、事先不知道文件总数的同步批次"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        added = conn.executemany(
+            "INSERT OR IGNORE INTO ingest_journal (job_id, local_path, original_filename, stage) "
+            "VALUES (?, ?, ?, 'queued')",
+            [(job_id, p, name) for p, name in items],
+        ).rowcount
+        conn.execute(
+            "UPDATE ingest_jobs SET total=total+?, updated_at=CURRENT_TIMESTAMP WHERE job_id=?", (added, job_id)
+        )
+        conn.commit()
+    except Exception as e:
+        import logging
+        logging.error(f"追加入库日志失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def journal_stage(job_id, local_path, stage, file_hash=None, s3_uri=None, error_msg=None):
+    """记录单个文件的阶段推进；未提供的字段保留之前的值"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.execute(
+            "UPDATE ingest_journal SET stage=?, file_hash=COALESCE(?, file_hash), s3_uri=COALESCE(?, s3_uri), "
+            "error_msg=?, updated_at=CURRENT_TIMESTAMP WHERE job_id=? AND local_path=?",
+            (stage, file_hash, s3_uri, error_msg, job_id, local_path),
+        )
+        conn.commit()
+    except Exception as e:
+        import logging
+        logging.error(f"写入入库日志失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def finish_ingest_job(job_id):
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute(
+            "UPDATE ingest_jobs SET status='done', updated_at=CURRENT_TIMESTAMP WHERE job_id=?", (job_id,)
+        )
+        conn.commit()
+    except Exception as e:
+        import logging
+        logging.error(f"更新入库批次状态失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_unfinished_jobs():
+    """返回未完成的入库批次 [(job_id, source, lane)]，按创建顺序"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        return conn.execute(
+            "SELECT job_id, source, lane FROM ingest_jobs WHERE status='running' ORDER BY created_at"
+        ).fetchall()
+    except Exception as e:
+        import logging
+        logging.error(f"查询未完成入库批次失败: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+def _claim(table, key, key_value, owner, lease_until, now, extra=""):
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        cur = conn.execute(
+            f"UPDATE {table} SET owner=?, lease_until=? WHERE {key}=?{extra} "
+            "AND (owner IS NULL OR owner=? OR lease_until IS NULL OR lease_until<?)",
+            (owner, lease_until, key_value, owner, now),
+        )
+        conn.commit()
+        return cur.rowcount == 1
+    except Exception as e:
+        import logging
+        logging.error(f"认领 {table} 记录失败: {e}")
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def claim_ingest_job(job_id, owner, lease_until, now):
+    """认领未完成的入库批次：无主或租约已过期才成功，返回是否认领到"""
+    return _claim("ingest_jobs", "job_id", job_id, owner, lease_until, now, " AND status='running'")
+
+
+def claim_ingest_failure(failure_id, owner, lease_until, now):
+    """认领一条待重试的失败记录，规则同 claim_ingest_job"""
+    return _claim("ingest_failures", "id", failure_id, owner, lease_until, now, " AND status!='resolved'")
+
+
+def release_ingest_failure(failure_id, owner):
+    """释放本进程对失败记录的认领"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.execute(
+            "UPDATE ingest_failures SET owner=NULL, lease_until=NULL WHERE id=? AND owner=?", (failure_id, owner)
+        )
+        conn.commit()
+    except Exception as e:
+        import logging
+        logging.error(f"释放失败记录认领失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def renew_leases(owner, lease_until):
+    """续租本进程持有的全部批次与失败记录，返回仍持有的条数"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        n = conn.execute(
+            "UPDATE ingest_jobs SET lease_until=? WHERE owner=? AND status='running'", (lease_until, owner)
+        ).rowcount
+        n += conn.execute(
+            "UPDATE ingest_failures SET lease_until=? WHERE owner=?", (lease_until, owner)
+        ).rowcount
+        conn.commit()
+        return n
+    except Exception as e:
+        import logging
+        logging.error(f"续租入库认领失败: {e}")
+        return 0
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_journal_entries(job_id):
+    """返回批次内各文件的日志 {local_path: (original_filename, stage, file_hash, s3_uri)}"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        rows = conn.execute(
+            "SELECT local_path, original_filename, stage, file_hash, s3_uri FROM ingest_journal WHERE job_id=?",
+            (job_id,),
+        ).fetchall()
+        return {r[0]: tuple(r[1:]) for r in rows}
+    except Exception as e:
+        import logging
+        logging.error(f"查询入库日志失败: {e}")
+        return {}
+    finally:
+        if conn:
+            conn.close()
+
+
+def add_raw_object_marker(file_hash, object_key, marker_key):
+    """登记原始对象的日期/类型索引标记；返回是否新登记（已存在则 False，无需重复写标记对象）"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO raw_object_index (file_hash, object_key, marker_key) VALUES (?, ?, ?)",
+            (file_hash, object_key, marker_key),
+        )
+        conn.commit()
+        return cur.rowcount > 0
+    except Exception as e:
+        import logging
+        logging.error(f"登记原始对象索引失败: {e}")
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_raw_object_keys(file_hash):
+    """返回某文件的 [(object_key, marker_key), ...]"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        return conn.execute(
+            "SELECT object_key, marker_key FROM raw_object_index WHERE file_hash=?", (file_hash,)
+        ).fetchall()
+    except Exception as e:
+        import logging
+        logging.error(f"读取原始对象索引失败: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+def delete_raw_object_index(file_hash):
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute("DELETE FROM raw_object_index WHERE file_hash=?", (file_hash,))
+        conn.commit()
+    except Exception as e:
+        import logging
+        logging.error(f"删除原始对象索引失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def insert_task_stat(task_type, file_count, success_count, processing_time, user_id=0,
+                     embed_cache_hits=0, embed_cache_misses=0, upload_bytes=0, upload_secs=0.0):
+    """写入一条任务统计，返回 id（供 insert_stage_stats 关联分阶段明细）"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cur = conn.execute(
+            "INSERT INTO task_stats (user_id, task_type, file_count, success_count, processing_time, "
+            "embed_cache_hits, embed_cache_misses, upload_bytes, upload_secs) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, task_type, file_count, success_count, processing_time,
+             embed_cache_hits, embed_cache_misses, upload_bytes, upload_secs),
+        )
+        conn.commit()
+        return cur.lastrowid
     except Exception as e:
         import logging
         logging.error(f"插入任务统计失败: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
+def insert_stage_stats(task_id, rows):
+    """写入任务的分阶段明细。rows: [(file_hash, doc_type, stage, duration, bytes, rows)]"""
+    if not rows:
+        return
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        conn.executemany(
+            "INSERT INTO task_stage_stats (task_id, file_hash, doc_type, stage, duration, bytes, rows) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(task_id, *r) for r in rows],
+        )
+        conn.commit()
+    except Exception as e:
+        import logging
+        logging.error(f"插入分阶段统计失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def upsert_doc_signature(file_hash, signature, bands):
+    """写入/覆盖文档 MinHash 签名及 LSH 分桶。bands: list of (band, bucket)"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute("DELETE FROM doc_minhash_bands WHERE file_hash=?", (file_hash,))
+        conn.execute(
+            "INSERT OR REPLACE INTO doc_minhash (file_hash, signature) VALUES (?, ?)",
+            (file_hash, signature),
+        )
+        conn.executemany(
+            "INSERT INTO doc_minhash_bands (band, bucket, file_hash) VALUES (?, ?, ?)",
+            [(band, bucket, file_hash) for band, bucket in bands],
+        )
+        conn.commit()
+    except Exception as e:
+        import logging
+        logging.error(f"写入文档签名失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def find_signature_candidates(bands):
+    """返回与任一 (band, bucket) 相同的文档 file_hash 列表"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        found = set()
+        for band, bucket in bands:
+            rows = conn.execute(
+                "SELECT file_hash FROM doc_minhash_bands WHERE band=? AND bucket=?",
+                (band, bucket),
+            ).fetchall()
+            found.update(r[0] for r in rows)
+        return list(found)
+    except Exception as e:
+        import logging
+        logging.error(f"查询签名候选失败: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_doc_signatures(file_hashes):
+    """批量读取签名，返回 [(file_hash, signature_bytes)]"""
+    if not file_hashes:
+        return []
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        file_hashes = list(file_hashes)
+        out = []
+        for i in range(0, len(file_hashes), 500):
+            part = file_hashes[i:i + 500]
+            marks = ",".join("?" * len(part))
+            out.extend(conn.execute(
+                f"SELECT file_hash, signature FROM doc_minhash WHERE file_hash IN ({marks})",
+                part,
+            ).fetchall())
+        return out
+    except Exception as e:
+        import logging
+        logging.error(f"读取文档签名失败: {e}")
+        return []
     finally:
         if conn:
             conn.close()
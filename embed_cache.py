@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""切片向量缓存：按 (模型, 规范化切片文本哈希) 持久化到本地 SQLite，LRU 淘汰"""
+
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from config import EMBED_CACHE_PATH, EMBED_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+_WS_RE = re.compile(r"\s+")
+_init_lock = threading.Lock()
+_initialized = False
+_puts_since_evict = 0
+
+
+def _connect():
+    global _initialized
+    if not _initialized:
+        Path(EMBED_CACHE_PATH).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(EMBED_CACHE_PATH, timeout=30)
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    """CREATE TABLE IF NOT EXISTS chunk_embeddings (
+                       model_id TEXT NOT NULL,
+                       text_hash TEXT NOT NULL,
+                       vector BLOB NOT NULL,
+                       last_used REAL NOT NULL,
+                       PRIMARY KEY (model_id, text_hash)
+                    )"""
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_embeddings_lru ON chunk_embeddings (last_used)")
+                conn.commit()
+                _initialized = True
+    return conn
+
+
+def chunk_key(text):
+    """规范化（合并空白、去首尾空白）后的切片文本哈希"""
+    return hashlib.sha1(_WS_RE.sub(" ", text).strip().encode("utf-8")).hexdigest()
+
+
+def get_cached_embeddings(model_id, keys):
+    """批量查缓存，返回 {key: np.ndarray(float32)}，并刷新命中项的 last_used"""
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return {}
+    conn = None
+    found = {}
+    try:
+        conn = _connect()
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            marks = ",".join("?" * len(part))
+            rows = conn.execute(
+                f"SELECT text_hash, vector FROM chunk_embeddings WHERE model_id=? AND text_hash IN ({marks})",
+                [model_id] + part,
+            ).fetchall()
+            for h, blob in rows:
+                found[h] = np.frombuffer(blob, dtype=np.float32)
+        if found:
+            now = time.time()
+            conn.executemany(
+                "UPDATE chunk_embeddings SET last_used=? WHERE model_id=? AND text_hash=?",
+                [(now, model_id, h) for h in found],
+            )
+            conn.commit()
+    except Exception as e:
+        logger.warning(f"读取切片向量缓存失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+    return found
+
+
+def put_cached_embeddings(model_id, items):
+    """写入缓存。items: list of (key, vector)"""
+    global _puts_since_evict
+    if not items:
+        return
+    conn = None
+    try:
+        conn = _connect()
+        now = time.time()
+        conn.executemany(
+            "INSERT OR REPLACE INTO chunk_embeddings (model_id, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+            [(model_id, k, np.asarray(v, dtype=np.float32).tobytes(), now) for k, v in items],
+        )
+        conn.commit()
+        _puts_since_evict += len(items)
+        # 每写入约 1% 容量检查一次，避免每批都 COUNT
+        if _puts_since_evict >= max(1000, EMBED_CACHE_MAX_ENTRIES // 100):
+            _puts_since_evict = 0
+            _evict(conn)
+    except Exception as e:
+        logger.warning(f"写入切片向量缓存失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def _evict(conn):
+    """超过容量时按 last_used 淘汰最久未用的条目，降到容量的 90%"""
+    total = conn.execute("SELECT COUNT(*) FROM chunk_embeddings").fetchone()[0]
+    if total <= EMBED_CACHE_MAX_ENTRIES:
+        return
+    n = total - int(EMBED_CACHE_MAX_ENTRIES * 0.9)
+    conn.execute(
+        "DELETE FROM chunk_embeddings WHERE rowid IN "
+        "(SELECT rowid FROM chunk_embeddings ORDER BY last_used LIMIT ?)",
+        (n,),
+    )
+    conn.commit()
+    logger.info(f"切片向量缓存淘汰 {n} 条（上限 {EMBED_CACHE_MAX_ENTRIES}）")
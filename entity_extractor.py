@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""LLM 实体抽取：独立队列 + 工作线程异步执行，长连接复用、失败退避重试、按文本哈希缓存结果"""
+
+import json
+import time
+import queue
+import random
+import hashlib
+import logging
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+from config import (
+    DEEPSEEK_API_KEY,
+    DEEPSEEK_BASE_URL,
+    DEEPSEEK_MODEL,
+    ENTITY_WORKERS,
+    ENTITY_QUEUE_MAX,
+    ENTITY_SNIPPET_CHARS,
+    ENTITY_BATCH_DOCS,
+    ENTITY_BATCH_WAIT,
+    ENTITY_TIMEOUT,
+    ENTITY_MAX_RETRIES,
+    ENTITY_BACKOFF_BASE,
+    ENTITY_BACKOFF_MAX,
+)
+from database import insert_file_entities, get_cached_entities, put_cached_entities
+
+logger = logging.getLogger(__name__)
+
+_PROMPT_HEAD = (
+    "请从以下文本中抽取关键实体（人名、地名、组织、技术术语等），"
+    "以 JSON 数组格式返回，每个元素包含 name 和 type 两个字段。"
+    "只返回 JSON 数组，不要其他内容。\n\n"
+)
+_MULTI_PROMPT_HEAD = (
+    "以下有多篇文档，每篇以 [[DOC 编号]] 开头。请分别从每篇中抽取关键实体（人名、地名、组织、技术术语等），"
+    "以 JSON 对象返回：键为文档编号（字符串），值为该文档的实体数组，每个元素包含 name 和 type 两个字段。"
+    "只返回 JSON 对象，不要其他内容。\n\n"
+)
+
+_queue = queue.Queue(maxsize=ENTITY_QUEUE_MAX)
+_workers = []
+_workers_lock = threading.Lock()
+_local = threading.local()
+
+
+class _RetryableError(Exception):
+    def __init__(self, msg, retry_after=None):
+        super().__init__(msg)
+        self.retry_after = retry_after
+
+
+def text_hash(snippet):
+    """缓存键：模型 + 实际送入 LLM 的文本，换模型后不会命中旧结果"""
+    return hashlib.sha1(f"{DEEPSEEK_MODEL}\0{snippet}".encode("utf-8")).hexdigest()
+
+
+# ---------- HTTP ----------
+
+def _new_connection():
+    u = urlsplit(DEEPSEEK_BASE_URL)
+    cls = http.client.HTTPSConnection if u.scheme == "https" else http.client.HTTPConnection
+    return cls(u.hostname, u.port, timeout=ENTITY_TIMEOUT)
+
+
+def _get_connection():
+    # 每个工作线程持有一条 keep-alive 连接，连接数即并发上限
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = _new_connection()
+    return conn
+
+
+def _drop_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    _local.conn = None
+
+
+def _post_chat(prompt):
+    """单次请求，返回 message content；429/5xx/网络错误抛 _RetryableError"""
+    path = urlsplit(DEEPSEEK_BASE_URL).path.rstrip("/") + "/v1/chat/completions"
+    body = json.dumps({
+        "model": DEEPSEEK_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0.1,
+    }).encode("utf-8")
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
+    }
+    try:
+        conn = _get_connection()
+        conn.request("POST", path, body=body, headers=headers)
+        resp = conn.getresponse()
+        data = resp.read()
+    except (OSError, http.client.HTTPException) as e:
+        _drop_connection()
+        raise _RetryableError(f"网络错误: {e}")
+
+    if resp.status == 429 or resp.status >= 500:
+        retry_after = resp.getheader("Retry-After")
+        try:
+            retry_after = float(retry_after) if retry_after else None
+        except ValueError:
+            retry_after = None
+        raise _RetryableError(f"HTTP {resp.status}", retry_after)
+    if resp.status != 200:
+        raise RuntimeError(f"HTTP {resp.status}: {data[:200]!r}")
+    if resp.getheader("Connection", "").lower() == "close":
+        _drop_connection()
+    result = json.loads(data.decode("utf-8"))
+    return result["choices"][0]["message"]["content"].strip()
+
+
+def _call_with_retry(prompt):
+    for attempt in range(ENTITY_MAX_RETRIES + 1):
+        try:
+            return _post_chat(prompt)
+        except _RetryableError as e:
+            if attempt >= ENTITY_MAX_RETRIES:
+                raise RuntimeError(f"重试 {ENTITY_MAX_RETRIES} 次仍失败: {e}")
+            delay = e.retry_after or min(ENTITY_BACKOFF_MAX, ENTITY_BACKOFF_BASE * (2 ** attempt))
+            delay *= random.uniform(0.8, 1.2)
+            logger.info(f"实体抽取请求失败（{e}），{delay:.1f}s 后第 {attempt + 1} 次重试")
+            time.sleep(delay)
+
+
+# ---------- 解析 ----------
+
+def _parse_json(content):
+    # 兼容 ```json ... ``` 包裹
+    if content.startswith("```"):
+        content = content.split("```")[1]
+        if content.startswith("json"):
+            content = content[4:]
+    return json.loads(content)
+
+
+def _clean_entities(raw):
+    entities = []
+    if not isinstance(raw, list):
+        return entities
+    for e in raw:
+        if not isinstance(e, dict):
+            continue
+        name = (e.get("name") or "").strip()
+        etype = (e.get("type") or "").strip()
+        if name:
+            entities.append((name, etype))
+    return entities
+
+
+# ---------- 抽取 ----------
+
+def _extract_single(snippet):
+    return _clean_entities(_parse_json(_call_with_retry(_PROMPT_HEAD + f"文本：{snippet}")))
+
+
+def _extract_multi(snippets):
+    """多篇合并为一次请求；返回与 snippets 等长的列表，某篇缺失时为 None"""
+    prompt = _MULTI_PROMPT_HEAD + "\n\n".join(f"[[DOC {i}]]\n{s}" for i, s in enumerate(snippets))
+    parsed = _parse_json(_call_with_retry(prompt))
+    if not isinstance(parsed, dict):
+        return [None] * len(snippets)
+    return [_clean_entities(parsed[str(i)]) if str(i) in parsed else None for i in range(len(snippets))]
+
+
+def _process_jobs(jobs):
+    """jobs: list of (file_hash, snippet)。先查缓存，未命中的调用 LLM，结果写缓存和 file_entities"""
+    keys = [text_hash(s) for _, s in jobs]
+    cached = get_cached_entities(list(set(keys)))
+    results = {k: [tuple(e) for e in json.loads(v)] for k, v in cached.items()}
+
+    pending = list({k: s for k, (_, s) in zip(keys, jobs) if k not in results}.items())
+    if pending:
+        if len(pending) == 1:
+            outs = [_extract_single(pending[0][1])]
+        else:
+            outs = _extract_multi([s for _, s in pending])
+            # 合并请求中漏掉的文档单独补抽
+            outs = [o if o is not None else _extract_single(s) for o, (_, s) in zip(outs, pending)]
+        fresh = {k: o for (k, _), o in zip(pending, outs)}
+        put_cached_entities([(k, json.dumps(o, ensure_ascii=False)) for k, o in fresh.items()])
+        results.update(fresh)
+
+    for (file_hash, _), k in zip(jobs, keys):
+        entities = results.get(k) or []
+        # 覆盖入库时替换旧实体，避免重复
+        insert_file_entities(file_hash, entities, replace=True)
+        if entities:
+            logger.info(f"实体抽取完成: hash={file_hash}, 共 {len(entities)} 个实体" + ("（缓存）" if k in cached else ""))
+
+
+def _take_batch():
+    first = _queue.get()
+    jobs = [first]
+    deadline = time.time() + ENTITY_BATCH_WAIT
+    while len(jobs) < ENTITY_BATCH_DOCS:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        try:
+            jobs.append(_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return jobs
+
+
+def _worker():
+    while True:
+        jobs = _take_batch()
+        try:
+            _process_jobs(jobs)
+        except Exception as e:
+            logger.warning(f"实体抽取失败（不影响主流程）: {e}")
+        finally:
+            for _ in jobs:
+                _queue.task_done()
+
+
+def _ensure_workers():
+    if len(_workers) >= ENTITY_WORKERS:
+        return
+    with _workers_lock:
+        while len(_workers) < ENTITY_WORKERS:
+            t = threading.Thread(target=_worker, name=f"entity-{len(_workers)}", daemon=True)
+            t.start()
+            _workers.append(t)
+
+
+def submit_entity_extraction(text, file_hash):
+    """把文档加入实体抽取队列后立即返回；队列满时丢弃并告警，不阻塞入库"""
+    if not DEEPSEEK_API_KEY or not text or not text.strip():
+        return False
+    _ensure_workers()
+    try:
+        _queue.put_nowait((file_hash, text[:ENTITY_SNIPPET_CHARS]))
+        return True
+    except queue.Full:
+        logger.warning(f"实体抽取队列已满（{ENTITY_QUEUE_MAX}），跳过: hash={file_hash}")
+        return False
+
+
+def wait_entity_queue(timeout=None):
+    """等待队列中已提交的任务处理完（脚本/基准退出前调用）；返回是否在超时前清空"""
+    deadline = None if timeout is None else time.time() + timeout
+    with _queue.all_tasks_done:
+        while _queue.unfinished_tasks:
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            _queue.all_tasks_done.wait(remaining)
+    return True
+
+
+def entity_queue_size():
+    return _queue.qsize()
@@ -1,33 +1,47 @@
 # -*- coding: utf-8 -*-
 """ETL：内容提取、管道处理、批量/SFTP 任务"""
 
+import io
 import os
 import uuid
 import time
+import hashlib
 import logging
 import shutil
+import tempfile
+import itertools
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import boto3
-import pandas as pd
 from PIL import Image
 import docx
-import pypdf
-from pdf2image import convert_from_path
 from pptx import Presentation
-import paramiko
 
 from config import (
     S3_CONFIG,
     TEMP_DIR,
-    EXTRACT_DIR,
     CONTENT_EXTS,
     IMAGE_EXTS,
+    AUDIO_EXTS,
+    VIDEO_EXTS,
+    MEDIA_EXTS,
     ARCHIVE_EXTS,
     CHUNK_SIZE,
     CHUNK_OVERLAP,
+    CHUNK_MODE,
+    CHUNK_TOKEN_OVERLAP,
     MAX_FILE_SIZE_MB,
+    EMBED_BATCH_SIZE,
+    TEXT_WRITE_BATCH,
+    TEXT_FULL_MAX_CHARS,
+    ARCHIVE_WORKERS,
+    ARCHIVE_MAX_DEPTH,
+    NEAR_DUP_ENABLED,
+    NEAR_DUP_SAMPLE_CHARS,
+    EMBED_CACHE_ENABLED,
+    ENTITY_SNIPPET_CHARS,
 )
 from database import (
     calculate_file_hash,
@@ -35,77 +49,133 @@ from database import (
     register_file,
     insert_task_stat,
     delete_file_from_registry,
-    insert_file_entities,
+    create_ingest_job,
+    journal_stage,
+    finish_ingest_job,
+    get_journal_entries,
+    insert_stage_stats,
+)
+from models_loader import TEXT_MODEL_NAME, get_model_text_splitter, iter_split_segments
+from embed_cache import chunk_key, get_cached_embeddings, put_cached_embeddings
+from near_dup import compute_signature, find_near_duplicate, index_signature
+from entity_extractor import submit_entity_extraction
+from ingest_retry import record_failure
+from ingest_lease import OWNER, lease_deadline
+from scheduler import get_scheduler, estimate_memory, stage_slot, lane_for_source, check_lane, current_lane, use_lane
+from s3_utils import (
+    get_s3_client,
+    object_exists,
+    put_index_marker,
+    delete_raw_objects,
+    S3_TRANSFER_CONFIG,
+)
+from extractors import (
+    iter_pdf_page_texts,
+    iter_pdf_page_images,
+    iter_table_segments,
+    iter_archive_members,
+    iter_text_blocks,
+    iter_audio_segments,
 )
-from models_loader import get_text_splitter
 
 logger = logging.getLogger(__name__)
 
-# S3 客户端（可选）
-_s3_client = None
-
 def _sanitize_filename(name: str) -> str:
     # S3 key 里避免出现路径分隔符
     return (name or "").replace("\\", "_").replace("/", "_")
 
 
+def _file_size(path) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
 def _category_for_ext(ext: str) -> str:
     e = (ext or "").lower()
     if e in IMAGE_EXTS:
         return "image"
-    if e in ["mp3", "wav", "m4a", "flac", "ogg"]:
+    if e in AUDIO_EXTS:
         return "audio"
-    if e in ["mp4", "webm", "mov", "avi", "mkv"]:
+    if e in VIDEO_EXTS:
         return "video"
-    if e in ["pdf", "docx", "pptx", "txt", "md", "csv", "xlsx", "xls", "json", "log", "sql", "xml", "yaml", "ini", "py", "js", "sh"]:
+    if e in ["pdf", "docx", "pptx", "txt", "md", "csv", "xlsx", "xls", "parquet", "json", "log", "sql", "xml", "yaml", "ini", "py", "js", "sh"]:
         return "text"
     if e in ARCHIVE_EXTS:
         return "archive"
     return "other"
 
 
-def get_s3_client():
-    global _s3_client
-    if _s3_client is None:
-        try:
-            _s3_client = boto3.client(
-                "s3",
-                endpoint_url=S3_CONFIG["endpoint_url"],
-                aws_access_key_id=S3_CONFIG["access_key_id"],
-                aws_secret_access_key=S3_CONFIG["secret_access_key"],
-            )
-            # 原始文件桶 & LanceDB 桶（LanceDB 桶主要给 lancedb 自己用，这里只确保存在）
-            for b in [S3_CONFIG["raw_bucket"], S3_CONFIG["lance_bucket"]]:
+class StageTimer:
+    """单文件各阶段累计耗时/字节数/行数。流式抽取与分批向量化交替进行，同一阶段会多次进入，按阶段累加"""
+
+    def __init__(self, file_hash=None, doc_type=""):
+        self.file_hash = file_hash
+        self.doc_type = doc_type
+        self.stages = {}  # stage -> [secs, bytes, rows]
+
+    def add(self, stage, secs, nbytes=0, rows=0):
+        acc = self.stages.setdefault(stage, [0.0, 0, 0])
+        acc[0] += secs
+        acc[1] += nbytes
+        acc[2] += rows
+
+    @contextmanager
+    def time(self, stage, nbytes=0, rows=0):
+        # 先占阶段并发名额（排队时间不计入阶段耗时）
+        with stage_slot(stage, rows):
+            t0 = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.add(stage, time.perf_counter() - t0, nbytes, rows)
+
+    def wrap_iter(self, stage, items):
+        """只统计生成器内部耗时（消费方处理产出项的时间不计入）"""
+        it = iter(items)
+        while True:
+            with stage_slot(stage):
+                t0 = time.perf_counter()
                 try:
-                    _s3_client.create_bucket(Bucket=b)
-                except Exception:
-                    pass
-        except Exception:
-            _s3_client = False
-    return _s3_client if _s3_client else None
+                    item = next(it)
+                except StopIteration:
+                    self.add(stage, time.perf_counter() - t0)
+                    return
+            self.add(stage, time.perf_counter() - t0, rows=1)
+            yield item
+
+    def as_rows(self):
+        """[(file_hash, doc_type, stage, secs, bytes, rows)]，供 insert_stage_stats 写入"""
+        return [(self.file_hash, self.doc_type, k, round(v[0], 4), v[1], v[2]) for k, v in self.stages.items()]
 
 
 def extract_content(path, ext, models):
-    """全能内容提取：文本、文档、表格、音视频"""
+    """全能内容提取：文本、文档、表格、音视频
+
+    path: 本地路径，或二进制文件对象（如内存中的压缩包成员）
+    """
     content = ""
     msg = ""
 
     try:
-        if ext in ["mp3", "wav", "m4a", "mp4", "avi", "mov", "mkv", "flac"]:
-            result = models["whisper"].transcribe(path)
+        if ext in MEDIA_EXTS:
+            with _spilled_path(path, f".{ext}") as media_path:
+                result = models["whisper"].transcribe(media_path)
             content = result.get("text", "")
             msg = "语音转录完成"
 
         elif ext in ["txt", "md", "py", "json", "log", "sh", "js", "java", "sql", "xml", "yaml", "ini"]:
-            with open(path, "r", encoding="utf-8", errors="ignore") as f:
-                content = f.read()
+            if isinstance(path, str):
+                with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                    content = f.read()
+            else:
+                content = path.read().decode("utf-8", errors="ignore")
 
         elif ext == "docx":
             content = "\n".join([p.text for p in docx.Document(path).paragraphs])
         elif ext == "pdf":
-            content = "\n".join(
-                [p.extract_text() or "" for p in pypdf.PdfReader(path).pages]
-            )
+            content = "\n".join(text for _, text in iter_pdf_page_texts(path))
         elif ext == "pptx":
             prs = Presentation(path)
             content = "\n".join(
@@ -114,12 +184,8 @@ def extract_content(path, ext, models):
                 for shape in slide.shapes
                 if hasattr(shape, "text")
             )
-        elif ext == "csv":
-            content = pd.read_csv(path).to_string()
-        elif ext in ["xlsx", "xls"]:
-            content = pd.read_excel(path).to_string()
-        elif ext == "parquet":
-            content = pd.read_parquet(path).to_string()
+        elif ext in ["csv", "xlsx", "xls", "parquet"]:
+            content = "\n\n".join(text for text, _ in iter_table_segments(path, ext))
     except Exception as e:
         logger.error("提取失败 %s: %s", ext, e)
         msg = str(e)
@@ -127,145 +193,421 @@ def extract_content(path, ext, models):
     return content, msg
 
 
-def process_pipeline(local_path, original_filename, models, tbl_text, tbl_image, tbl_files):
+def iter_content_segments(path, ext, models):
+    """按段产出 (text, meta_info)，供切片/向量化边读边处理。
+
+    PDF 按页产出（meta_info 为 "Page N"）；表格按行块产出（带表头，
+    meta_info 为工作表/row group 与行号范围）；纯文本/日志按固定大小块流式产出；
+    音视频按 VAD 语音段转录后产出（meta_info 为 "HH:MM:SS-HH:MM:SS"）；其余格式整体作为一段。
+    """
+    if ext in ["txt", "md", "py", "json", "log", "sh", "js", "java", "sql", "xml", "yaml", "ini"]:
+        try:
+            for block in iter_text_blocks(path):
+                yield block, ""
+        except Exception as e:
+            logger.error("提取失败 %s: %s", ext, e)
+        return
+
+    if ext == "pdf":
+        try:
+            for page_no, text in iter_pdf_page_texts(path):
+                if text and text.strip():
+                    yield text, f"Page {page_no}"
+        except Exception as e:
+            logger.error("提取失败 %s: %s", ext, e)
+        return
+
+    if ext in ["csv", "xlsx", "xls", "parquet"]:
+        try:
+            yield from iter_table_segments(path, ext)
+        except Exception as e:
+            logger.error("提取失败 %s: %s", ext, e)
+        return
+
+    if ext in MEDIA_EXTS:
+        produced = False
+        try:
+            with _spilled_path(path, f".{ext}") as media_path:
+                for seg in iter_audio_segments(media_path, models["whisper"]):
+                    produced = True
+                    yield seg
+            return
+        except Exception as e:
+            if produced:
+                logger.error("提取失败 %s: %s", ext, e)
+                return
+            # 分段转录不可用（如缺少 ffmpeg 可执行文件）时回退为整段转录
+            logger.warning("分段转录失败，回退整段转录 %s: %s", ext, e)
+
+    content, _ = extract_content(path, ext, models)
+    if content and content.strip():
+        yield content, ""
+
+
+def _peek_text_sample(segments, sample_chars):
+    """预读不超过 sample_chars 的段用于签名，返回 (样本文本, 原样的完整段迭代器)"""
+    it = iter(segments)
+    head = []
+    n = 0
+    for seg in it:
+        head.append(seg)
+        n += len(seg[0])
+        if n >= sample_chars:
+            break
+    sample = "".join(t for t, _ in head)[:sample_chars]
+    return sample, itertools.chain(head, it)
+
+
+def _index_text_segments(segments, models, tbl_text, row_base, before_first_write=None, timer=None):
+    """切片 → 批量向量化 → 分批写入 text_chunks。
+
+    row_base: 每行公共字段（source_uri/doc_name/doc_type/file_hash）
+    before_first_write: 首次写入前的回调（覆盖模式下用于删除旧切片）
+    timer: 可选 StageTimer，记录 embed（向量化）与 commit（LanceDB 写入）阶段
+    启用近重复检测时，先预读文本前缀计算 MinHash 签名并记录命中的近重复文档。
+    向量复用统一走切片向量缓存：与已入库文档相同的切片（含近重复文档的重合部分）
+    在缓存中命中，只对未命中的切片做 encode 并回填缓存。
+    返回: (写入切片数, 截断后的全文, 统计信息 dict)
+    """
+    splitter = get_model_text_splitter(
+        models["text"], CHUNK_MODE, CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_TOKEN_OVERLAP
+    )
+    has_meta = "meta_info" in getattr(tbl_text.schema, "names", [])
+    pending = []  # 待向量化 (chunk, meta_info)
+    rows = []  # 待写入行
+    text_parts = []
+    text_len = 0
+    written = 0
+    stats = {"near_dup_of": None, "near_dup_sim": 0.0, "cache_hits": 0, "cache_misses": 0}
+    timer = timer or StageTimer()
+
+    f_hash = row_base.get("file_hash")
+    signature = None
+    if NEAR_DUP_ENABLED:
+        try:
+            sample, segments = _peek_text_sample(segments, NEAR_DUP_SAMPLE_CHARS)
+            signature = compute_signature(sample)
+            match = find_near_duplicate(signature, exclude_hash=f_hash)
+            if match:
+                stats["near_dup_of"], stats["near_dup_sim"] = match[0], round(match[1], 3)
+                logger.info(f"检测到近重复文档: hash={f_hash} ≈ {match[0]} (相似度 {match[1]:.2f})")
+        except Exception as e:
+            logger.warning(f"近重复检测失败（不影响入库）: {e}")
+
+    def encode_pending():
+        if not pending:
+            return
+        misses = list(dict.fromkeys(c for c, _ in pending))
+        fresh = {}
+        if misses and EMBED_CACHE_ENABLED:
+            keys = {c: chunk_key(c) for c in misses}
+            cached = get_cached_embeddings(TEXT_MODEL_NAME, keys.values())
+            for c in misses:
+                if keys[c] in cached:
+                    fresh[c] = cached[keys[c]]
+            stats["cache_hits"] += len(fresh)
+            misses = [c for c in misses if c not in fresh]
+        if misses:
+            with timer.time("embed", rows=len(misses)):
+                vecs = models["text"].encode(misses, batch_size=EMBED_BATCH_SIZE)
+            fresh.update(zip(misses, vecs))
+            stats["cache_misses"] += len(misses)
+            if EMBED_CACHE_ENABLED:
+                put_cached_embeddings(TEXT_MODEL_NAME, [(chunk_key(c), v) for c, v in zip(misses, vecs)])
+        for c, meta in pending:
+            row = dict(row_base, id=str(uuid.uuid4()), vector=fresh[c], text=c)
+            if has_meta:
+                row["meta_info"] = meta
+            rows.append(row)
+        pending.clear()
+
+    def write_rows():
+        nonlocal written
+        if not rows:
+            return
+        if written == 0 and before_first_write:
+            before_first_write()
+        with timer.time("commit", rows=len(rows)):
+            tbl_text.add(rows)
+        written += len(rows)
+        rows.clear()
+
+    def tracked(segs):
+        # 边产出边截留全文（受 TEXT_FULL_MAX_CHARS 限制）；同一文本流的连续块直接拼接，换页/换块补换行
+        nonlocal text_len
+        prev_meta = None
+        for text, meta in segs:
+            if text_len < TEXT_FULL_MAX_CHARS:
+                sep = "\n" if text_parts and (meta or meta != prev_meta) else ""
+                prev_meta = meta
+                part = (sep + text)[: TEXT_FULL_MAX_CHARS - text_len]
+                text_parts.append(part)
+                text_len += len(part)
+            yield text, meta
+
+    for c, meta in iter_split_segments(splitter, tracked(segments)):
+        pending.append((c, meta))
+        if len(pending) >= EMBED_BATCH_SIZE:
+            encode_pending()
+            if len(rows) >= TEXT_WRITE_BATCH:
+                write_rows()
+    encode_pending()
+    write_rows()
+    if written and signature is not None:
+        index_signature(f_hash, signature)
+    return written, "".join(text_parts), stats
+
+
+def _as_source(local_path, data):
+    """解析器输入：本地路径，或内存字节的新 BytesIO（每次调用返回独立读指针）"""
+    return local_path if data is None else io.BytesIO(data)
+
+
+@contextmanager
+def _spilled_path(source, suffix=""):
+    """为只接受文件路径的解析器（ffmpeg/pdftoppm）提供路径：内存数据临时落盘，用完即删"""
+    if isinstance(source, str):
+        yield source
+        return
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(suffix=suffix, dir=TEMP_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            source.seek(0)
+            shutil.copyfileobj(source, f, 1024 * 1024)
+        yield tmp
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _process_archive(local_path, original_filename, ext, models, tbl_text, tbl_image, tbl_files, data=None, depth=0):
+    """流式读取压缩包成员并并行入库，不解压到磁盘（超大成员临时落盘，处理完即删）"""
+    if depth >= ARCHIVE_MAX_DEPTH:
+        return {"success": False, "msg": f"嵌套压缩包超过 {ARCHIVE_MAX_DEPTH} 层，已跳过", "count": 0, "status": "skipped"}
+
+    # 成员线程沿用压缩包所在通道，成员各自的预估内存追加计入调度器预算
+    lane = current_lane()
+    scheduler = get_scheduler()
+    owner = object()
+
+    def run_member(name, member_data, tmp_path):
+        try:
+            with use_lane(lane):
+                return process_pipeline(tmp_path, name, models, tbl_text, tbl_image, tbl_files,
+                                        data=member_data, _depth=depth + 1)
+        except Exception as e:
+            logger.error(f"压缩包成员处理失败: {name}, {e}")
+            return {"success": False, "msg": str(e), "count": 0, "status": "error"}
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    total = 0
+    cache_hits = cache_misses = 0
+    upload_bytes = upload_secs = 0
+    stages = []
+    errors = []
+    # 限制在途成员数，控制内存中同时驻留的成员字节
+    slots = threading.BoundedSemaphore(ARCHIVE_WORKERS * 2)
+    futures = []
+    try:
+        with ThreadPoolExecutor(max_workers=ARCHIVE_WORKERS) as executor:
+            try:
+                members = iter_archive_members(_as_source(local_path, data), ext, original_filename)
+                for name, member_data, tmp_path in members:
+                    slots.acquire()
+                    size = len(member_data) if member_data is not None else os.path.getsize(tmp_path)
+                    cost = scheduler.charge(estimate_memory(tmp_path, name, size=size), owner)
+                    fut = executor.submit(run_member, name, member_data, tmp_path)
+                    fut.add_done_callback(lambda _f, c=cost: (scheduler.release(c, owner), slots.release()))
+                    futures.append((name, fut))
+            except Exception as e:
+                errors.append(str(e))
+                logger.error(f"读取压缩包失败: {original_filename}, {e}")
+        for name, fut in futures:
+            res = fut.result()
+            cache_hits += res.get("cache_hits", 0)
+            cache_misses += res.get("cache_misses", 0)
+            upload_bytes += res.get("upload_bytes", 0)
+            upload_secs += res.get("upload_secs", 0)
+            stages.extend(res.get("stages", []))
+            if res["success"]:
+                total += res["count"]
+            elif res["status"] == "error":
+                errors.append(f"{name}: {res['msg']}")
+    except Exception as e:
+        return {"success": False, "msg": str(e), "count": 0, "status": "error"}
+
+    if errors and not total:
+        return {"success": False, "msg": "; ".join(errors[:5]), "count": 0, "status": "error"}
+    msg = f"解压入库 {total} 文件" + (f"，{len(errors)} 个失败" if errors else "")
+    return {"success": True, "msg": msg, "count": total, "status": "ok",
+            "cache_hits": cache_hits, "cache_misses": cache_misses,
+            "upload_bytes": upload_bytes, "upload_secs": upload_secs, "stages": stages}
+
+
+def raw_object_key(f_hash, ext):
+    """原始文件在 raw 桶中的内容寻址 key：相同字节只存一份"""
+    return f"raw/objects/{f_hash[:2]}/{f_hash}" + (f".{ext}" if ext else "")
+
+
+def raw_index_key(f_hash, original_filename, ext):
+    """按日期/类型浏览用的 0 字节索引标记 key（S3 里"目录"本质是 key 前缀）"""
+    safe_name = _sanitize_filename(original_filename)
+    cat = _category_for_ext(ext)
+    today = datetime.now().strftime("%Y-%m-%d")
+    return f"raw/{today}/{cat}/{f_hash[:8]}_{safe_name}"
+
+
+def process_pipeline(local_path, original_filename, models, tbl_text, tbl_image, tbl_files, data=None, _depth=0,
+                     f_hash=None, s3_uri=None, on_stage=None, stored=False):
+    """单文件入库管道。
+
+    data: 可选的文件字节（如压缩包成员），提供时直接在内存中处理，local_path 可为 None
+    f_hash / s3_uri: 调用方边读边算好的 hash、已上传的原始文件 URI（如 SFTP 流式拉取），提供时不再重复读取/上传
+    on_stage: 可选，阶段完成回调 on_stage(stage, file_hash=..., s3_uri=...)，供入库日志记录断点
+    stored: files 表已写入（续跑中断于 stored 阶段的文件），跳过原始文件入 files 表，直接切片/向量化
+    """
     if original_filename is None:
         original_filename = os.path.basename(local_path)
     ext = original_filename.rsplit(".", 1)[-1].lower() if "." in original_filename else ""
 
+    # 压缩包：不登记压缩包自身 hash，成员各自登记
+    if ext in ARCHIVE_EXTS:
+        return _process_archive(local_path, original_filename, ext, models, tbl_text, tbl_image, tbl_files,
+                                data=data, depth=_depth)
+
     overwrite = False
+    timer = StageTimer(doc_type=ext)
     try:
-        f_hash = calculate_file_hash(local_path)
+        if not f_hash:
+            with timer.time("hash", nbytes=len(data) if data is not None else os.path.getsize(local_path)):
+                f_hash = hashlib.md5(data).hexdigest() if data is not None else calculate_file_hash(local_path)
+        timer.file_hash = f_hash
         overwrite = check_file_exists(f_hash)
         # SQLite 登记（重复则忽略）
-        register_file(f_hash, original_filename, os.path.getsize(local_path))
-    except Exception:
-        # f_hash 仍可能用于后续流程；若异常，后面会再算一次
-        pass
-
-    # 压缩包
-    if ext in ARCHIVE_EXTS:
-        import zipfile
-        import tarfile
-        import shutil
-
-        try:
-            extract_folder = os.path.join(EXTRACT_DIR, str(uuid.uuid4()))
-            os.makedirs(extract_folder)
-            if ext == "zip":
-                with zipfile.ZipFile(local_path, "r") as z:
-                    z.extractall(extract_folder)
-            else:
-                with tarfile.open(local_path, "r") as t:
-                    # Python 3.12+ 需要 filter 参数防止路径穿越攻击
-                    import sys
-                    if sys.version_info >= (3, 12):
-                        t.extractall(extract_folder, filter='data')
-                    else:
-                        t.extractall(extract_folder)
-
-            sub_files = []
-            for root, _, files in os.walk(extract_folder):
-                for f in files:
-                    if not f.startswith("."):
-                        sub_files.append((os.path.join(root, f), f))
-
-            total = 0
-            for p, n in sub_files:
-                res = process_pipeline(p, n, models, tbl_text, tbl_image, tbl_files)
-                if res["success"]:
-                    total += res["count"]
-            shutil.rmtree(extract_folder)
-            return {"success": True, "msg": f"解压入库 {total} 文件", "count": total, "status": "ok"}
-        except Exception as e:
-            return {"success": False, "msg": str(e), "count": 0, "status": "error"}
+        file_size = len(data) if data is not None else os.path.getsize(local_path)
+        register_file(f_hash, original_filename, file_size)
+    except Exception as e:
+        logger.warning(f"文件登记失败: {original_filename}, {e}")
 
     # 单文件
     try:
-        f_hash = calculate_file_hash(local_path)
         if not f_hash:
             return {"success": False, "msg": "文件hash计算失败", "count": 0, "status": "error"}
+        if on_stage:
+            on_stage("hashed", file_hash=f_hash)
 
+        upload_stats = {"upload_bytes": 0, "upload_secs": 0.0}
+        bucket = S3_CONFIG["raw_bucket"]
         s3_client = get_s3_client()
-        s3_uri = f"local://{original_filename}"
-        if s3_client:
-            try:
-                safe_name = _sanitize_filename(original_filename)
-                cat = _category_for_ext(ext)
-                # S3 里"目录"本质是 key 前缀，按日期/类型分组
-                today = datetime.now().strftime("%Y-%m-%d")
-                key = f"raw/{today}/{cat}/{uuid.uuid4().hex[:8]}_{safe_name}"
-                s3_client.upload_file(local_path, S3_CONFIG["raw_bucket"], key)
-                s3_uri = f"s3://{S3_CONFIG['raw_bucket']}/{key}"
-            except Exception as e:
-                logger.warning(f"S3上传失败，使用本地URI: {e}")
+        object_key = None
+        if s3_uri:
+            # 调用方已上传到内容寻址 key（如 SFTP 流式拉取）
+            if s3_uri.startswith("s3://"):
+                object_key = s3_uri[5:].split("/", 1)[1]
+        else:
+            s3_uri = f"local://{original_filename}"
+            if s3_client:
+                try:
+                    key = raw_object_key(f_hash, ext)
+                    # HEAD-before-PUT：相同内容已在桶中则跳过上传
+                    if object_exists(s3_client, bucket, key):
+                        logger.info(f"S3 已有相同内容，跳过上传: {key}")
+                    else:
+                        t0 = time.time()
+                        if data is not None:
+                            s3_client.upload_fileobj(io.BytesIO(data), bucket, key, Config=S3_TRANSFER_CONFIG)
+                        else:
+                            s3_client.upload_file(local_path, bucket, key, Config=S3_TRANSFER_CONFIG)
+                        upload_stats = {"upload_bytes": len(data) if data is not None else os.path.getsize(local_path),
+                                        "upload_secs": time.time() - t0}
+                        timer.add("upload", upload_stats["upload_secs"], upload_stats["upload_bytes"])
+                    s3_uri = f"s3://{bucket}/{key}"
+                    object_key = key
+                except Exception as e:
+                    logger.warning(f"S3上传失败，使用本地URI: {e}")
+        if s3_client and object_key:
+            put_index_marker(s3_client, bucket, f_hash, object_key, raw_index_key(f_hash, original_filename, ext))
+        if on_stage and object_key:
+            on_stage("uploaded", s3_uri=s3_uri)
 
         processed = False
+        text_stats = {"cache_hits": 0, "cache_misses": 0}
+        text_head = ""
 
         # 覆盖式重跑：同一 file_hash 先删旧记录，再写新记录（保证预览/检索一致）
         # 注意：为了避免删除后写入失败导致数据丢失，我们先准备好所有数据再删除
         if overwrite:
             logger.info(f"检测到重复文件，将覆盖: {original_filename}, hash={f_hash}")
 
-        # 1) 原始文件入 LanceDB（用于整文件预览/下载）
-        file_bytes = None
-        try:
-            # 检查文件大小，避免大文件占用过多内存
-            file_size = os.path.getsize(local_path)
-            max_file_size = MAX_FILE_SIZE_MB * 1024 * 1024  # 转换为字节
-
-            if file_size > max_file_size:
-                logger.warning(f"文件过大 ({file_size / 1024 / 1024:.2f}MB)，跳过存储到 files 表: {original_filename}")
-                # 大文件只存储元数据，不存储 bytes
-                file_row = {
-                    "file_hash": f_hash,
-                    "doc_name": original_filename,
-                    "doc_type": ext,
-                    "source_uri": s3_uri,
-                    "file_bytes": b"",  # 空 bytes
-                    "text_full": "",
-                }
-            else:
-                with open(local_path, "rb") as rf:
-                    file_bytes = rf.read()
-
-                if not file_bytes:
-                    logger.error(f"文件读取为空: {original_filename}")
-                    return {"success": False, "msg": "文件读取为空", "count": 0, "status": "error"}
-
-                file_row = {
-                    "file_hash": f_hash,
-                    "doc_name": original_filename,
-                    "doc_type": ext,
-                    "source_uri": s3_uri,
-                    "file_bytes": file_bytes,
-                    "text_full": "",
-                }
-
-            # 如果是覆盖模式，先删除旧的 files 表记录
-            if overwrite:
-                try:
-                    # 转义单引号避免 SQL 注入
-                    safe_hash = f_hash.replace("'", "''")
-                    tbl_files.delete(f"file_hash = '{safe_hash}'")
-                    logger.info(f"已删除旧的 files 表记录: hash={f_hash}")
-                except Exception as e:
-                    logger.warning(f"删除旧 files 表记录失败（可能不存在）: {e}")
-
-            # 准备并写入 files 表数据
-            tbl_files.add([file_row])
-            logger.info(f"files 表写入成功: {original_filename}, hash={f_hash}, size={file_size} bytes")
-        except Exception as e:
-            logger.error(f"files 表写入失败: {e}, file={original_filename}, hash={f_hash}")
-            import traceback
-            logger.error(traceback.format_exc())
-            # 如果 files 表写入失败，返回错误而不是继续处理
-            return {"success": False, "msg": f"files表写入失败: {str(e)}", "count": 0, "status": "error"}
+        # 1) 原始文件入 LanceDB（用于整文件预览/下载）；续跑时已写入的跳过
+        if not stored:
+            file_bytes = None
+            try:
+                # 检查文件大小，避免大文件占用过多内存
+                file_size = len(data) if data is not None else os.path.getsize(local_path)
+                max_file_size = MAX_FILE_SIZE_MB * 1024 * 1024  # 转换为字节
+
+                if file_size > max_file_size:
+                    logger.warning(f"文件过大 ({file_size / 1024 / 1024:.2f}MB)，跳过存储到 files 表: {original_filename}")
+                    # 大文件只存储元数据，不存储 bytes
+                    file_row = {
+                        "file_hash": f_hash,
+                        "doc_name": original_filename,
+                        "doc_type": ext,
+                        "source_uri": s3_uri,
+                        "file_bytes": b"",  # 空 bytes
+                        "text_full": "",
+                    }
+                else:
+                    if data is not None:
+                        file_bytes = data
+                    else:
+                        with open(local_path, "rb") as rf:
+                            file_bytes = rf.read()
+
+                    if not file_bytes:
+                        logger.error(f"文件读取为空: {original_filename}")
+                        return {"success": False, "msg": "文件读取为空", "count": 0, "status": "error"}
+
+                    file_row = {
+                        "file_hash": f_hash,
+                        "doc_name": original_filename,
+                        "doc_type": ext,
+                        "source_uri": s3_uri,
+                        "file_bytes": file_bytes,
+                        "text_full": "",
+                    }
+
+                # 如果是覆盖模式，先删除旧的 files 表记录
+                if overwrite:
+                    try:
+                        # 转义单引号避免 SQL 注入
+                        safe_hash = f_hash.replace("'", "''")
+                        tbl_files.delete(f"file_hash = '{safe_hash}'")
+                        logger.info(f"已删除旧的 files 表记录: hash={f_hash}")
+                    except Exception as e:
+                        logger.warning(f"删除旧 files 表记录失败（可能不存在）: {e}")
+
+                # 准备并写入 files 表数据
+                with timer.time("store", nbytes=len(file_row["file_bytes"]), rows=1):
+                    tbl_files.add([file_row])
+                logger.info(f"files 表写入成功: {original_filename}, hash={f_hash}, size={file_size} bytes")
+                if on_stage:
+                    on_stage("stored")
+            except Exception as e:
+                logger.error(f"files 表写入失败: {e}, file={original_filename}, hash={f_hash}")
+                import traceback
+                logger.error(traceback.format_exc())
+                # 如果 files 表写入失败，返回错误而不是继续处理
+                return {"success": False, "msg": f"files表写入失败: {str(e)}", "count": 0, "status": "error"}
 
-        # 2) 向量化入库（用于检索）
+        # 2) 向量化入库（用于检索）：按段流式切片、批量向量化、分批写入
         if ext in CONTENT_EXTS:
-            content, msg = extract_content(local_path, ext, models)
-            if content and content.strip():
-                # 如果是覆盖模式，先删除旧的 text 表记录
+            def drop_old_text():
+                # 如果是覆盖模式，先删除旧的 text 表记录（仅在确有新切片时）
                 if overwrite:
                     try:
                         # 转义单引号避免 SQL 注入
@@ -275,33 +617,33 @@ def process_pipeline(local_path, original_filename, models, tbl_text, tbl_image,
                     except Exception as e:
                         logger.warning(f"删除旧 text_chunks 表记录失败: {e}")
 
-                splitter = get_text_splitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-                chunks = splitter.split_text(content)
-                if chunks:
-                    vecs = models["text"].encode(chunks)
-                    data = [
-                        {
-                            "id": str(uuid.uuid4()),
-                            "vector": v,
-                            "text": c,
-                            "source_uri": s3_uri,
-                            "doc_name": original_filename,
-                            "doc_type": ext,
-                            "file_hash": f_hash,  # 直接写入，表一定有此列
-                        }
-                        for c, v in zip(chunks, vecs)
-                    ]
-                    tbl_text.add(data)
-                    logger.info(f"text_chunks 表写入成功: {len(chunks)} 个切片, hash={f_hash}")
-                    # 同步全文到 files 表（便于"整份文档"预览）
-                    # 这里用 update（若版本不支持则忽略，仍可下载原件）
-                    try:
-                        safe_hash = f_hash.replace("'", "''")
-                        tbl_files.update(where=f"file_hash = '{safe_hash}'", values={"text_full": content})
-                        logger.info(f"files 表 text_full 更新成功: hash={f_hash}")
-                    except Exception as e:
-                        logger.warning(f"files 表 text_full 更新失败: {e}")
-                    processed = True
+            row_base = {
+                "source_uri": s3_uri,
+                "doc_name": original_filename,
+                "doc_type": ext,
+                "file_hash": f_hash,  # 直接写入，表一定有此列
+            }
+            # 音视频的"抽取"即 Whisper 转录，单独成阶段便于评估 GPU 需求
+            extract_stage = "transcribe" if _category_for_ext(ext) in ("audio", "video") else "extract"
+            n_chunks, content, text_stats = _index_text_segments(
+                timer.wrap_iter(extract_stage, iter_content_segments(_as_source(local_path, data), ext, models)),
+                models, tbl_text, row_base, before_first_write=drop_old_text, timer=timer,
+            )
+            if n_chunks:
+                text_head = content[:ENTITY_SNIPPET_CHARS]
+                logger.info(
+                    f"text_chunks 表写入成功: {n_chunks} 个切片（"
+                    f"缓存命中 {text_stats['cache_hits']}/{text_stats['cache_hits'] + text_stats['cache_misses']}）, hash={f_hash}"
+                )
+                # 同步全文到 files 表（便于"整份文档"预览）
+                # 这里用 update（若版本不支持则忽略，仍可下载原件）
+                try:
+                    safe_hash = f_hash.replace("'", "''")
+                    tbl_files.update(where=f"file_hash = '{safe_hash}'", values={"text_full": content})
+                    logger.info(f"files 表 text_full 更新成功: hash={f_hash}")
+                except Exception as e:
+                    logger.warning(f"files 表 text_full 更新失败: {e}")
+                processed = True
 
         if ext in IMAGE_EXTS:
             try:
@@ -314,8 +656,9 @@ def process_pipeline(local_path, original_filename, models, tbl_text, tbl_image,
                     except Exception as e:
                         logger.warning(f"删除旧 image_chunks 表记录失败: {e}")
 
-                img = Image.open(local_path)
-                vec = models["clip_vision"].encode(img)
+                img = Image.open(_as_source(local_path, data))
+                with timer.time("image_embed", rows=1):
+                    vec = models["clip_vision"].encode(img)
                 row = {
                     "id": str(uuid.uuid4()),
                     "vector": vec,
@@ -324,7 +667,8 @@ def process_pipeline(local_path, original_filename, models, tbl_text, tbl_image,
                     "meta_info": "image_file",
                     "file_hash": f_hash,  # 直接写入，表一定有此列
                 }
-                tbl_image.add([row])
+                with timer.time("commit", rows=1):
+                    tbl_image.add([row])
                 logger.info(f"image_chunks 表写入成功: {original_filename}, hash={f_hash}")
                 processed = True
             except Exception as e:
@@ -341,39 +685,61 @@ def process_pipeline(local_path, original_filename, models, tbl_text, tbl_image,
                     except Exception as e:
                         logger.warning(f"删除旧 PDF 图像记录失败: {e}")
 
-                images = convert_from_path(local_path)
-                if images:
-                    vecs = models["clip_vision"].encode(images)
-                    data = [
-                        {
-                            "id": str(uuid.uuid4()),
-                            "vector": v,
-                            "source_uri": s3_uri,
-                            "doc_name": original_filename,
-                            "meta_info": f"Page {i+1}",
-                            "file_hash": f_hash,  # 直接写入，表一定有此列
-                        }
-                        for i, v in enumerate(vecs)
-                    ]
-                    tbl_image.add(data)
-                    logger.info(f"PDF 图像向量化成功: {len(images)} 页, hash={f_hash}")
+                # 分批渲染 → 编码 → 写入，内存中最多保留一批页面图像
+                n_pages = 0
+                with _spilled_path(_as_source(local_path, data), ".pdf") as pdf_path:
+                    for batch in timer.wrap_iter("pdf_render", iter_pdf_page_images(pdf_path)):
+                        if not batch:
+                            continue
+                        with timer.time("image_embed", rows=len(batch)):
+                            vecs = models["clip_vision"].encode([img for _, img in batch], batch_size=len(batch))
+                        rows = [
+                            {
+                                "id": str(uuid.uuid4()),
+                                "vector": v,
+                                "source_uri": s3_uri,
+                                "doc_name": original_filename,
+                                "meta_info": f"Page {page_no}",
+                                "file_hash": f_hash,  # 直接写入，表一定有此列
+                            }
+                            for (page_no, _), v in zip(batch, vecs)
+                        ]
+                        with timer.time("commit", rows=len(rows)):
+                            tbl_image.add(rows)
+                        n_pages += len(rows)
+                        for _, img in batch:
+                            img.close()
+                if n_pages:
+                    logger.info(f"PDF 图像向量化成功: {n_pages} 页, hash={f_hash}")
                     processed = True
             except Exception as e:
                 logger.warning(f"PDF 图像向量化失败: {e}")
 
         if processed:
             # 方式B：不落本地预览目录，原始文件已写入 LanceDB `files` 表
-            return {"success": True, "msg": ("覆盖OK" if overwrite else "OK"), "count": 1, "status": "ok"}
-        return {"success": False, "msg": "Skipped", "count": 0, "status": "skipped"}
+            # text_head 供调用方提交实体抽取，无需再次解析原文件
+            return {"success": True, "msg": ("覆盖OK" if overwrite else "OK"), "count": 1, "status": "ok",
+                    "cache_hits": text_stats["cache_hits"], "cache_misses": text_stats["cache_misses"],
+                    "file_hash": f_hash, "text_head": text_head, "stages": timer.as_rows(), **upload_stats}
+        return {"success": False, "msg": "Skipped", "count": 0, "status": "skipped", "stages": timer.as_rows()}
     except Exception as e:
         logger.exception("process_pipeline error: %s", e)
-        return {"success": False, "msg": str(e), "count": 0, "status": "error"}
+        return {"success": False, "msg": str(e), "count": 0, "status": "error", "error_type": type(e).__name__}
 
 
 def delete_file_by_hash(file_hash, tbl_text, tbl_image, tbl_files):
-    """删除文件的所有数据：file_registry + text_chunks + image_chunks + files 四张表"""
+    """删除文件的所有数据：file_registry + text_chunks + image_chunks + files 四张表 + S3 原始对象及索引标记"""
     safe_hash = file_hash.replace("'", "''")
     errors = []
+    source_uri = None
+    try:
+        df = tbl_files.search().where(f"file_hash = '{safe_hash}'").select(["source_uri"]).limit(1).to_pandas()
+        if not df.empty:
+            source_uri = df.iloc[0]["source_uri"]
+    except Exception as e:
+        logger.warning(f"读取 source_uri 失败: {e}")
+    if not delete_raw_objects(file_hash, source_uri):
+        errors.append("s3: 删除失败")
     for tbl, name in [(tbl_text, 'text_chunks'), (tbl_image, 'image_chunks'), (tbl_files, 'files')]:
         try:
             tbl.delete(f"file_hash = '{safe_hash}'")
@@ -387,173 +753,109 @@ def delete_file_by_hash(file_hash, tbl_text, tbl_image, tbl_files):
     return len(errors) == 0
 
 
-def extract_entities_llm(text, file_hash):
-    """调用 DeepSeek API 从文本中抽取实体，写入 file_entities 表。失败不阻塞主流程。"""
-    try:
-        from config import DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, DEEPSEEK_MODEL
-        import json
-        import urllib.request
-
-        if not DEEPSEEK_API_KEY or not text or not text.strip():
-            return
-
-        # 截取前 3000 字符避免 token 过长
-        snippet = text[:3000]
-        prompt = (
-            "请从以下文本中抽取关键实体（人名、地名、组织、技术术语等），"
-            "以 JSON 数组格式返回，每个元素包含 name 和 type 两个字段。"
-            "只返回 JSON 数组，不要其他内容。\n\n"
-            f"文本：{snippet}"
-        )
-
-        payload = json.dumps({
-            "model": DEEPSEEK_MODEL,
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.1,
-        }).encode("utf-8")
-
-        req = urllib.request.Request(
-            f"{DEEPSEEK_BASE_URL}/v1/chat/completions",
-            data=payload,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-            },
-        )
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            result = json.loads(resp.read().decode("utf-8"))
-
-        content = result["choices"][0]["message"]["content"].strip()
-        # 尝试提取 JSON 数组
-        if content.startswith("```"):
-            content = content.split("```")[1]
-            if content.startswith("json"):
-                content = content[4:]
-        entities_raw = json.loads(content)
-        if not isinstance(entities_raw, list):
-            return
-
-        entities = []
-        for e in entities_raw:
-            name = (e.get("name") or "").strip()
-            etype = (e.get("type") or "").strip()
-            if name:
-                entities.append((name, etype))
-
-        if entities:
-            insert_file_entities(file_hash, entities)
-            logger.info(f"实体抽取完成: hash={file_hash}, 共 {len(entities)} 个实体")
-    except Exception as e:
-        logger.warning(f"实体抽取失败（不影响主流程）: {e}")
+def log_upload_throughput(task_type, upload_bytes, upload_secs):
+    """记录一次任务的原始文件上传吞吐（各文件上传耗时之和，反映单连接有效带宽）"""
+    if upload_bytes and upload_secs:
+        logger.info(f"{task_type} 任务 S3 上传 {upload_bytes / 1024 / 1024:.1f}MB，"
+                    f"耗时 {upload_secs:.1f}s，吞吐 {upload_bytes / 1024 / 1024 / upload_secs:.1f}MB/s")
 
 
-def batch_process_local_files(file_paths, models, tbl_text, tbl_image, tbl_files, progress_callback=None):
+def batch_process_local_files(file_paths, models, tbl_text, tbl_image, tbl_files, progress_callback=None,
+                              result_callback=None, source="upload", job_id=None, lane=None):
     """处理本地文件路径列表（NiceGUI 等非 Streamlit 前端使用）。
     file_paths: list of (local_path, original_filename) 元组
+    result_callback: 可选，每个文件完成后以 ((local_path, original_filename), res) 回调
+    source: 失败记录的来源标记；失败文件登记到重试队列（临时文件移入 FAILED_DIR 保留）
+    job_id: 入库日志中的批次号（缺省新建）。每个文件的阶段推进写入 SQLite 日志，重启后由 ingest_journal 续跑；
+            续跑时已完成 hash/上传的文件直接复用日志中的 file_hash / s3_uri，已写入 files 表的文件不再重写
+    lane: 优先级通道 interactive / bulk / backfill，缺省按 source 取 INGEST_SOURCE_LANES
     返回: (succ, skip, dur, skipped_names)
     """
     start = time.time()
     total = len(file_paths)
     results = []
     skipped_names = []
+    job_id = job_id or uuid.uuid4().hex[:12]
+    lane = check_lane(lane or lane_for_source(source))
+    create_ingest_job(job_id, source, file_paths, lane=lane, owner=OWNER, lease_until=lease_deadline())
+    journal = get_journal_entries(job_id)
 
     def process_one(item):
         local_path, name = item
+        _, done_stage, done_hash, done_uri = journal.get(local_path, (None, None, None, None))
+
+        def on_stage(stage, file_hash=None, s3_uri=None):
+            journal_stage(job_id, local_path, stage, file_hash=file_hash, s3_uri=s3_uri)
+
         try:
-            res = process_pipeline(local_path, name, models, tbl_text, tbl_image, tbl_files)
-            # 异步实体抽取（成功入库的文本文件）
-            if res.get("status") == "ok":
-                try:
-                    ext = name.rsplit(".", 1)[-1].lower() if "." in name else ""
-                    if ext in CONTENT_EXTS:
-                        content, _ = extract_content(local_path, ext, models)
-                        if content and content.strip():
-                            f_hash = calculate_file_hash(local_path)
-                            extract_entities_llm(content, f_hash)
-                except Exception:
-                    pass
-            return res, name
+            res = process_pipeline(local_path, name, models, tbl_text, tbl_image, tbl_files,
+                                   f_hash=done_hash, s3_uri=done_uri, on_stage=on_stage,
+                                   stored=done_stage == "stored" and bool(done_hash))
+            # 异步实体抽取（成功入库的文本文件），入队即返回
+            if res.get("status") == "ok" and res.get("text_head"):
+                submit_entity_extraction(res["text_head"], res["file_hash"])
         except Exception as e:
             logger.error(f"处理文件失败: {name}, {e}")
-            return {"success": False, "msg": str(e), "count": 0, "status": "error"}, name
+            res = {"success": False, "msg": str(e), "count": 0, "status": "error", "error_type": type(e).__name__}
+        if res.get("status") == "error":
+            journal_stage(job_id, local_path, "failed", error_msg=res["msg"][:500])
+            record_failure(local_path, name, res, source=source)
+        else:
+            journal_stage(job_id, local_path, "committed", file_hash=res.get("file_hash"))
+        return res, item
 
     try:
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            futures = {executor.submit(process_one, item): item for item in file_paths}
-            for i, future in enumerate(as_completed(futures)):
-                try:
-                    res, name = future.result()
-                    results.append(res)
-                    if res.get("status") == "skipped":
-                        skipped_names.append(name)
-                    if progress_callback:
-                        progress_callback(i + 1, total, res["msg"])
-                except Exception as e:
-                    logger.error(f"获取任务结果失败: {e}")
-                    results.append({"success": False, "msg": str(e), "count": 0, "status": "error"})
+        # 共享调度器按预估内存准入：大文件等内存时小文件可先处理
+        scheduler = get_scheduler()
+        futures = {
+            scheduler.submit(process_one, item, cost=estimate_memory(item[0], item[1]), nbytes=_file_size(item[0]),
+                             lane=lane): item
+            for item in file_paths
+        }
+        for i, future in enumerate(as_completed(futures)):
+            try:
+                res, item = future.result()
+                results.append(res)
+                if res.get("status") == "skipped":
+                    skipped_names.append(item[1])
+                if result_callback:
+                    result_callback(item, res)
+                if progress_callback:
+                    progress_callback(i + 1, total, res["msg"])
+            except Exception as e:
+                logger.error(f"获取任务结果失败: {e}")
+                results.append({"success": False, "msg": str(e), "count": 0, "status": "error"})
     finally:
         pass  # 本地路径由调用方管理清理
+    finish_ingest_job(job_id)
 
     succ = sum(r["count"] for r in results if r["status"] == "ok")
     skip = sum(1 for r in results if r["status"] == "skipped")
     dur = time.time() - start
-    insert_task_stat("batch", total, succ, dur)
+    cache_hits = sum(r.get("cache_hits", 0) for r in results)
+    cache_misses = sum(r.get("cache_misses", 0) for r in results)
+    if cache_hits + cache_misses:
+        logger.info(f"切片向量缓存命中率: {cache_hits / (cache_hits + cache_misses):.1%} ({cache_hits}/{cache_hits + cache_misses})")
+    upload_bytes = sum(r.get("upload_bytes", 0) for r in results)
+    upload_secs = sum(r.get("upload_secs", 0) for r in results)
+    log_upload_throughput("batch", upload_bytes, upload_secs)
+    task_id = insert_task_stat("batch", total, succ, dur, embed_cache_hits=cache_hits,
+                               embed_cache_misses=cache_misses, upload_bytes=upload_bytes, upload_secs=upload_secs)
+    insert_stage_stats(task_id, [row for r in results for row in r.get("stages", [])])
     return succ, skip, dur, skipped_names
 
 
-def sftp_task(host, port, user, password, path, models, tbl_text, tbl_image, tbl_files, progress_callback=None):
-    logs = []
-    skipped_names = []
-    tr = None
-    try:
-        tr = paramiko.Transport((host, int(port)))
-        tr.connect(username=user, password=password)
-        sftp = paramiko.SFTPClient.from_transport(tr)
-        files = sftp.listdir(path)
-        logs.append(f"🔗 扫描到 {len(files)} 个文件")
-
-        local_fs = []
-        total_files = 0
-        for f in files:
-            if f.startswith("."):
-                continue
-            total_files += 1
-            try:
-                local_path = os.path.join(TEMP_DIR, f"{uuid.uuid4().hex[:8]}_{f}")
-                sftp.get(path.rstrip("/") + "/" + f, local_path)
-                local_fs.append((local_path, f))
-                if progress_callback:
-                    progress_callback(len(local_fs), total_files, f"下载: {f}")
-            except Exception:
-                logs.append(f"⚠️ 下载失败 {f}")
-
-        cnt = 0
-        for i, (local_path, name) in enumerate(local_fs):
-            res = process_pipeline(local_path, name, models, tbl_text, tbl_image, tbl_files)
-            if res["status"] == "ok":
-                cnt += res["count"]
-                # 异步实体抽取
-                try:
-                    ext = name.rsplit(".", 1)[-1].lower() if "." in name else ""
-                    if ext in CONTENT_EXTS:
-                        content, _ = extract_content(local_path, ext, models)
-                        if content and content.strip():
-                            f_hash = calculate_file_hash(local_path)
-                            extract_entities_llm(content, f_hash)
-                except Exception:
-                    pass
-            elif res["status"] == "skipped":
-                skipped_names.append(name)
-            if progress_callback:
-                progress_callback(i + 1, len(local_fs), f"处理: {name}")
-            if os.path.exists(local_path):
-                os.remove(local_path)
-        logs.append(f"🎉 入库 {cnt} 条")
-        if skipped_names:
-            logs.append(f"⏭️ 跳过 {len(skipped_names)} 个文件: {', '.join(skipped_names)}")
-    except Exception as e:
-        logs.append(f"🔴 {e}")
-    finally:
-        if tr:
-            tr.close()
-    return logs, skipped_names
+def sftp_task(host, port, user, password, path, models, tbl_text, tbl_image, tbl_files, progress_callback=None,
+              lane=None):
+    """递归增量同步 SFTP 目录（见 sftp_sync），返回 (logs, skipped_names)"""
+    from sftp_sync import sync_sftp
+
+    stats = sync_sftp(host, port, user, password, path, models, tbl_text, tbl_image, tbl_files,
+                      progress_callback=progress_callback, lane=lane)
+    logs = [f"🔗 扫描到 {stats['listed']} 个文件，{stats['unchanged']} 个未变化已跳过"]
+    for err in stats["errors"][:20]:
+        logs.append(f"⚠️ {err}")
+    logs.append(f"🎉 入库 {stats['count']} 条（{stats['ingested']} 个文件，耗时 {stats['duration']:.1f}s）")
+    if stats["skipped_names"]:
+        logs.append(f"⏭️ 跳过 {len(stats['skipped_names'])} 个文件: {', '.join(stats['skipped_names'])}")
+    return logs, stats["skipped_names"]
@@ -0,0 +1,640 @@
+# -*- coding: utf-8 -*-
+"""流式内容读取：按页/按段产出文本，避免整份文档驻留内存；长音视频按语音段并行转录"""
+
+import os
+import io
+import gzip
+import shutil
+import logging
+import tarfile
+import tempfile
+import threading
+import zipfile
+import subprocess
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+import pypdf
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+from config import (
+    PDF_PARALLEL_MIN_PAGES,
+    PDF_PAGES_PER_TASK,
+    PDF_EXTRACT_WORKERS,
+    PDF_RENDER_DPI,
+    PDF_RENDER_BATCH,
+    PDF_RENDER_THREADS,
+    PDF_RENDER_MAX_PAGES,
+    PDF_RENDER_SAMPLING,
+    CHUNK_SIZE,
+    TABLE_READ_ROWS,
+    TEXT_READ_BLOCK_CHARS,
+    TEMP_DIR,
+    ARCHIVE_MAX_MEMBERS,
+    ARCHIVE_MAX_TOTAL_MB,
+    ARCHIVE_INMEMORY_MAX_MB,
+    AUDIO_SAMPLE_RATE,
+    AUDIO_READ_BLOCK_SEC,
+    AUDIO_VAD_FRAME_MS,
+    AUDIO_VAD_MIN_DB,
+    AUDIO_VAD_MARGIN_DB,
+    AUDIO_VAD_MIN_SILENCE_SEC,
+    AUDIO_VAD_MIN_SPEECH_SEC,
+    AUDIO_VAD_PAD_SEC,
+    AUDIO_SEGMENT_MAX_SEC,
+    AUDIO_TRANSCRIBE_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+# PDF 解析进程池（全局复用，首次使用时创建）
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # spawn：fork 会复制主进程中持有锁的线程状态（调度器、LanceDB、模型线程），子进程可能卡死
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _pdf_pool
+
+
+def _reset_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown(wait=False, cancel_futures=True)
+        _pdf_pool = None
+
+
+def _extract_pdf_page_range(path, start, end):
+    """子进程任务：提取 [start, end) 页文本，返回 [(页码, 文本)]，页码从 1 开始"""
+    reader = pypdf.PdfReader(path)
+    return [(i + 1, reader.pages[i].extract_text() or "") for i in range(start, end)]
+
+
+def iter_pdf_page_texts(path):
+    """按页顺序产出 (页码, 文本)。
+
+    页数较多且 path 为本地路径时，按页段分发到进程池并行提取；
+    在途任务数受限，先完成的前几页可立即交给下游切片/向量化。
+    """
+    reader = pypdf.PdfReader(path)
+    n_pages = len(reader.pages)
+    if n_pages < PDF_PARALLEL_MIN_PAGES or PDF_EXTRACT_WORKERS <= 1 or not isinstance(path, str):
+        for i, page in enumerate(reader.pages):
+            yield i + 1, page.extract_text() or ""
+        return
+    del reader
+
+    ranges = deque(
+        (s, min(s + PDF_PAGES_PER_TASK, n_pages)) for s in range(0, n_pages, PDF_PAGES_PER_TASK)
+    )
+    window = PDF_EXTRACT_WORKERS * 2
+    pending = deque()
+    next_page = 0
+    try:
+        pool = _get_pdf_pool()
+        while ranges or pending:
+            while ranges and len(pending) < window:
+                s, e = ranges.popleft()
+                pending.append(pool.submit(_extract_pdf_page_range, path, s, e))
+            for page_no, text in pending.popleft().result():
+                next_page = page_no
+                yield page_no, text
+    except BrokenProcessPool as e:
+        # 子进程异常退出（如 OOM），剩余页回退为单进程顺序提取
+        logger.warning(f"PDF 并行提取进程池异常，回退顺序提取: {e}")
+        _reset_pdf_pool()
+        for page_no, text in _extract_pdf_page_range(path, next_page, n_pages):
+            yield page_no, text
+    finally:
+        for f in pending:
+            f.cancel()
+
+
+def iter_text_blocks(source, block_chars=TEXT_READ_BLOCK_CHARS):
+    """按固定字符数流式读取文本（UTF-8，忽略非法字节），source 为路径或二进制文件对象"""
+    if isinstance(source, str):
+        f = open(source, "r", encoding="utf-8", errors="ignore")
+    else:
+        f = io.TextIOWrapper(source, encoding="utf-8", errors="ignore")
+    with f:
+        for block in iter(lambda: f.read(block_chars), ""):
+            yield block
+
+
+def select_pdf_pages(n_pages, max_pages=PDF_RENDER_MAX_PAGES, policy=PDF_RENDER_SAMPLING):
+    """按上限与策略选出要渲染的页码（从 1 开始，升序）"""
+    if n_pages <= 0:
+        return []
+    if not max_pages or n_pages <= max_pages:
+        return list(range(1, n_pages + 1))
+    if policy == "head" or max_pages == 1:
+        return list(range(1, max_pages + 1))
+    # uniform：首尾必选，中间等距抽样
+    step = (n_pages - 1) / (max_pages - 1)
+    return sorted({1 + round(i * step) for i in range(max_pages)})
+
+
+def _pdf_page_count(path):
+    try:
+        return int(pdfinfo_from_path(path)["Pages"])
+    except Exception:
+        return len(pypdf.PdfReader(path).pages)
+
+
+def iter_pdf_page_images(path):
+    """分批产出 [(页码, PIL.Image)]，每批不超过 PDF_RENDER_BATCH 页。
+
+    以低 DPI 渲染，连续页段交给 pdftoppm 多线程处理；
+    超过 PDF_RENDER_MAX_PAGES 时按 PDF_RENDER_SAMPLING 取页。
+    """
+    pages = select_pdf_pages(_pdf_page_count(path))
+    for b in range(0, len(pages), PDF_RENDER_BATCH):
+        batch = pages[b:b + PDF_RENDER_BATCH]
+        # 把本批页码拆成连续页段，每段一次 pdftoppm 调用
+        runs = []
+        for p in batch:
+            if runs and p == runs[-1][1] + 1:
+                runs[-1][1] = p
+            else:
+                runs.append([p, p])
+        out = []
+        for first, last in runs:
+            images = convert_from_path(
+                path,
+                dpi=PDF_RENDER_DPI,
+                first_page=first,
+                last_page=last,
+                thread_count=max(1, min(PDF_RENDER_THREADS, last - first + 1)),
+            )
+            out.extend(zip(range(first, last + 1), images))
+        yield out
+
+
+# ---------- 音视频：VAD 分段 + 并行转录 ----------
+
+# 转录进程池（全局复用，首次使用时创建；每个子进程按调用方模型的 spec 各自加载一份同样的模型）
+# 用 spawn 启动：父进程已加载 torch/OpenMP 且有多个入库线程，fork 出的子进程可能卡在继承来的锁上
+_audio_pool = None
+_audio_pool_spec = None
+_audio_pool_lock = threading.Lock()
+_worker_transcriber = None
+
+
+def _init_audio_worker(spec):
+    """子进程初始化：多个转录进程平分 CPU（torch 与 CTranslate2 都不再按全部核数开线程），再加载模型"""
+    global _worker_transcriber
+    threads = max(1, (os.cpu_count() or 1) // AUDIO_TRANSCRIBE_WORKERS)
+    backend, size = spec
+    if backend == "openai":
+        import torch
+
+        torch.set_num_threads(threads)
+    from models_loader import load_transcriber
+
+    _worker_transcriber = load_transcriber(backend, size, cpu_threads=threads)
+
+
+def _get_audio_pool(spec):
+    global _audio_pool, _audio_pool_spec
+    with _audio_pool_lock:
+        if _audio_pool is not None and _audio_pool_spec != spec:
+            _audio_pool.shutdown(wait=False, cancel_futures=True)
+            _audio_pool = None
+        if _audio_pool is None:
+            _audio_pool = ProcessPoolExecutor(
+                max_workers=AUDIO_TRANSCRIBE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_audio_worker,
+                initargs=(spec,),
+            )
+            _audio_pool_spec = spec
+        return _audio_pool
+
+
+def _reset_audio_pool():
+    global _audio_pool
+    with _audio_pool_lock:
+        if _audio_pool is not None:
+            _audio_pool.shutdown(wait=False, cancel_futures=True)
+        _audio_pool = None
+
+
+def _transcribe_pcm(model, pcm):
+    audio = pcm.astype(np.float32) / 32768.0
+    return (model.transcribe(audio).get("text") or "").strip()
+
+
+def _transcribe_in_worker(pcm):
+    """子进程任务：转录一段 int16 PCM，返回文本（模型已在 _init_audio_worker 中加载）"""
+    return _transcribe_pcm(_worker_transcriber, pcm)
+
+
+def iter_pcm_blocks(path, block_sec=AUDIO_READ_BLOCK_SEC):
+    """ffmpeg 流式解码为 16kHz 单声道 int16 PCM，按块产出 ndarray（视频只取音轨）"""
+    cmd = ["ffmpeg", "-nostdin", "-v", "error", "-i", path, "-vn",
+           "-f", "s16le", "-ac", "1", "-ar", str(AUDIO_SAMPLE_RATE), "-"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        block_bytes = int(block_sec * AUDIO_SAMPLE_RATE) * 2
+        while True:
+            data = proc.stdout.read(block_bytes)
+            if not data:
+                break
+            yield np.frombuffer(data[:len(data) // 2 * 2], dtype=np.int16)
+        err = proc.stderr.read().decode("utf-8", errors="ignore").strip()
+        if proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg 解码失败: {err[-300:]}")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+
+def iter_speech_segments(blocks, stats=None):
+    """能量 VAD：从 PCM 块流中切出语音段，产出 (起始秒, 结束秒, int16 PCM)。
+
+    帧能量高于 max(AUDIO_VAD_MIN_DB, 底噪 + AUDIO_VAD_MARGIN_DB) 视为语音。底噪从安静假设起步，
+    每块向下跟到该块第 10 百分位、向上每块最多抬升 3dB，开头即连续讲话时不会把语音当成底噪；
+    静音超过 AUDIO_VAD_MIN_SILENCE_SEC 时结束一段，段长达到 AUDIO_SEGMENT_MAX_SEC 时在段尾 30% 内能量最低的帧处切开。
+    只保留当前段的样本，内存与录音时长无关。stats（可选 dict）填入 total_sec / speech_sec / segments。
+    """
+    sr = AUDIO_SAMPLE_RATE
+    flen = sr * AUDIO_VAD_FRAME_MS // 1000
+    fsec = flen / sr
+    pad = int(AUDIO_VAD_PAD_SEC / fsec)
+    min_sil = max(1, int(AUDIO_VAD_MIN_SILENCE_SEC / fsec))
+    min_speech = int(AUDIO_VAD_MIN_SPEECH_SEC / fsec)
+    max_len = max(2, int(AUDIO_SEGMENT_MAX_SEC / fsec))
+    stats = {} if stats is None else stats
+    stats.update(total_sec=0.0, speech_sec=0.0, segments=0)
+
+    win = np.empty(0, dtype=np.int16)  # 已分帧、尚需保留的样本，首帧编号 win_f0
+    win_db = np.empty(0)
+    win_f0 = 0
+    rest = np.empty(0, dtype=np.int16)  # 不足一帧的尾部样本
+    noise = AUDIO_VAD_MIN_DB - AUDIO_VAD_MARGIN_DB
+    n = 0  # 已处理帧数
+    seg_start, last_voice, last_end, voiced = None, -1, 0, 0
+
+    def emit(a, b, nvoiced):
+        if b <= a or nvoiced < min_speech:
+            return None
+        stats["speech_sec"] += (b - a) * fsec
+        stats["segments"] += 1
+        return a * fsec, b * fsec, win[(a - win_f0) * flen:(b - win_f0) * flen].copy()
+
+    for block in blocks:
+        pcm = np.concatenate([rest, block])
+        k = len(pcm) // flen
+        rest = pcm[k * flen:]
+        if not k:
+            continue
+        frames = pcm[:k * flen]
+        x = frames.reshape(k, flen).astype(np.float32) / 32768.0
+        db = 20 * np.log10(np.sqrt((x * x).mean(axis=1)) + 1e-10)
+        p10 = float(np.percentile(db, 10))
+        noise = min(p10, noise + 3.0)
+        thr = max(AUDIO_VAD_MIN_DB, noise + AUDIO_VAD_MARGIN_DB)
+        win = np.concatenate([win, frames])
+        win_db = np.concatenate([win_db, db])
+
+        for i in range(k):
+            f = n + i
+            if db[i] >= thr:
+                if seg_start is None:
+                    seg_start = max(f - pad, win_f0, last_end)
+                    voiced = 0
+                last_voice = f
+                voiced += 1
+            if seg_start is None:
+                continue
+            if f - last_voice >= min_sil:
+                end = min(last_voice + 1 + pad, f + 1)
+                out = emit(seg_start, end, voiced)
+                seg_start, last_end = None, end
+                if out:
+                    yield out
+            elif f + 1 - seg_start >= max_len:
+                lo = seg_start + int(max_len * 0.7)
+                end = lo + int(np.argmin(win_db[lo - win_f0:f + 1 - win_f0]))
+                end = end if end > seg_start else f + 1
+                out = emit(seg_start, end, voiced)
+                voiced = int((win_db[end - win_f0:f + 1 - win_f0] >= thr).sum())
+                seg_start = last_end = end
+                if out:
+                    yield out
+        n += k
+
+        keep_from = seg_start if seg_start is not None else max(n - pad, win_f0)
+        if keep_from > win_f0:
+            win = win[(keep_from - win_f0) * flen:]
+            win_db = win_db[keep_from - win_f0:]
+            win_f0 = keep_from
+
+    stats["total_sec"] = (n * flen + len(rest)) / sr
+    if seg_start is not None:
+        out = emit(seg_start, min(last_voice + 1 + pad, n), voiced)
+        if out:
+            yield out
+
+
+def _transcribe_segments(segments, model):
+    """按原顺序产出 (起始秒, 结束秒, 文本)。
+
+    AUDIO_TRANSCRIBE_WORKERS > 1 且 model 为 load_transcriber 加载的模型（带 spec）时，
+    分发到加载同一后端/规格模型的进程池并行转录，在途段数受限；队首段一完成即产出，后续段仍在转录时下游已可切片/向量化。
+    其他模型（如基准用的桩模型）在当前进程顺序转录。
+    """
+    spec = getattr(model, "spec", None)
+    if AUDIO_TRANSCRIBE_WORKERS <= 1 or spec is None:
+        for start, end, pcm in segments:
+            yield start, end, _transcribe_pcm(model, pcm)
+        return
+
+    window = AUDIO_TRANSCRIBE_WORKERS * 2
+    pending = deque()
+    seg = None
+    try:
+        pool = _get_audio_pool(spec)
+        for seg in segments:
+            pending.append((seg, pool.submit(_transcribe_in_worker, seg[2])))
+            seg = None
+            while pending and (len(pending) >= window or pending[0][1].done()):
+                (start, end, _), fut = pending[0]
+                text = fut.result()
+                pending.popleft()
+                yield start, end, text
+        while pending:
+            (start, end, _), fut = pending[0]
+            text = fut.result()
+            pending.popleft()
+            yield start, end, text
+    except BrokenProcessPool as e:
+        # 子进程异常退出（如 OOM），未完成的段及其后各段回退为当前进程顺序转录
+        logger.warning(f"转录进程池异常，回退顺序转录: {e}")
+        _reset_audio_pool()
+        todo = [s for s, _ in pending] + ([seg] if seg is not None else [])
+        pending.clear()
+        for start, end, pcm in todo:
+            yield start, end, _transcribe_pcm(model, pcm)
+        for start, end, pcm in segments:
+            yield start, end, _transcribe_pcm(model, pcm)
+    finally:
+        for _, f in pending:
+            f.cancel()
+
+
+def _format_ts(sec):
+    sec = int(sec)
+    return f"{sec // 3600:02d}:{sec % 3600 // 60:02d}:{sec % 60:02d}"
+
+
+def iter_audio_segments(path, model):
+    """长音频/视频按语音段转录，产出 (text, "HH:MM:SS-HH:MM:SS")。
+
+    静音段不送入模型；相邻语音段的转录文本合并到约 CHUNK_SIZE 字符再产出，meta_info 为合并后的起止时间。
+    """
+    stats = {}
+    buf, span = [], None
+    size = 0
+    for start, end, text in _transcribe_segments(iter_speech_segments(iter_pcm_blocks(path), stats), model):
+        if not text:
+            continue
+        span = (span[0] if span else start, end)
+        buf.append(text)
+        size += len(text)
+        if size >= CHUNK_SIZE:
+            yield " ".join(buf), f"{_format_ts(span[0])}-{_format_ts(span[1])}"
+            buf, span, size = [], None, 0
+    if buf:
+        yield " ".join(buf), f"{_format_ts(span[0])}-{_format_ts(span[1])}"
+    total = stats.get("total_sec", 0.0)
+    logger.info(
+        f"VAD 分段转录: 时长 {total:.0f}s，语音 {stats.get('speech_sec', 0.0):.0f}s（{stats.get('segments', 0)} 段），"
+        f"跳过静音 {1 - stats.get('speech_sec', 0.0) / total if total else 0:.0%}"
+    )
+
+
+def _format_row(values):
+    """单行紧凑文本：字段以 " | " 分隔，不做列宽对齐填充"""
+    return " | ".join("" if v is None else str(v).strip() for v in values)
+
+
+class _RowChunker:
+    """把表格行拼成带表头的文本块，每块不超过 max_chars，块边界始终落在行边界上"""
+
+    def __init__(self, header, label, max_chars=CHUNK_SIZE):
+        self.header = _format_row(header)
+        self.label = label
+        self.max_chars = max_chars
+        self.lines = []
+        self.size = len(self.header)
+        self.first_row = None
+        self.last_row = None
+
+    def add(self, row_no, values):
+        """追加一行（row_no 为数据行号，从 1 开始），块满时返回 [(text, meta_info)]"""
+        line = _format_row(values)
+        if not line.replace("|", "").strip():
+            return []
+        out = []
+        if self.lines and self.size + len(line) + 1 > self.max_chars:
+            out.append(self.flush())
+        if self.first_row is None:
+            self.first_row = row_no
+        self.lines.append(line)
+        self.size += len(line) + 1
+        self.last_row = row_no
+        return out
+
+    def flush(self):
+        text = "\n".join([self.header] + self.lines)
+        meta = f"{self.label} rows {self.first_row}-{self.last_row}".strip()
+        self.lines = []
+        self.size = len(self.header)
+        self.first_row = None
+        return text, meta
+
+    def finish(self):
+        return [self.flush()] if self.lines else []
+
+
+def _iter_csv_segments(path):
+    reader = pd.read_csv(path, chunksize=TABLE_READ_ROWS, dtype=str, keep_default_na=False)
+    chunker = None
+    row_no = 0
+    for df in reader:
+        if chunker is None:
+            chunker = _RowChunker(df.columns, "")
+        for values in df.itertuples(index=False, name=None):
+            row_no += 1
+            yield from chunker.add(row_no, values)
+    if chunker:
+        yield from chunker.finish()
+
+
+def _iter_xlsx_segments(path):
+    import openpyxl
+
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            chunker = None
+            row_no = 0
+            for values in ws.iter_rows(values_only=True):
+                if chunker is None:
+                    # 首个非空行作为表头
+                    if any(v is not None and str(v).strip() for v in values):
+                        chunker = _RowChunker(values, ws.title)
+                    continue
+                row_no += 1
+                yield from chunker.add(row_no, values)
+            if chunker:
+                yield from chunker.finish()
+    finally:
+        wb.close()
+
+
+def _iter_xls_segments(path):
+    # 旧版 xls 无流式读取接口，按工作表整体读入，但仍覆盖全部工作表
+    for sheet, df in pd.read_excel(path, sheet_name=None, dtype=str).items():
+        df = df.fillna("")
+        chunker = _RowChunker(df.columns, str(sheet))
+        for row_no, values in enumerate(df.itertuples(index=False, name=None), 1):
+            yield from chunker.add(row_no, values)
+        yield from chunker.finish()
+
+
+def _iter_parquet_segments(path):
+    import pyarrow.parquet as pq
+
+    pf = pq.ParquetFile(path)
+    header = pf.schema_arrow.names
+    row_no = 0
+    for rg in range(pf.num_row_groups):
+        # 以 row group 为边界：文本块不跨 row group
+        chunker = _RowChunker(header, f"row_group {rg}")
+        for batch in pf.iter_batches(batch_size=TABLE_READ_ROWS, row_groups=[rg]):
+            columns = batch.to_pydict()
+            for values in zip(*(columns[name] for name in header)):
+                row_no += 1
+                yield from chunker.add(row_no, values)
+        yield from chunker.finish()
+
+
+def iter_table_segments(path, ext):
+    """流式读取表格，产出 (带表头的行文本块, meta_info)，覆盖全部工作表"""
+    if ext == "csv":
+        return _iter_csv_segments(path)
+    if ext == "xlsx":
+        return _iter_xlsx_segments(path)
+    if ext == "xls":
+        return _iter_xls_segments(path)
+    if ext == "parquet":
+        return _iter_parquet_segments(path)
+    raise ValueError(f"不支持的表格格式: {ext}")
+
+
+def _member_payload(fobj, name, size, limit):
+    """读取成员内容：小文件返回 (bytes, None)，大文件流式写入临时文件返回 (None, path)。
+
+    size 未知（如普通 .gz）时先按内存上限试读；实际读出的字节数超过 limit
+    时抛出 ValueError（不信任归档头中的大小）。
+    """
+    inmemory_max = ARCHIVE_INMEMORY_MAX_MB * 1024 * 1024
+    head = b""
+    if size is None or size <= inmemory_max:
+        head = fobj.read(min(limit, inmemory_max) + 1)
+        if len(head) <= min(limit, inmemory_max):
+            return head, None
+        if len(head) > limit:
+            raise ValueError(f"压缩包解压后总大小超过上限 {ARCHIVE_MAX_TOTAL_MB}MB")
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix="arc_", suffix=f"_{os.path.basename(name)}", dir=TEMP_DIR)
+    written = len(head)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(head)
+            for block in iter(lambda: fobj.read(1024 * 1024), b""):
+                written += len(block)
+                if written > limit:
+                    raise ValueError(f"压缩包解压后总大小超过上限 {ARCHIVE_MAX_TOTAL_MB}MB")
+                out.write(block)
+    except Exception:
+        os.remove(tmp)
+        raise
+    return None, tmp
+
+
+def _skip_member(name):
+    base = os.path.basename(name)
+    return not base or base.startswith(".") or "__MACOSX/" in name
+
+
+def iter_archive_members(source, ext, name=""):
+    """直接从 zip/tar/gz 流中逐个读取成员，不解压到磁盘。
+
+    source: 本地路径或二进制文件对象
+    产出 (成员文件名, bytes 或 None, 临时文件路径或 None)；临时文件由调用方处理后删除。
+    超过 ARCHIVE_INMEMORY_MAX_MB 的成员有意落盘而不是以文件对象流式交给下游，原因见 config 中该项的说明。
+    超过 ARCHIVE_MAX_MEMBERS / ARCHIVE_MAX_TOTAL_MB 时抛出 ValueError。
+    """
+    max_total = ARCHIVE_MAX_TOTAL_MB * 1024 * 1024
+    total = 0
+    count = 0
+
+    def read_member(fobj, member_name, size):
+        nonlocal total, count
+        count += 1
+        if count > ARCHIVE_MAX_MEMBERS:
+            raise ValueError(f"压缩包成员数超过上限 {ARCHIVE_MAX_MEMBERS}")
+        data, tmp = _member_payload(fobj, member_name, size, max_total - total)
+        total += len(data) if data is not None else os.path.getsize(tmp)
+        return os.path.basename(member_name), data, tmp
+
+    if ext == "zip":
+        with zipfile.ZipFile(source, "r") as z:
+            for info in z.infolist():
+                if info.is_dir() or _skip_member(info.filename):
+                    continue
+                with z.open(info) as f:
+                    yield read_member(f, info.filename, info.file_size)
+        return
+
+    if hasattr(source, "seek"):
+        source.seek(0)
+    try:
+        # 流模式（r|*）顺序读取，无需随机访问
+        if isinstance(source, str):
+            t = tarfile.open(source, mode="r|*")
+        else:
+            t = tarfile.open(fileobj=source, mode="r|*")
+    except tarfile.ReadError:
+        if ext != "gz":
+            raise
+        # 普通 .gz（非 tar.gz）：只有一个成员
+        if hasattr(source, "seek"):
+            source.seek(0)
+        inner = name[:-3] if name.lower().endswith(".gz") else (name or "member")
+        with gzip.open(source, "rb") as f:
+            yield read_member(f, inner, None)
+        return
+
+    with t:
+        for m in t:
+            if not m.isfile() or _skip_member(m.name):
+                continue
+            f = t.extractfile(m)
+            if f is None:
+                continue
+            yield read_member(f, m.name, m.size)
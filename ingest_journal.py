@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""入库日志续跑：进程重启后继续处理未完成的上传批次
+
+batch_process_local_files 把每个文件的阶段推进（queued → hashed → uploaded → stored → committed/failed）
+写入 SQLite（ingest_jobs / ingest_journal）。启动时对仍为 running 的批次：
+- committed / failed 的文件跳过（失败文件已由重试队列接管）
+- 其余文件从最近完成的阶段继续：已算出的 file_hash、已上传的 s3_uri 直接复用，不再重复计算/上传；
+  已写入 files 表（stored）的文件直接进入切片/向量写入
+- 原始文件已不存在的标记为 failed
+目录监听、SFTP、S3 同步批次不续跑：监听器启动时全量扫描，同步按清单/断点重新拉取，未完成的文件会重新提交
+续跑前先认领批次（见 ingest_lease），同一 DB_PATH 上的多个进程不会重复续跑；
+被其他存活进程持有的批次等其结束或租约过期后再判断是否接手
+"""
+
+import os
+import time
+import logging
+import threading
+
+from config import TEMP_DIR, INGEST_LEASE_SEC
+from database import get_unfinished_jobs, get_journal_entries, journal_stage, finish_ingest_job
+from ingest_lease import claim_job
+
+logger = logging.getLogger(__name__)
+
+_DONE_STAGES = ("committed", "failed")
+_RESCAN_SOURCES = ("watch", "sftp", "s3")
+
+
+def _cleanup_temp(paths):
+    # 上传批次的临时文件在原进程中来不及清理，这里补上（失败文件已移入 FAILED_DIR）
+    for path in paths:
+        if os.path.abspath(path).startswith(os.path.abspath(TEMP_DIR) + os.sep) and os.path.exists(path):
+            os.remove(path)
+
+
+def resume_job(job_id, source, get_resources, lane=None):
+    """续跑一个批次（沿用原批次的优先级通道），返回本次重新处理的文件数；批次被其他进程持有时返回 None"""
+    from etl import batch_process_local_files
+
+    if not claim_job(job_id):
+        return None
+    entries = get_journal_entries(job_id)
+    if source in _RESCAN_SOURCES:
+        finish_ingest_job(job_id)
+        _cleanup_temp(entries)
+        return 0
+    todo = []
+    for path, (name, stage, _, _) in entries.items():
+        if stage in _DONE_STAGES:
+            continue
+        if not os.path.exists(path):
+            journal_stage(job_id, path, "failed", error_msg="重启后原始文件已不存在")
+            continue
+        todo.append((path, name))
+    if not todo:
+        finish_ingest_job(job_id)
+        _cleanup_temp(entries)
+        return 0
+
+    done = len(entries) - len(todo)
+    logger.info(f"续跑入库批次 {job_id}（{source}）: 已完成 {done}，待处理 {len(todo)}")
+    models, tbl_text, tbl_image, tbl_files = get_resources()
+    try:
+        batch_process_local_files(todo, models, tbl_text, tbl_image, tbl_files, source=source, job_id=job_id,
+                                  lane=lane)
+    finally:
+        _cleanup_temp(entries)
+    return len(todo)
+
+
+def start_resume(get_resources):
+    """启动时调用：在后台线程续跑启动前就已存在的未完成批次"""
+    jobs = get_unfinished_jobs()  # 先同步取快照，避免把启动后新建的批次当成中断批次
+    if not jobs:
+        return None
+
+    def run():
+        waiting = jobs
+        while waiting:
+            held = []
+            for job_id, source, lane in waiting:
+                try:
+                    if resume_job(job_id, source, get_resources, lane=lane) is None:
+                        held.append((job_id, source, lane))
+                except Exception as e:
+                    logger.error(f"续跑入库批次失败: {job_id}, {e}")
+            if not held:
+                break
+            # 其他进程持有的批次：等一个租约周期后，仍未完成的再尝试认领
+            time.sleep(INGEST_LEASE_SEC)
+            running = {job_id for job_id, _, _ in get_unfinished_jobs()}
+            waiting = [job for job in held if job[0] in running]
+
+    t = threading.Thread(target=run, name="ingest-resume", daemon=True)
+    t.start()
+    return t
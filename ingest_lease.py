@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""入库认领租约：多个进程共用同一个 DB_PATH 时，续跑批次、重试失败记录前先在 SQLite 中认领
+
+FastAPI 后端与 NiceGUI 前端启动时都会续跑未完成批次并轮询到期的失败记录。
+认领是一条条件 UPDATE（无主、本进程持有或租约已过期时才改写 owner），只有认领成功的进程处理；
+持有期间后台线程每 INGEST_LEASE_SEC / 3 续租一次，进程退出或崩溃后租约过期，其他进程可接手。
+"""
+
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+
+from config import INGEST_LEASE_SEC
+from database import claim_ingest_job, claim_ingest_failure, release_ingest_failure, renew_leases
+
+logger = logging.getLogger(__name__)
+
+# 进程标识：带随机后缀，重启后 pid 复用也不会误认为仍持有旧租约
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_heartbeat = None
+_heartbeat_lock = threading.Lock()
+
+
+def lease_deadline():
+    """新租约的到期时间，并确保续租线程已启动"""
+    _ensure_heartbeat()
+    return time.time() + INGEST_LEASE_SEC
+
+
+def claim_job(job_id):
+    """认领入库批次，返回是否认领到"""
+    return claim_ingest_job(job_id, OWNER, lease_deadline(), time.time())
+
+
+def claim_failure(failure_id):
+    """认领失败记录，返回是否认领到"""
+    return claim_ingest_failure(failure_id, OWNER, lease_deadline(), time.time())
+
+
+def release_failure(failure_id):
+    release_ingest_failure(failure_id, OWNER)
+
+
+def _renew_loop():
+    while True:
+        time.sleep(INGEST_LEASE_SEC / 3)
+        try:
+            renew_leases(OWNER, time.time() + INGEST_LEASE_SEC)
+        except Exception as e:
+            logger.warning(f"续租失败（稍后再试）: {e}")
+
+
+def _ensure_heartbeat():
+    global _heartbeat
+    with _heartbeat_lock:
+        if _heartbeat is None or not _heartbeat.is_alive():
+            _heartbeat = threading.Thread(target=_renew_loop, name="ingest-lease", daemon=True)
+            _heartbeat.start()
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""入库失败重试与死信
+
+- 失败文件登记到 SQLite ingest_failures（错误类别、异常类型、信息、重试次数、下次重试时间）
+- 瞬时错误（网络、超时、存储/模型暂不可用）按指数退避自动重试，超过 INGEST_MAX_RETRIES 转入死信
+- 永久错误（格式损坏、解析失败、空文件等）直接进死信，可在修复后手动重新投递
+- 临时目录中的失败文件移到 FAILED_DIR 保留，成功或丢弃时删除；TEMP_DIR 中超期的残留文件定期清理
+"""
+
+import os
+import time
+import uuid
+import shutil
+import logging
+import threading
+
+from config import (
+    TEMP_DIR,
+    FAILED_DIR,
+    INGEST_MAX_RETRIES,
+    INGEST_RETRY_BASE_SEC,
+    INGEST_RETRY_MAX_SEC,
+    INGEST_RETRY_INTERVAL,
+    INGEST_TEMP_MAX_AGE_SEC,
+)
+from scheduler import get_scheduler, estimate_memory, lane_for_source
+from ingest_lease import claim_failure, release_failure
+from database import (
+    insert_ingest_failure,
+    update_ingest_failure,
+    get_ingest_failures,
+    get_ingest_failure,
+    delete_ingest_failure,
+)
+
+logger = logging.getLogger(__name__)
+
+_TRANSIENT_TYPES = {
+    "ConnectionError", "ConnectionResetError", "ConnectionRefusedError", "ConnectionAbortedError",
+    "BrokenPipeError", "TimeoutError", "timeout", "ReadTimeout", "ConnectTimeout", "ReadTimeoutError",
+    "EndpointConnectionError", "ConnectTimeoutError", "ProtocolError", "SSHException",
+    "OutOfMemoryError", "MemoryError", "RuntimeError",
+}
+_PERMANENT_TYPES = {
+    "ValueError", "TypeError", "KeyError", "IndexError", "UnicodeDecodeError", "UnicodeError",
+    "BadZipFile", "PdfReadError", "PdfStreamError", "UnidentifiedImageError", "ParserError",
+    "EmptyDataError", "FileNotFoundError", "IsADirectoryError", "NotImplementedError",
+}
+_TRANSIENT_WORDS = (
+    "timeout", "timed out", "connection", "temporarily", "unavailable", "throttl", "slowdown",
+    "too many requests", "503", "502", "504", "429", "reset by peer", "out of memory",
+    "不可达", "超时", "连接失败", "资源加载失败",
+)
+_PERMANENT_WORDS = ("文件读取为空", "不支持", "损坏", "corrupt", "invalid", "cannot identify", "hash计算失败")
+
+_inflight = set()
+_inflight_lock = threading.Lock()
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+
+def classify_error(error_type, error_msg):
+    """返回 "transient"（值得自动重试）或 "permanent"（进死信）；无法判断时按瞬时处理，由重试上限兜底"""
+    msg = (error_msg or "").lower()
+    if any(w in msg for w in _PERMANENT_WORDS):
+        return "permanent"
+    if error_type in _TRANSIENT_TYPES or any(w in msg for w in _TRANSIENT_WORDS):
+        return "transient"
+    if error_type in _PERMANENT_TYPES:
+        return "permanent"
+    return "transient"
+
+
+def backoff_delay(attempts):
+    """第 attempts 次失败后的等待时间：30s, 60s, 120s, ... 封顶 INGEST_RETRY_MAX_SEC"""
+    return min(INGEST_RETRY_MAX_SEC, INGEST_RETRY_BASE_SEC * (2 ** max(attempts - 1, 0)))
+
+
+def _is_temp(path):
+    return bool(path) and os.path.abspath(path).startswith(os.path.abspath(TEMP_DIR) + os.sep)
+
+
+def _is_kept(path):
+    return bool(path) and os.path.abspath(path).startswith(os.path.abspath(FAILED_DIR) + os.sep)
+
+
+def _keep_file(local_path):
+    """临时目录里的文件移到 FAILED_DIR（调用方随后清理临时文件时不会删掉待重试的文件）；其他路径原地保留"""
+    if not _is_temp(local_path) or not os.path.exists(local_path):
+        return local_path
+    os.makedirs(FAILED_DIR, exist_ok=True)
+    dst = os.path.join(FAILED_DIR, os.path.basename(local_path))
+    try:
+        shutil.move(local_path, dst)
+        return dst
+    except OSError as e:
+        logger.warning(f"保留失败文件出错: {local_path}, {e}")
+        return local_path
+
+
+def _keep_bytes(data, original_filename):
+    """只在内存中的文件（SFTP/S3 拉取的小文件等）写入 FAILED_DIR 保留，返回路径；写入失败返回 None"""
+    os.makedirs(FAILED_DIR, exist_ok=True)
+    path = os.path.join(FAILED_DIR, f"{uuid.uuid4().hex[:8]}_{os.path.basename(original_filename)}")
+    try:
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+    except OSError as e:
+        logger.warning(f"保留失败文件出错: {original_filename}, {e}")
+        return None
+
+
+def _discard_file(path):
+    if _is_kept(path) and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"删除失败文件出错: {path}, {e}")
+
+
+def _schedule(failure_id, attempts, error_type, error_msg):
+    error_class = classify_error(error_type, error_msg)
+    dead = error_class == "permanent" or attempts > INGEST_MAX_RETRIES
+    update_ingest_failure(
+        failure_id,
+        attempts=attempts,
+        error_class=error_class,
+        error_type=error_type,
+        error_msg=(error_msg or "")[:2000],
+        status="dead" if dead else "retrying",
+        next_retry_at=None if dead else time.time() + backoff_delay(attempts),
+    )
+    return "dead" if dead else "retrying"
+
+
+def record_failure(local_path, original_filename, res, source="upload", data=None):
+    """登记一次入库失败，返回记录 id。同一路径已有未解决的记录时累加重试次数。
+    data: 只在内存中的文件字节（local_path 为 None），落盘到 FAILED_DIR 后可重试；
+    两者都没有（如远端下载失败）时直接记为死信，由下次同步重新拉取"""
+    if local_path is None and data is not None:
+        local_path = _keep_bytes(data, original_filename)
+    else:
+        local_path = _keep_file(local_path)
+    error_type = res.get("error_type") or ""
+    error_msg = res.get("msg") or ""
+    existing = [r for r in get_ingest_failures(local_path=local_path, limit=5)
+                if r["status"] != "resolved"] if local_path else []
+    if existing:
+        row = existing[0]
+        status = _schedule(row["id"], row["attempts"] + 1, error_type, error_msg)
+        failure_id = row["id"]
+    else:
+        error_class = classify_error(error_type, error_msg)
+        status = "dead" if error_class == "permanent" or not local_path else "retrying"
+        failure_id = insert_ingest_failure(
+            local_path, original_filename, source, error_class, error_type, error_msg[:2000], status,
+            time.time() + backoff_delay(1) if status == "retrying" else None,
+        )
+    logger.warning(f"入库失败已登记: {original_filename}（{error_type or '未知'}: {error_msg[:200]}）-> {status}")
+    return failure_id
+
+
+def _submit_retry(row, models, tbl_text, tbl_image, tbl_files):
+    """占用一条失败记录并把重试提交给调度器，返回 (future, None)；
+    记录正在重试（本进程或其他进程已认领）或文件已不存在时不提交，返回 (None, 结果)"""
+    from etl import process_pipeline
+
+    with _inflight_lock:
+        if row["id"] in _inflight:
+            return None, {"success": False, "msg": "正在重试中", "count": 0, "status": "busy"}
+        _inflight.add(row["id"])
+    path = row["local_path"]
+    fut = None
+    try:
+        if not claim_failure(row["id"]):
+            return None, {"success": False, "msg": "其他进程正在重试", "count": 0, "status": "busy"}
+        if not path or not os.path.exists(path):
+            update_ingest_failure(row["id"], status="dead", error_class="permanent", error_type="FileNotFoundError",
+                                  error_msg="原始文件已不存在，无法重试", next_retry_at=None)
+            return None, {"success": False, "msg": "原始文件已不存在", "count": 0, "status": "error"}
+        # 重试走 backfill 通道，不与交互上传、批量同步争抢名额
+        fut = get_scheduler().submit(
+            process_pipeline, path, row["original_filename"], models, tbl_text, tbl_image, tbl_files,
+            cost=estimate_memory(path, row["original_filename"]), nbytes=os.path.getsize(path),
+            lane=lane_for_source("retry"),
+        )
+        return fut, None
+    except Exception as e:
+        res = {"success": False, "msg": str(e), "count": 0, "status": "error", "error_type": type(e).__name__}
+        status = _schedule(row["id"], row["attempts"] + 1, res["error_type"], res["msg"])
+        logger.info(f"重试提交失败: {row['original_filename']}（第 {row['attempts'] + 1} 次）-> {status}")
+        return None, res
+    finally:
+        if fut is None:  # 已提交的由 _finish_retry 释放
+            release_failure(row["id"])
+            with _inflight_lock:
+                _inflight.discard(row["id"])
+
+
+def _finish_retry(row, fut):
+    """等待重试结果并更新记录，返回 process_pipeline 结果"""
+    from entity_extractor import submit_entity_extraction
+
+    path = row["local_path"]
+    try:
+        try:
+            res = fut.result()
+        except Exception as e:
+            res = {"success": False, "msg": str(e), "count": 0, "status": "error", "error_type": type(e).__name__}
+        if res["status"] == "error":
+            status = _schedule(row["id"], row["attempts"] + 1, res.get("error_type") or "", res["msg"])
+            logger.info(f"重试失败: {row['original_filename']}（第 {row['attempts'] + 1} 次）-> {status}")
+            return res
+        update_ingest_failure(row["id"], status="resolved", next_retry_at=None)
+        _discard_file(path)
+        if res["status"] == "ok" and res.get("text_head"):
+            submit_entity_extraction(res["text_head"], res["file_hash"])
+        logger.info(f"重试成功: {row['original_filename']}")
+        return res
+    finally:
+        release_failure(row["id"])
+        with _inflight_lock:
+            _inflight.discard(row["id"])
+
+
+def retry_failure(row, models, tbl_text, tbl_image, tbl_files):
+    """重试一条失败记录，返回 process_pipeline 结果；同一记录不会被并发重试"""
+    fut, res = _submit_retry(row, models, tbl_text, tbl_image, tbl_files)
+    return res if fut is None else _finish_retry(row, fut)
+
+
+def retry_due(get_resources, limit=50):
+    """重试所有到期的瞬时失败记录。get_resources() 返回 (models, tbl_text, tbl_image, tbl_files)，
+    只在有到期记录时调用，避免空闲时加载模型。返回本轮处理条数"""
+    rows = get_ingest_failures(status="retrying", due_before=time.time(), limit=limit)
+    if not rows:
+        return 0
+    models, tbl_text, tbl_image, tbl_files = get_resources()
+    # 先全部提交（先失败的先提交）再逐个收结果，单个慢文件不拖住整轮
+    pending = []
+    for row in reversed(rows):
+        fut, _ = _submit_retry(row, models, tbl_text, tbl_image, tbl_files)
+        if fut is not None:
+            pending.append((row, fut))
+    for row, fut in pending:
+        _finish_retry(row, fut)
+    return len(rows)
+
+
+def redrive_failure(failure_id, get_resources):
+    """手动重新投递（含死信）：清零重试次数后立即重试一次"""
+    row = get_ingest_failure(failure_id)
+    if not row or row["status"] == "resolved":
+        return None
+    row["attempts"] = 0
+    return retry_failure(row, *get_resources())
+
+
+def redrive_all_dead():
+    """把全部死信重新放回重试队列（清零重试次数，立即到期），由后台重试线程处理；返回条数"""
+    rows = get_ingest_failures(status="dead", limit=100000)
+    now = time.time()
+    for row in rows:
+        update_ingest_failure(row["id"], status="retrying", attempts=0, next_retry_at=now)
+    return len(rows)
+
+
+def discard_failure(failure_id):
+    """放弃一条失败记录：删除保留的文件和记录"""
+    row = get_ingest_failure(failure_id)
+    if not row:
+        return False
+    _discard_file(row["local_path"])
+    return delete_ingest_failure(failure_id)
+
+
+def sweep_temp_dir(max_age=INGEST_TEMP_MAX_AGE_SEC):
+    """清理 TEMP_DIR 中超期的残留文件（进程崩溃、任务中断留下的），返回删除个数"""
+    if not os.path.isdir(TEMP_DIR):
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for name in os.listdir(TEMP_DIR):
+        p = os.path.join(TEMP_DIR, name)
+        try:
+            if os.path.isfile(p) and os.path.getmtime(p) < cutoff:
+                os.remove(p)
+                removed += 1
+        except OSError:
+            pass
+    if removed:
+        logger.info(f"清理临时目录残留文件 {removed} 个")
+    return removed
+
+
+def _loop(get_resources):
+    last_sweep = 0
+    while True:
+        time.sleep(INGEST_RETRY_INTERVAL)
+        try:
+            if time.time() - last_sweep > 3600:
+                sweep_temp_dir()
+                last_sweep = time.time()
+            retry_due(get_resources)
+        except Exception as e:
+            logger.warning(f"失败重试轮询出错（稍后再试）: {e}")
+
+
+def start_retry_loop(get_resources):
+    """启动后台重试线程（进程内只启动一个）"""
+    global _loop_thread
+    with _loop_lock:
+        if _loop_thread is not None and _loop_thread.is_alive():
+            return _loop_thread
+        _loop_thread = threading.Thread(target=_loop, args=(get_resources,), name="ingest-retry", daemon=True)
+        _loop_thread.start()
+        return _loop_thread
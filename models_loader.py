@@ -1,11 +1,26 @@
 # -*- coding: utf-8 -*-
 """AI 模型与 LanceDB 连接"""
 
+import re
 import logging
+import itertools
+import threading
+import weakref
+from functools import lru_cache
+
 import pyarrow as pa
 import lancedb
 
-from config import LANCE_DB_URI, S3_CONFIG
+from config import (
+    LANCE_DB_URI,
+    S3_CONFIG,
+    TOKEN_LENGTH_CACHE_SIZE,
+    WHISPER_BACKEND,
+    WHISPER_MODEL_SIZE,
+    WHISPER_COMPUTE_TYPE,
+    WHISPER_CPU_THREADS,
+    WHISPER_BEAM_SIZE,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -14,57 +29,390 @@ try:
 except ImportError:
     from langchain.text_splitter import RecursiveCharacterTextSplitter
 
-def get_text_splitter(chunk_size=500, chunk_overlap=50):
+# 分词器登记表：token 计长缓存以登记序号为键，避免把分词器对象放进缓存键。
+# 两张表都只持弱引用，分词器（随模型）释放后自动注销；序号不复用，不会命中已释放分词器的缓存。
+_tokenizers = weakref.WeakValueDictionary()
+_tokenizer_keys = weakref.WeakKeyDictionary()
+_tokenizer_seq = itertools.count()
+
+
+def _register_tokenizer(tokenizer):
+    key = _tokenizer_keys.get(tokenizer)
+    if key is None:
+        key = next(_tokenizer_seq)
+        _tokenizer_keys[tokenizer] = key
+        _tokenizers[key] = tokenizer
+    return key
+
+
+def _token_len(tokenizer_id, text):
+    return len(_tokenizers[tokenizer_id].encode(text, add_special_tokens=False))
+
+
+# 只缓存短片段（见 _TokenBudgetSplitter._length）：缓存键持有整段文本，长片段会把大缓冲留在内存里
+_cached_token_len = lru_cache(maxsize=TOKEN_LENGTH_CACHE_SIZE)(_token_len)
+
+
+class _TokenBudgetSplitter(RecursiveCharacterTextSplitter):
+    """按 token 计长的递归切分，并保证每个切片不超过 chunk_size 个 token。
+
+    递归切分按片段 token 数相加估算长度，拼接处可能多出少量 token，
+    这里对超限切片再按分词偏移硬切，确保送入模型时不被截断。
+    """
+
+    def __init__(self, tokenizer, chunk_size, chunk_overlap):
+        super().__init__(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=self._length,
+        )
+        self._tokenizer = tokenizer
+        self._tokenizer_id = _register_tokenizer(tokenizer)
+        # 反复计长的是切片及其组成片段，都在 chunk_size 个 token 量级；更长的文本只算一次，不进缓存
+        self._cache_max_chars = 8 * chunk_size
+
+    def _length(self, text):
+        if len(text) <= self._cache_max_chars:
+            return _cached_token_len(self._tokenizer_id, text)
+        return _token_len(self._tokenizer_id, text)
+
+    def _hard_split(self, text):
+        enc = self._tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        offsets = enc["offset_mapping"]
+        out = []
+        for i in range(0, len(offsets), self._chunk_size):
+            window = offsets[i:i + self._chunk_size]
+            piece = text[window[0][0]:window[-1][1]].strip()
+            if piece:
+                out.append(piece)
+        return out
+
+    def _fit_budget(self, chunks):
+        out = []
+        for c in chunks:
+            if self._length(c) > self._chunk_size:
+                out.extend(self._hard_split(c))
+            else:
+                out.append(c)
+        return out
+
+    def split_text(self, text):
+        return self._fit_budget(super().split_text(text))
+
+
+def get_text_splitter(chunk_size=500, chunk_overlap=50, tokenizer=None):
+    """文本切分器。
+
+    tokenizer 为空时按字符计长；传入文本模型的（fast）分词器时按 token 计长，
+    此时 chunk_size/chunk_overlap 的单位是 token。
+    """
+    if tokenizer is not None:
+        return _TokenBudgetSplitter(tokenizer, chunk_size, chunk_overlap)
     return RecursiveCharacterTextSplitter(
         chunk_size=chunk_size, chunk_overlap=chunk_overlap
     )
 
 
-def _load_models():
+def get_model_text_splitter(text_model, mode="char", chunk_size=500, chunk_overlap=50, token_overlap=32):
+    """按配置的分块模式为文本模型创建切分器。
+
+    mode="token" 时切片上限取模型 max_seq_length 减去首尾特殊 token，
+    模型不带分词器时回退为按字符切分。
+    """
+    tokenizer = getattr(text_model, "tokenizer", None)
+    if mode == "token" and tokenizer is not None:
+        max_len = getattr(text_model, "max_seq_length", None) or 512
+        return get_text_splitter(max_len - 2, token_overlap, tokenizer=tokenizer)
+    return get_text_splitter(chunk_size, chunk_overlap)
+
+
+# 增量切片时缓冲末尾这么多字符内的分隔符暂不判断（分隔符可能跨段，如 "\n" + "\n"）
+_SEP_LOOKAHEAD = 16
+
+
+def _sep_pattern(splitter, sep):
+    return sep if splitter._is_separator_regex else re.escape(sep)
+
+
+def _first_sep_level(splitter, text):
+    """与 RecursiveCharacterTextSplitter._split_text 相同的规则：文本中出现的第一个分隔符的层级"""
+    seps = splitter._separators
+    for i, sep in enumerate(seps):
+        if not sep or re.search(_sep_pattern(splitter, sep), text):
+            return i
+    return len(seps) - 1
+
+
+def _sep_starts(splitter, sep, text):
+    """分隔符各次出现的起点（不含开头）；与切分时一样从头非重叠匹配（如连续换行），片段边界才对得上"""
+    return [m.start() for m in re.finditer(_sep_pattern(splitter, sep), text) if m.start() > 0]
+
+
+def _open_doc_start(splitter, pieces, sep):
+    """按 _split_text / _merge_splits 的贪心合并规则只计长度，返回合并结束时尚未输出的切片的首个片段下标；
+    最后一个片段超长（走递归切分）时没有未输出的合并切片，返回 None"""
+    length = splitter._length_function
+    size, overlap = splitter._chunk_size, splitter._chunk_overlap
+    sep_len = length("" if splitter._keep_separator else sep)
+    start = total = 0  # 合并中的切片为 pieces[start:i]
+    for i, piece in enumerate(pieces):
+        n = length(piece)
+        if n >= size:
+            start, total = i + 1, 0
+            continue
+        if i > start and total + n + sep_len > size:
+            while start < i and (total > overlap or (total + n + (sep_len if i > start else 0) > size and total > 0)):
+                total -= length(pieces[start]) + (sep_len if i - start > 1 else 0)
+                start += 1
+        total += n + (sep_len if i > start else 0)
+    return start if start < len(pieces) else None
+
+
+def _stream_step(splitter, buf, base, level, final=False):
+    """增量切片的一步：返回 (已确定的原始切片, 剩余缓冲, 新层级)，无进展时切片为空、缓冲不变。
+    final=True 表示文本流已结束，缓冲末尾不再留待判断的分隔符。
+
+    level 是当前按哪一级分隔符切分缓冲；大于 base 表示缓冲处在一个超长片段内部，
+    整体切分时它会用更低一级分隔符递归切分，这里同样下降一级流式处理。
+    """
+    seps = splitter._separators
+    size = splitter._chunk_size
+    length = splitter._length_function
+
+    # 缓冲末尾的分隔符可能跨段（如 "\n" + "\n"），落在这段里的边界等后续文本到了再判断
+    limit = len(buf) - (0 if final else _SEP_LOOKAHEAD)
+
+    def raw(text):
+        return splitter._split_text(text, seps[level:])
+
+    # 外层分隔符再次出现：所在超长片段结束，其切片全部确定，回到外层
+    ends = []
+    for j in range(base, level):
+        starts = _sep_starts(splitter, seps[j], buf)
+        if starts and starts[0] > limit:
+            return [], buf, level
+        if starts:
+            ends.append((starts[0], j))
+    if ends:
+        end, j = min(ends)
+        return raw(buf[:end]), buf[end:], j
+
+    sep = seps[level]
+    starts = _sep_starts(splitter, sep, buf) if sep else []
+    tail_end = len(buf)
+    if starts and starts[-1] > limit:
+        tail_end = min(p for p in starts if p > limit)
+        starts = [p for p in starts if p <= limit]
+        if not starts:
+            return [], buf, level
+    last = starts[-1] if starts else None
+    if not last:
+        # 缓冲只有一个片段：已超长则与整体切分一样下降一级
+        if sep and level + 1 < len(seps) and length(buf) >= size:
+            return [], buf, level + 1
+        if sep:
+            return [], buf, level
+        last = len(buf)  # 逐字符一级：没有片段边界，从最后一个切片的起点续切
+    if sep and length(buf[last:tail_end]) >= size:
+        # 最后一个片段已超长：之前合并中的切片不会再变
+        return raw(buf[:last]), buf[last:], level
+    head = buf[:last]
+    if not sep:
+        chunks = raw(head)
+        if len(chunks) <= 1:
+            return [], buf, level
+        pos = len(head.rstrip()) - len(chunks[-1])
+        return (chunks[:-1], buf[pos:], level) if pos > 0 else ([], buf, level)
+    bounds = [0] + [p for p in starts if p < last] + [last]
+    first = _open_doc_start(splitter, [head[i:j] for i, j in zip(bounds, bounds[1:])], sep)
+    if first is None:
+        # 最后一个片段超长、已递归切分：缓冲里到这里为止的切片都已确定
+        return raw(head), buf[last:], level
+    # 合并到最后仍未输出的切片还可能并入后续片段：从它的首个片段（含上一切片留作重叠的片段，
+    # 纯空白的也算）起留在缓冲里。合并是贪心的，从该片段重新开始得到的切片与整体切分一致
+    restart = bounds[first]
+    if restart <= 0:
+        return [], buf, level
+    chunks = raw(head)
+    if splitter._join_docs([head[restart:]], "") is not None:
+        chunks = chunks[:-1]  # 纯空白的未输出切片不会出现在 chunks 里
+    return chunks, buf[restart:], level
+
+
+def iter_split_segments(splitter, segments):
+    """增量切片：逐段读入、逐块产出 (chunk, meta_info)，内存只保留当前缓冲。
+
+    连续且 meta_info 相同的段视为同一文本流（如按块读取的大日志），
+    按递归切分的分隔符层级逐级处理：只产出不会再变的切片，未确定的部分从片段边界留在缓冲里，
+    超长片段与整体 split_text 一样下降一级分隔符继续切，因此结果与整体切分一致（tests/test_chunking.py），
+    缓冲大小只与切片大小和单段长度有关。要求 splitter 为 RecursiveCharacterTextSplitter
+    且分隔符保留在片段开头（默认）；依赖其私有属性，langchain-text-splitters 版本在 requirements.txt 中固定。
+    meta_info 变化（如 PDF 换页）时先把缓冲切完再开始新段。
+    """
+    fit = getattr(splitter, "_fit_budget", None) or (lambda chunks: chunks)
+    buf = ""
+    cur_meta = None
+    base = level = None
+    emitted = False
+
+    def drain(final):
+        nonlocal buf, level, emitted
+        while True:
+            chunks, rest, new_level = _stream_step(splitter, buf, base, level, final)
+            for c in fit(chunks):
+                emitted = True
+                yield c, cur_meta
+            if rest is buf and new_level == level:
+                break
+            buf, level = rest, new_level
+        if final and buf:
+            for c in fit(splitter._split_text(buf, splitter._separators[level:])):
+                yield c, cur_meta
+            buf = ""
+
+    for text, meta in segments:
+        if meta != cur_meta and buf:
+            yield from drain(True)
+            base, level, emitted = None, None, False
+        cur_meta = meta
+        # 流里首次出现更高一级分隔符时，整体切分会把此前全部文本当作这一级的第一个片段：
+        # 已产出过切片说明该片段超长，它在下一级递归切分的结果就是目前的流式结果，维持当前层级；
+        # 否则缓冲里就是全部文本，按该片段是否超长从这一级或下一级重新开始
+        first = _first_sep_level(splitter, buf[-_SEP_LOOKAHEAD:] + text)
+        buf += text
+        if base is None or (first < base and not emitted):
+            base = first
+            starts = _sep_starts(splitter, splitter._separators[base], buf)
+            head = buf[:starts[0]] if starts else buf
+            big = (bool(starts) and base + 1 < len(splitter._separators)
+                   and splitter._length_function(head) >= splitter._chunk_size)
+            level = base + 1 if big else base
+        elif first < base:
+            base = first
+        yield from drain(False)
+    if buf:
+        yield from drain(True)
+
+
+TEXT_MODEL_NAME = "BAAI/bge-small-zh-v1.5"
+
+
+def load_sentence_transformer(name):
+    """加载 SentenceTransformer：优先本地缓存，失败则联网下载"""
     from sentence_transformers import SentenceTransformer
-    import whisper
     import os
 
     # 使用 HuggingFace 镜像中转站（如果能联网的话）
     os.environ.setdefault("HF_ENDPOINT", "https://hf-mirror.com")
+    try:
+        return SentenceTransformer(name, local_files_only=True)
+    except Exception:
+        logger.info(f"本地缓存未命中，联网加载模型: {name}")
+        return SentenceTransformer(name)
 
-    # whisper: 优先用本地缓存文件路径直接加载，绕过联网校验
-    whisper_cache = os.path.join(os.getenv("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "whisper")
-    whisper_local = os.path.join(whisper_cache, "base.pt")
-    if os.path.isfile(whisper_local):
-        whisper_model = whisper.load_model(whisper_local)
-    else:
-        whisper_model = whisper.load_model("base")
 
-    def _load_st(name):
-        """优先本地缓存，失败则联网下载"""
+class _OpenAIWhisper:
+    """openai-whisper（PyTorch）"""
+
+    backend = "openai"
+
+    def __init__(self, size):
+        import whisper
+        import os
+
+        self.spec = (self.backend, size)
+        # 优先用本地缓存文件路径直接加载，绕过联网校验
+        cache = os.path.join(os.getenv("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "whisper")
+        local = os.path.join(cache, f"{size}.pt")
+        self.model = whisper.load_model(local if os.path.isfile(local) else size)
+
+    def transcribe(self, audio, **kwargs):
+        return self.model.transcribe(audio, **kwargs)
+
+
+class _FasterWhisper:
+    """faster-whisper（CTranslate2），CPU 上默认 int8 量化"""
+
+    backend = "faster"
+
+    def __init__(self, size, compute_type, cpu_threads):
+        from faster_whisper import WhisperModel
+
+        self.spec = (self.backend, size)
         try:
-            return SentenceTransformer(name, local_files_only=True)
+            self.model = WhisperModel(size, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads,
+                                      local_files_only=True)
         except Exception:
-            logger.info(f"本地缓存未命中，联网加载模型: {name}")
-            return SentenceTransformer(name)
+            logger.info(f"本地缓存未命中，联网加载 faster-whisper 模型: {size}")
+            self.model = WhisperModel(size, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads)
+
+    def transcribe(self, audio, language=None, **kwargs):
+        segments, info = self.model.transcribe(audio, language=language, beam_size=WHISPER_BEAM_SIZE)
+        segs = [{"start": s.start, "end": s.end, "text": s.text} for s in segments]
+        return {"text": "".join(s["text"] for s in segs), "segments": segs, "language": info.language}
 
+
+def load_transcriber(backend=None, size=None, cpu_threads=None):
+    """加载语音转录模型，按 WHISPER_BACKEND 选择实现。
+
+    两种实现都提供 transcribe(audio) -> {"text", "segments", "language"}，
+    audio 为文件路径或 16kHz 单声道 float32 数组，调用方无需关心具体后端。
+    返回对象的 spec 为 (后端, 规格)，转录子进程据此加载同一模型。
+    cpu_threads: 仅 faster 后端，缺省取 WHISPER_CPU_THREADS。
+    """
+    backend = backend or WHISPER_BACKEND
+    size = size or WHISPER_MODEL_SIZE
+    if backend == "faster":
+        try:
+            threads = WHISPER_CPU_THREADS if cpu_threads is None else cpu_threads
+            return _FasterWhisper(size, WHISPER_COMPUTE_TYPE, threads)
+        except ImportError:
+            logger.warning("未安装 faster-whisper，回退到 openai-whisper")
+    elif backend != "openai":
+        raise ValueError(f"未知 WHISPER_BACKEND: {backend}（可选 openai / faster）")
+    return _OpenAIWhisper(size)
+
+
+def _load_models():
     return {
-        "text": _load_st("BAAI/bge-small-zh-v1.5"),
-        "clip_text": _load_st("sentence-transformers/clip-ViT-B-32-multilingual-v1"),
-        "clip_vision": _load_st("clip-ViT-B-32"),
-        "whisper": whisper_model,
+        "text": load_sentence_transformer(TEXT_MODEL_NAME),
+        "clip_text": load_sentence_transformer("sentence-transformers/clip-ViT-B-32-multilingual-v1"),
+        "clip_vision": load_sentence_transformer("clip-ViT-B-32"),
+        "whisper": load_transcriber(),
     }
 
 
+_models = None
+_models_lock = threading.Lock()
+
+
 def load_models_cached():
-    """加载 AI 模型（带缓存语义，供上层调用）"""
-    return _load_models()
+    """加载 AI 模型，进程内只加载一次，之后返回同一组实例"""
+    global _models
+    if _models is None:
+        with _models_lock:
+            if _models is None:
+                _models = _load_models()
+    return _models
 
 
-def get_lancedb_tables():
-    """打开或创建 LanceDB 表（带 file_hash）。
+# text_chunks 表结构（检索基准按此结构生成合成数据）
+TEXT_SCHEMA = pa.schema([
+    pa.field("id", pa.string()),
+    pa.field("vector", lancedb.vector(512)),
+    pa.field("text", pa.string()),
+    pa.field("source_uri", pa.string()),
+    pa.field("doc_name", pa.string()),
+    pa.field("doc_type", pa.string()),
+    pa.field("file_hash", pa.string()),
+    pa.field("meta_info", pa.string()),
+])
 
-    - `text_chunks` / `image_chunks`：用于向量检索（必要字段含 file_hash，支持整文件预览定位）
-    - `files`：存原始文件 bytes + 可选全文 text_full（用于前端整文件预览/下载）
 
-    若旧表已存在但无 file_hash 列则一次性重建（仅一次），保证新接入可预览。
-    """
+def _connect_lancedb():
+    """连接 LANCE_DB_URI；s3:// 时带上 SeaweedFS 的连接参数，本地目录直接连接"""
+    if not LANCE_DB_URI.startswith("s3://"):
+        return lancedb.connect(LANCE_DB_URI)
     storage_options = {
         "endpoint_url": S3_CONFIG["endpoint_url"],
         "access_key_id": S3_CONFIG["access_key_id"],
@@ -74,16 +422,19 @@ def get_lancedb_tables():
         "allow_http": "true",
         "force_path_style": "true",
     }
-    db = lancedb.connect(LANCE_DB_URI, storage_options=storage_options)
-    text_schema = pa.schema([
-        pa.field("id", pa.string()),
-        pa.field("vector", lancedb.vector(512)),
-        pa.field("text", pa.string()),
-        pa.field("source_uri", pa.string()),
-        pa.field("doc_name", pa.string()),
-        pa.field("doc_type", pa.string()),
-        pa.field("file_hash", pa.string()),
-    ])
+    return lancedb.connect(LANCE_DB_URI, storage_options=storage_options)
+
+
+def get_lancedb_tables():
+    """打开或创建 LanceDB 表（带 file_hash）。
+
+    - `text_chunks` / `image_chunks`：用于向量检索（必要字段含 file_hash，支持整文件预览定位）
+    - `files`：存原始文件 bytes + 可选全文 text_full（用于前端整文件预览/下载）
+
+    若旧表已存在但无 file_hash 列则一次性重建（仅一次），保证新接入可预览。
+    """
+    db = _connect_lancedb()
+    text_schema = TEXT_SCHEMA
     image_schema = pa.schema([
         pa.field("id", pa.string()),
         pa.field("vector", lancedb.vector(512)),
@@ -114,19 +465,19 @@ def get_lancedb_tables():
         logger.info("image_chunks 缺少 file_hash 列，一次性重建以支持整份文档/图片预览")
         db.drop_table("image_chunks")
         tbl_image = db.create_table("image_chunks", schema=image_schema)
+    # 旧表缺少 meta_info（页码/段落位置）列时原地追加，不重建、不丢数据
+    if "meta_info" not in getattr(tbl_text.schema, "names", []):
+        try:
+            tbl_text.add_columns({"meta_info": "CAST(NULL AS STRING)"})
+            logger.info("text_chunks 已追加 meta_info 列")
+        except Exception as e:
+            logger.warning(f"text_chunks 追加 meta_info 列失败，切片将不带位置信息: {e}")
     return tbl_text, tbl_image, tbl_files
 
 
 def get_file_entities_table():
     """打开或创建 file_entities 表，用于存储文件-实体关系。"""
-    storage_options = {
-        "endpoint_url": S3_CONFIG["endpoint_url"],
-        "access_key_id": S3_CONFIG["access_key_id"],
-        "secret_access_key": S3_CONFIG["secret_access_key"],
-        "allow_http": "true",
-        "force_path_style": "true",
-    }
-    db = lancedb.connect(LANCE_DB_URI, storage_options=storage_options)
+    db = _connect_lancedb()
     entities_schema = pa.schema([
         pa.field("file_hash", pa.string()),
         pa.field("entity", pa.string()),
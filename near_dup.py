@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""近重复文档检测：MinHash 签名 + LSH 分桶（签名与桶持久化在 SQLite）"""
+
+import re
+import zlib
+import hashlib
+
+import numpy as np
+
+from config import (
+    NEAR_DUP_NUM_PERM,
+    NEAR_DUP_BANDS,
+    NEAR_DUP_SHINGLE,
+    NEAR_DUP_THRESHOLD,
+)
+from database import (
+    get_doc_signatures,
+    find_signature_candidates,
+    upsert_doc_signature,
+)
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+# 固定种子的哈希置换参数：签名会持久化，参数必须跨进程稳定
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, (1 << 61) - 1, size=NEAR_DUP_NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, (1 << 61) - 1, size=NEAR_DUP_NUM_PERM, dtype=np.uint64)
+
+_WS_RE = re.compile(r"\s+")
+_DIGIT_RE = re.compile(r"\d")
+
+
+def _normalize(text):
+    # 数字统一为 0：仅时间戳/序号不同的日志、版本号不同的文档视为相同内容
+    return _DIGIT_RE.sub("0", _WS_RE.sub(" ", text.lower())).strip()
+
+
+def compute_signature(text):
+    """字符 n-gram（兼顾中文）MinHash 签名，返回 uint32 数组；文本过短返回 None"""
+    norm = _normalize(text or "")
+    k = NEAR_DUP_SHINGLE
+    if len(norm) < k:
+        return None
+    shingles = {zlib.crc32(norm[i:i + k].encode("utf-8")) for i in range(len(norm) - k + 1)}
+    hv = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+    sig = np.full(NEAR_DUP_NUM_PERM, _MAX_HASH, dtype=np.uint64)
+    # 分批计算，避免 (shingle 数 × 置换数) 的大矩阵
+    for i in range(0, len(hv), 4096):
+        with np.errstate(over="ignore"):
+            phv = ((np.outer(hv[i:i + 4096], _PERM_A) + _PERM_B) % _MERSENNE_PRIME) & _MAX_HASH
+        np.minimum(sig, phv.min(axis=0), out=sig)
+    return sig.astype(np.uint32)
+
+
+def _band_keys(sig):
+    rows = NEAR_DUP_NUM_PERM // NEAR_DUP_BANDS
+    return [
+        (b, hashlib.md5(sig[b * rows:(b + 1) * rows].tobytes()).hexdigest()[:16])
+        for b in range(NEAR_DUP_BANDS)
+    ]
+
+
+def find_near_duplicate(sig, exclude_hash=None, threshold=NEAR_DUP_THRESHOLD):
+    """查询 LSH 索引，返回 (file_hash, 估计 Jaccard 相似度)；无满足阈值的候选返回 None"""
+    if sig is None:
+        return None
+    candidates = [h for h in find_signature_candidates(_band_keys(sig)) if h != exclude_hash]
+    best = None
+    for h, blob in get_doc_signatures(candidates):
+        other = np.frombuffer(blob, dtype=np.uint32)
+        if other.shape != sig.shape:
+            continue
+        sim = float(np.mean(other == sig))
+        if sim >= threshold and (best is None or sim > best[1]):
+            best = (h, sim)
+    return best
+
+
+def index_signature(file_hash, sig):
+    """把文档签名写入索引（同一 file_hash 覆盖旧签名）"""
+    if sig is None:
+        return
+    upsert_doc_signature(file_hash, sig.tobytes(), _band_keys(sig))
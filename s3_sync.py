@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""S3 桶/前缀同步：分页 list_objects_v2，并发 get_object 后走统一入库管道
+
+- 断点：每页处理完记录最后一个 key（StartAfter），中断后从断点继续列举；整轮完成后清除
+- 清单：按 (源, key) 记录 ETag，重跑时只处理新增或 ETag 变化的对象
+- 每轮同步是一个入库批次：各对象的阶段推进写入入库日志，失败对象（含内存中的小对象）登记到重试队列
+- 源桶可以是任意 S3 兼容服务（传入 endpoint/凭据），本地可用 moto server 联调:
+    moto_server -p 5000
+    python -c "from s3_sync import sync_s3_prefix; ..."  # endpoint_url="http://127.0.0.1:5000"
+"""
+
+import os
+import time
+import uuid
+import logging
+import posixpath
+import threading
+
+from config import (
+    S3_CONFIG,
+    TEMP_DIR,
+    S3_SYNC_WORKERS,
+    S3_SYNC_PAGE_SIZE,
+    S3_SYNC_INMEMORY_MAX_MB,
+)
+from database import (
+    get_s3_sync_etags,
+    upsert_s3_sync_manifest,
+    get_s3_sync_checkpoint,
+    set_s3_sync_checkpoint,
+    insert_task_stat,
+    insert_stage_stats,
+    create_ingest_job,
+    add_journal_entries,
+    journal_stage,
+    finish_ingest_job,
+)
+from etl import process_pipeline, log_upload_throughput
+from ingest_retry import record_failure
+from ingest_lease import OWNER, lease_deadline
+from s3_utils import get_s3_client, make_s3_client, S3_TRANSFER_CONFIG
+from entity_extractor import submit_entity_extraction
+from scheduler import get_scheduler, estimate_memory, lane_for_source, check_lane
+
+logger = logging.getLogger(__name__)
+
+
+def _fetch_and_ingest(client, bucket, obj, models, tbl_text, tbl_image, tbl_files, on_stage=None):
+    """下载并入库一个对象；入库失败时把对象内容（临时文件或内存数据）交给重试队列保留"""
+    key, size = obj["Key"], obj.get("Size", 0)
+    name = posixpath.basename(key)
+    ext = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+    t0 = time.perf_counter()
+    if size <= S3_SYNC_INMEMORY_MAX_MB * 1024 * 1024:
+        data = client.get_object(Bucket=bucket, Key=key)["Body"].read()
+        dl_secs = time.perf_counter() - t0
+        res = process_pipeline(None, name, models, tbl_text, tbl_image, tbl_files, data=data, on_stage=on_stage)
+        if res["status"] == "error":
+            record_failure(None, name, res, source="s3", data=data)
+    else:
+        os.makedirs(TEMP_DIR, exist_ok=True)
+        local_path = os.path.join(TEMP_DIR, f"{uuid.uuid4().hex[:8]}_{name}")
+        try:
+            client.download_file(bucket, key, local_path, Config=S3_TRANSFER_CONFIG)
+            dl_secs = time.perf_counter() - t0
+            res = process_pipeline(local_path, name, models, tbl_text, tbl_image, tbl_files, on_stage=on_stage)
+            if res["status"] == "error":
+                record_failure(local_path, name, res, source="s3")  # 临时文件移入 FAILED_DIR
+        finally:
+            if os.path.exists(local_path):
+                os.remove(local_path)
+    res["stages"] = res.get("stages", []) + [(res.get("file_hash"), ext, "download", round(dl_secs, 4), size, 1)]
+    return res
+
+
+def sync_s3_prefix(bucket, prefix, models, tbl_text, tbl_image, tbl_files,
+                   endpoint_url=None, access_key_id=None, secret_access_key=None,
+                   progress_callback=None, force=False, lane=None):
+    """同步一个桶/前缀下的对象。endpoint/凭据缺省时使用 S3_CONFIG 的共享客户端；
+    force=True 时忽略断点与清单全部重新处理；lane 为入库优先级通道（缺省 bulk）。
+    返回统计 dict（含 skipped_names、errors）"""
+    start = time.time()
+    prefix = prefix or ""
+    source = f"{endpoint_url or S3_CONFIG['endpoint_url']}/{bucket}/{prefix}"
+    client = (make_s3_client(endpoint_url, access_key_id, secret_access_key)
+              if endpoint_url or access_key_id else get_s3_client())
+    stats = {"listed": 0, "unchanged": 0, "queued": 0, "done": 0, "ingested": 0, "skipped": 0,
+             "failed": 0, "count": 0, "cache_hits": 0, "cache_misses": 0,
+             "upload_bytes": 0, "upload_secs": 0.0}
+    skipped_names, errors, stage_rows = [], [], []
+    if client is None:
+        errors.append("S3 客户端不可用")
+        stats.update(skipped_names=skipped_names, errors=errors, duration=0.0)
+        return stats
+
+    lock = threading.Lock()
+    lane = check_lane(lane or lane_for_source("s3"))
+    scheduler = get_scheduler()
+    # 限制已提交调度器、尚未完成的对象数；提交不阻塞线程，完成回调里做清单与统计并释放名额
+    slots = threading.BoundedSemaphore(S3_SYNC_WORKERS)
+    job_id = uuid.uuid4().hex[:12]
+    create_ingest_job(job_id, "s3", [], lane=lane, owner=OWNER, lease_until=lease_deadline())
+
+    def journal_key(key):
+        # 入库日志按对象地址记录（小对象只在内存中，没有本地路径）
+        return f"s3://{bucket}/{key}"
+
+    def report(msg):
+        if progress_callback:
+            with lock:
+                done, total = stats["done"], stats["queued"]
+            progress_callback(done, max(total, 1), msg)
+
+    def finish(obj, res):
+        key = obj["Key"]
+        name = posixpath.basename(key)
+        if res["status"] == "error":
+            journal_stage(job_id, journal_key(key), "failed", error_msg=res["msg"][:500])
+        else:
+            journal_stage(job_id, journal_key(key), "committed", file_hash=res.get("file_hash"))
+            # ok 与 skipped（内容已入库）都记入清单，ETag 不变则下次跳过
+            upsert_s3_sync_manifest(source, key, obj.get("ETag"), obj.get("Size", 0), res.get("file_hash"))
+        if res["status"] == "ok" and res.get("text_head"):
+            submit_entity_extraction(res["text_head"], res["file_hash"])
+        with lock:
+            stats["done"] += 1
+            stats["count"] += res["count"]
+            for k in ("cache_hits", "cache_misses", "upload_bytes", "upload_secs"):
+                stats[k] += res.get(k, 0)
+            stage_rows.extend(res.get("stages", []))
+            if res["status"] == "ok":
+                stats["ingested"] += 1
+            elif res["status"] == "skipped":
+                stats["skipped"] += 1
+                skipped_names.append(name)
+            else:
+                stats["failed"] += 1
+                errors.append(f"{key}: {res['msg']}")
+        report(f"入库: {name}")
+
+    def submit(obj):
+        name = posixpath.basename(obj["Key"])
+        size = obj.get("Size", 0)
+        jkey = journal_key(obj["Key"])
+        slots.acquire()
+
+        def on_stage(stage, file_hash=None, s3_uri=None):
+            journal_stage(job_id, jkey, stage, file_hash=file_hash, s3_uri=s3_uri)
+
+        def settle(res):
+            try:
+                finish(obj, res)
+            finally:
+                slots.release()
+
+        def on_done(fut):
+            try:
+                res = fut.result()
+            except Exception as e:
+                # 下载失败等：没有可保留的内容，登记后由下次同步按清单重新拉取
+                res = {"success": False, "msg": str(e), "count": 0, "status": "error", "error_type": type(e).__name__}
+                record_failure(None, name, res, source="s3")
+            settle(res)
+
+        try:
+            fut = scheduler.submit(_fetch_and_ingest, client, bucket, obj, models, tbl_text, tbl_image, tbl_files,
+                                   on_stage=on_stage,
+                                   cost=estimate_memory(None, name, size=size), nbytes=size, lane=lane)
+        except Exception as e:
+            res = {"success": False, "msg": str(e), "count": 0, "status": "error", "error_type": type(e).__name__}
+            record_failure(None, name, res, source="s3")
+            settle(res)
+            return
+        fut.add_done_callback(on_done)
+
+    def drain():
+        """等所有已提交对象的完成回调跑完"""
+        for _ in range(S3_SYNC_WORKERS):
+            slots.acquire()
+        for _ in range(S3_SYNC_WORKERS):
+            slots.release()
+
+    start_after = None if force else get_s3_sync_checkpoint(source)
+    if start_after:
+        logger.info(f"S3 同步从断点继续: {source}, StartAfter={start_after}")
+    token = None
+    try:
+        while True:
+            kwargs = {"Bucket": bucket, "Prefix": prefix, "MaxKeys": S3_SYNC_PAGE_SIZE}
+            if token:
+                kwargs["ContinuationToken"] = token
+            elif start_after:
+                kwargs["StartAfter"] = start_after
+            page = client.list_objects_v2(**kwargs)
+            # 跳过"目录"占位和 0 字节对象（如 raw 桶的索引标记）
+            objs = [o for o in page.get("Contents", []) or []
+                    if not o["Key"].endswith("/") and o.get("Size", 0) > 0]
+            etags = {} if force else get_s3_sync_etags(source, [o["Key"] for o in objs])
+            todo = [o for o in objs if etags.get(o["Key"]) != o.get("ETag")]
+            with lock:
+                stats["listed"] += len(objs)
+                stats["unchanged"] += len(objs) - len(todo)
+                stats["queued"] += len(todo)
+            add_journal_entries(job_id, [(journal_key(o["Key"]), posixpath.basename(o["Key"])) for o in todo])
+            for o in todo:
+                submit(o)
+            drain()
+            # 本页全部处理完再推进断点，中断后不会漏处理
+            contents = page.get("Contents") or []
+            if contents:
+                set_s3_sync_checkpoint(source, contents[-1]["Key"])
+            if not page.get("IsTruncated"):
+                break
+            token = page.get("NextContinuationToken")
+        set_s3_sync_checkpoint(source, None)
+    except Exception as e:
+        errors.append(str(e))
+        logger.error(f"S3 同步失败: {source}, {e}")
+    finally:
+        drain()
+        finish_ingest_job(job_id)
+
+    dur = time.time() - start
+    log_upload_throughput("s3", stats["upload_bytes"], stats["upload_secs"])
+    task_id = insert_task_stat("s3", stats["queued"], stats["count"], dur,
+                               embed_cache_hits=stats["cache_hits"], embed_cache_misses=stats["cache_misses"],
+                               upload_bytes=stats["upload_bytes"], upload_secs=stats["upload_secs"])
+    insert_stage_stats(task_id, stage_rows)
+    logger.info(
+        f"S3 同步完成: {source}, 列举 {stats['listed']}，未变 {stats['unchanged']}，"
+        f"入库 {stats['ingested']}，跳过 {stats['skipped']}，失败 {stats['failed']}，耗时 {dur:.1f}s"
+    )
+    stats.update(skipped_names=skipped_names, errors=errors, duration=dur)
+    return stats
@@ -1,12 +1,79 @@
 # -*- coding: utf-8 -*-
-"""S3 工具函数"""
+"""S3 工具函数：全局共享客户端（调优连接池 + 分片上传参数）、删除、流式分片上传"""
 
+import time
 import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
-from config import S3_CONFIG
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
+
+from config import (
+    S3_CONFIG,
+    S3_MAX_POOL_CONNECTIONS,
+    S3_MAX_RETRIES,
+    S3_MULTIPART_THRESHOLD_MB,
+    S3_MULTIPART_PART_MB,
+    S3_TRANSFER_CONCURRENCY,
+)
+from database import add_raw_object_marker, get_raw_object_keys, delete_raw_object_index
 
 logger = logging.getLogger(__name__)
 
+MB = 1024 * 1024
+
+# upload_file / upload_fileobj / download_fileobj 统一使用
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=S3_MULTIPART_THRESHOLD_MB * MB,
+    multipart_chunksize=S3_MULTIPART_PART_MB * MB,
+    max_concurrency=S3_TRANSFER_CONCURRENCY,
+    use_threads=True,
+)
+
+_s3_client = None
+_client_lock = threading.Lock()
+# 流式上传的分片在此池中并发上传（各上传器共享，总并发受控）
+_part_pool = ThreadPoolExecutor(max_workers=S3_TRANSFER_CONCURRENCY, thread_name_prefix="s3-part")
+
+
+def make_s3_client(endpoint_url=None, access_key_id=None, secret_access_key=None):
+    """按统一的连接池/重试参数创建 S3 客户端；参数缺省时取 S3_CONFIG（外部源桶可传入各自的凭据）"""
+    return boto3.client(
+        "s3",
+        endpoint_url=endpoint_url or S3_CONFIG["endpoint_url"],
+        aws_access_key_id=access_key_id or S3_CONFIG["access_key_id"],
+        aws_secret_access_key=secret_access_key or S3_CONFIG["secret_access_key"],
+        config=Config(
+            max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+            retries={"max_attempts": S3_MAX_RETRIES, "mode": "adaptive"},
+        ),
+    )
+
+
+def get_s3_client():
+    """全局共享的 S3 客户端（boto3 client 线程安全）；创建失败返回 None，之后不再重试"""
+    global _s3_client
+    if _s3_client is None:
+        with _client_lock:
+            if _s3_client is None:
+                try:
+                    client = make_s3_client()
+                    # 原始文件桶 & LanceDB 桶（LanceDB 桶主要给 lancedb 自己用，这里只确保存在）
+                    for b in [S3_CONFIG["raw_bucket"], S3_CONFIG["lance_bucket"]]:
+                        try:
+                            client.create_bucket(Bucket=b)
+                        except Exception:
+                            pass
+                    _s3_client = client
+                except Exception as e:
+                    logger.warning(f"S3 客户端创建失败: {e}")
+                    _s3_client = False
+    return _s3_client if _s3_client else None
+
+
 def delete_from_s3(s3_uri: str):
     """从 S3 删除文件
 
@@ -26,13 +93,10 @@ def delete_from_s3(s3_uri: str):
 
         bucket, key = parts
 
-        # 创建 S3 客户端
-        s3 = boto3.client(
-            "s3",
-            endpoint_url=S3_CONFIG["endpoint_url"],
-            aws_access_key_id=S3_CONFIG["access_key_id"],
-            aws_secret_access_key=S3_CONFIG["secret_access_key"],
-        )
+        s3 = get_s3_client()
+        if s3 is None:
+            logger.warning(f"S3 客户端不可用，无法删除: {s3_uri}")
+            return False
 
         # 删除对象
         s3.delete_object(Bucket=bucket, Key=key)
@@ -42,3 +106,171 @@ def delete_from_s3(s3_uri: str):
     except Exception as e:
         logger.error(f"从 S3 删除文件失败 {s3_uri}: {e}")
         return False
+
+
+def object_exists(client, bucket, key):
+    """HEAD 检查对象是否存在（仅 404 视为不存在，其它错误向上抛）"""
+    try:
+        client.head_object(Bucket=bucket, Key=key)
+        return True
+    except client.exceptions.ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+
+def promote_staged_object(client, bucket, staging_key, final_key):
+    """流式上传先写临时 key，算出 hash 后：目标已存在则丢弃临时对象，否则服务端复制到最终 key。
+    返回是否新写入了最终对象"""
+    try:
+        if object_exists(client, bucket, final_key):
+            return False
+        client.copy({"Bucket": bucket, "Key": staging_key}, bucket, final_key, Config=S3_TRANSFER_CONFIG)
+        return True
+    finally:
+        try:
+            client.delete_object(Bucket=bucket, Key=staging_key)
+        except Exception as e:
+            logger.warning(f"删除临时对象失败 s3://{bucket}/{staging_key}: {e}")
+
+
+def put_index_marker(client, bucket, file_hash, object_key, marker_key):
+    """在 raw/{日期}/{类型}/ 下写 0 字节标记对象（元数据指向内容寻址对象），并登记到 SQLite 便于删除"""
+    if not add_raw_object_marker(file_hash, object_key, marker_key):
+        return
+    try:
+        client.put_object(
+            Bucket=bucket, Key=marker_key, Body=b"",
+            Metadata={"object-key": object_key, "file-hash": file_hash},
+        )
+    except Exception as e:
+        logger.warning(f"写索引标记失败 s3://{bucket}/{marker_key}: {e}")
+
+
+def delete_raw_objects(file_hash, source_uri=None):
+    """删除某文件在 raw 桶中的内容对象及其全部索引标记；未登记（旧数据）时按 source_uri 删除"""
+    rows = get_raw_object_keys(file_hash)
+    if not rows:
+        return delete_from_s3(source_uri) if source_uri and source_uri.startswith("s3://") else True
+    s3 = get_s3_client()
+    if s3 is None:
+        logger.warning(f"S3 客户端不可用，无法删除原始对象: {file_hash}")
+        return False
+    bucket = S3_CONFIG["raw_bucket"]
+    keys = sorted({k for row in rows for k in row})
+    try:
+        for i in range(0, len(keys), 1000):
+            s3.delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": k} for k in keys[i:i + 1000]]})
+        delete_raw_object_index(file_hash)
+        logger.info(f"已从 S3 删除 {file_hash} 的 {len(keys)} 个对象（含索引标记）")
+        return True
+    except Exception as e:
+        logger.error(f"从 S3 删除原始对象失败 {file_hash}: {e}")
+        return False
+
+
+class S3StreamUploader:
+    """边读边传：write() 累积到分片大小即提交到共享线程池并发 upload_part，complete() 收尾。
+
+    每个上传器最多保留若干个在途分片（内存上限 = 在途数 × 分片大小），超过时等最早的分片完成；
+    总量不足一个分片时退化为一次 put_object。任一步失败会中止分片上传并置 failed，
+    之后的 write 直接忽略，调用方据此回退到本地 URI，不影响入库。
+    bytes / elapsed 记录上传量与从首次写入到完成的耗时，用于统计吞吐。
+    """
+
+    def __init__(self, client, bucket, key, part_size=S3_MULTIPART_PART_MB * MB):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, 5 * MB)
+        self.max_inflight = max(2, S3_TRANSFER_CONCURRENCY // 2)
+        self.failed = False
+        self.bytes = 0
+        self.elapsed = 0.0
+        self._t0 = None
+        self._buf = bytearray()
+        self._upload_id = None
+        self._inflight = deque()
+        self._parts = []
+
+    @property
+    def uri(self):
+        return f"s3://{self.bucket}/{self.key}"
+
+    def write(self, chunk):
+        if self.failed:
+            return
+        if self._t0 is None:
+            self._t0 = time.time()
+        self._buf += chunk
+        self.bytes += len(chunk)
+        try:
+            while len(self._buf) >= self.part_size:
+                self._submit_part(bytes(self._buf[:self.part_size]))
+                del self._buf[:self.part_size]
+        except Exception as e:
+            self._fail(e)
+
+    def _submit_part(self, body):
+        if self._upload_id is None:
+            resp = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)
+            self._upload_id = resp["UploadId"]
+        while len(self._inflight) >= self.max_inflight:
+            self._collect_oldest()
+        n = len(self._parts) + len(self._inflight) + 1
+        fut = _part_pool.submit(
+            self.client.upload_part,
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, PartNumber=n, Body=body,
+        )
+        self._inflight.append((n, fut))
+
+    def _collect_oldest(self):
+        n, fut = self._inflight.popleft()
+        self._parts.append({"ETag": fut.result()["ETag"], "PartNumber": n})
+
+    def complete(self):
+        """上传剩余数据并完成，成功返回 True"""
+        if self.failed:
+            return False
+        if self._t0 is None:
+            self._t0 = time.time()
+        try:
+            if self._upload_id is None:
+                self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buf))
+            else:
+                if self._buf:
+                    self._submit_part(bytes(self._buf))
+                while self._inflight:
+                    self._collect_oldest()
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                    MultipartUpload={"Parts": self._parts},
+                )
+            self._buf = bytearray()
+            self.elapsed = time.time() - self._t0
+            return True
+        except Exception as e:
+            self._fail(e)
+            return False
+
+    def abort(self):
+        for _, fut in self._inflight:
+            fut.cancel()
+        for _, fut in self._inflight:
+            try:
+                fut.result()
+            except Exception:
+                pass
+        self._inflight.clear()
+        if self._upload_id is not None:
+            try:
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            except Exception as e:
+                logger.warning(f"中止分片上传失败 {self.uri}: {e}")
+            self._upload_id = None
+        self._buf = bytearray()
+
+    def _fail(self, e):
+        logger.warning(f"S3 流式上传失败 {self.uri}: {e}")
+        self.failed = True
+        self.abort()
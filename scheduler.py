@@ -0,0 +1,549 @@
+# -*- coding: utf-8 -*-
+"""入库调度：按预估内存做准入控制
+
+每个文件按大小和类型估算处理时的峰值内存，只有"正在处理的文件预估内存之和"不超过预算时才开始处理，
+避免多个线程同时拿到超大音视频/PDF 把机器打爆。
+- 队首文件内存不够时，后面放得下的小文件可以插队先处理
+- 同一个队首被插队超过 INGEST_MEM_MAX_OVERTAKE 次后停止插队，等运行中的任务释放内存后优先处理它（防饿死）；
+  预留期间 interactive 通道仍可在其预留并发名额内处理放得下的任务，交互上传不被批量大文件卡住
+- 单个文件预估超过整个预算时，等没有其他任务在跑时单独处理
+进程内所有批次共用一个调度器（get_scheduler），上传、目录监听等同时入库时也受同一预算约束。
+
+并发数不再固定：ConcurrencyController 周期性观察排队数、吞吐和 CPU/内存占用，
+在配置的上下限内调整文件级并发（max_workers）和各阶段并发（StageGate，由 etl.StageTimer 进出阶段时占用）。
+
+任务分 interactive（页面/API 上传）、bulk（目录监听、SFTP/S3 同步）、backfill（失败重试等）三个通道，
+小批量交互上传不会排在数万文件的同步任务之后。
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future
+
+from config import (
+    IMAGE_EXTS,
+    ARCHIVE_EXTS,
+    AUDIO_EXTS,
+    VIDEO_EXTS,
+    MAX_FILE_SIZE_MB,
+    INGEST_WORKERS,
+    INGEST_MEM_BUDGET_MB,
+    INGEST_MEM_MAX_OVERTAKE,
+    INGEST_MEM_BASE_MB,
+    INGEST_MEM_FIXED_MB,
+    INGEST_MEM_FACTORS,
+    AUDIO_TRANSCRIBE_WORKERS,
+    AUDIO_WORKER_MEM_MB,
+    INGEST_ADAPTIVE,
+    INGEST_ADAPT_INTERVAL,
+    INGEST_WORKERS_MIN,
+    INGEST_WORKERS_MAX,
+    INGEST_CPU_HIGH,
+    INGEST_MEM_HIGH,
+    INGEST_ADAPT_TOLERANCE,
+    INGEST_STAGE_LIMITS,
+    INGEST_CPU_STAGES,
+    INGEST_LANES,
+    INGEST_DEFAULT_LANE,
+    INGEST_SOURCE_LANES,
+    INGEST_INTERACTIVE_RESERVED,
+)
+
+logger = logging.getLogger(__name__)
+
+_MB = 1024 * 1024
+_OFFICE = {"docx", "pptx", "xlsx", "xls"}
+_TABLE = {"csv", "parquet"}
+
+
+def _mem_kind(ext):
+    if ext in AUDIO_EXTS:
+        return "audio"
+    if ext in VIDEO_EXTS:
+        return "video"
+    if ext == "pdf":
+        return "pdf"
+    if ext in _OFFICE:
+        return "office"
+    if ext in IMAGE_EXTS:
+        return "image"
+    if ext in _TABLE:
+        return "table"
+    if ext in ARCHIVE_EXTS:
+        return "archive"
+    return "text"
+
+
+def estimate_memory(local_path, original_filename=None, size=None):
+    """估算处理单个文件的峰值内存（字节）"""
+    name = original_filename or os.path.basename(local_path or "")
+    ext = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+    if size is None:
+        try:
+            size = os.path.getsize(local_path)
+        except (OSError, TypeError):
+            size = 0
+    kind = _mem_kind(ext)
+    cost = INGEST_MEM_FIXED_MB.get(kind, INGEST_MEM_BASE_MB) * _MB + size * INGEST_MEM_FACTORS.get(kind, 1.0)
+    if size <= MAX_FILE_SIZE_MB * _MB and kind != "archive":
+        cost += size  # 原始字节整体读入后写 files 表
+    return int(cost)
+
+
+def _default_budget():
+    if INGEST_MEM_BUDGET_MB > 0:
+        total = INGEST_MEM_BUDGET_MB * _MB
+    else:
+        try:
+            import psutil
+
+            total = psutil.virtual_memory().total // 2
+        except Exception:
+            total = 4096 * _MB
+    # 并行转录时每个子进程常驻一份 Whisper，不随单个文件计费，先从预算中扣除（至少保留四分之一给文件处理）
+    pool = AUDIO_TRANSCRIBE_WORKERS * AUDIO_WORKER_MEM_MB * _MB if AUDIO_TRANSCRIBE_WORKERS > 1 else 0
+    return max(total - pool, total // 4)
+
+
+class _Job:
+    __slots__ = ("fn", "args", "kwargs", "cost", "nbytes", "lane", "future", "submitted", "overtaken")
+
+    def __init__(self, fn, args, kwargs, cost, nbytes, lane):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.cost = cost
+        self.nbytes = nbytes
+        self.lane = lane
+        self.future = Future()
+        self.submitted = time.time()
+        self.overtaken = 0
+
+
+def lane_for_source(source):
+    """入库来源对应的默认优先级通道"""
+    return INGEST_SOURCE_LANES.get(source, INGEST_DEFAULT_LANE)
+
+
+def check_lane(lane):
+    if lane not in INGEST_LANES:
+        raise ValueError(f"未知优先级: {lane}，可选 {', '.join(INGEST_LANES)}")
+    return lane
+
+
+_current = threading.local()
+
+
+def current_lane():
+    """当前线程正在处理的任务所属通道（不在调度器线程中时为 None）"""
+    return getattr(_current, "lane", None)
+
+
+@contextmanager
+def use_lane(lane):
+    """在任务派生的辅助线程（如压缩包成员线程）中沿用发起任务的通道"""
+    prev = getattr(_current, "lane", None)
+    _current.lane = lane
+    try:
+        yield
+    finally:
+        _current.lane = prev
+
+
+class IngestScheduler:
+    """固定数量工作线程 + 内存预算准入 + 优先级通道。submit 返回 concurrent.futures.Future，可配合 as_completed 使用
+
+    通道间按 INGEST_LANES 权重加权公平调度（每个通道累计 已调度数/权重，取最小者），
+    另为 interactive 预留 INGEST_INTERACTIVE_RESERVED 比例的并发名额，bulk / backfill 占满其余名额后只能排队。
+    """
+
+    def __init__(self, max_workers=INGEST_WORKERS, budget_bytes=None):
+        self.max_workers = max_workers
+        self.budget = budget_bytes or _default_budget()
+        self._cond = threading.Condition()
+        self._pending = {lane: deque() for lane in INGEST_LANES}
+        self._vtime = {lane: 0.0 for lane in INGEST_LANES}
+        self._lane_running = {lane: 0 for lane in INGEST_LANES}
+        self._lane_admitted = {lane: 0 for lane in INGEST_LANES}
+        self._running = 0
+        self._used = 0
+        self._threads = []
+        self._charges = {}
+        self._overtakes = 0
+        self._admitted = 0
+        self._completed = 0
+        self._completed_bytes = 0
+
+    # ---------- 提交 ----------
+
+    def submit(self, fn, *args, cost=0, nbytes=0, lane=INGEST_DEFAULT_LANE, **kwargs):
+        """cost: 预估内存（字节），用于准入；nbytes: 输入大小，用于统计吞吐；lane: 优先级通道"""
+        job = _Job(fn, args, kwargs, max(int(cost), 0), nbytes, check_lane(lane))
+        with self._cond:
+            queue = self._pending[lane]
+            if not queue and not self._lane_running[lane]:
+                # 空闲后重新活跃的通道不能拿空闲期间"攒下"的份额一次性插到最前
+                active = [self._vtime[l] for l in INGEST_LANES if self._pending[l] or self._lane_running[l]]
+                if active:
+                    self._vtime[lane] = max(self._vtime[lane], min(active))
+            queue.append(job)
+            self._ensure_threads()
+            self._cond.notify_all()
+        return job.future
+
+    def _ensure_threads(self):
+        while len(self._threads) < self.max_workers:
+            t = threading.Thread(target=self._worker, name=f"ingest-{len(self._threads)}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def set_max_workers(self, n):
+        """调整并发上限：调大时补足工作线程；调小时多出的线程在当前任务结束后不再领新任务"""
+        with self._cond:
+            self.max_workers = max(1, int(n))
+            if any(self._pending.values()):
+                self._ensure_threads()
+            self._cond.notify_all()
+
+    # ---------- 准入 ----------
+
+    def _reserved(self):
+        # 只有一个名额时不预留，否则批量任务永远无法运行
+        return min(self.max_workers - 1, max(1, round(self.max_workers * INGEST_INTERACTIVE_RESERVED)))
+
+    def _fits(self, job):
+        return self._used + job.cost <= self.budget or self._running == 0
+
+    def _pick(self):
+        """在锁内选出下一个可运行的任务；没有则返回 None"""
+        if self._running >= self.max_workers:
+            return None
+        others_cap = self.max_workers - self._reserved()
+        others_running = self._running - self._lane_running["interactive"]
+        lanes = sorted((l for l in INGEST_LANES if self._pending[l]), key=lambda l: self._vtime[l])
+        blocked = []
+        reserving = False
+        for lane in lanes:
+            if lane != "interactive" and others_running >= others_cap:
+                continue
+            queue = self._pending[lane]
+            head = queue[0]
+            if reserving:
+                # 其他通道的队首正在预留内存：只有 interactive 可在其预留名额内继续放行放得下的队首
+                if lane != "interactive" or self._lane_running[lane] >= self._reserved() or not self._fits(head):
+                    continue
+                job = queue.popleft()
+            elif self._fits(head):
+                job = queue.popleft()
+            elif head.overtaken >= INGEST_MEM_MAX_OVERTAKE:
+                reserving = True  # 为该队首预留内存：其他任务不再插队
+                continue
+            else:
+                blocked.append(head)
+                job = next((j for j in queue if self._fits(j)), None)
+                if job is None:
+                    continue
+                queue.remove(job)
+            for h in blocked:
+                h.overtaken += 1
+                self._overtakes += 1
+            self._vtime[lane] += 1.0 / INGEST_LANES[lane]
+            return job
+        return None
+
+    def charge(self, cost, owner):
+        """运行中的任务追加占用内存预算（如压缩包成员各自的处理内存），放不下时阻塞等待。
+
+        owner 名下还没有追加占用时直接放行，保证任务自身至少能推进一个成员，不会与自己互锁
+        """
+        cost = max(int(cost), 0)
+        with self._cond:
+            while self._charges.get(owner) and self._used + cost > self.budget:
+                self._cond.wait()
+            self._used += cost
+            self._charges[owner] = self._charges.get(owner, 0) + 1
+        return cost
+
+    def release(self, cost, owner):
+        """归还 charge 追加占用的内存"""
+        with self._cond:
+            self._used -= cost
+            left = self._charges.get(owner, 0) - 1
+            if left > 0:
+                self._charges[owner] = left
+            else:
+                self._charges.pop(owner, None)
+            self._cond.notify_all()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._pick()
+                while job is None:
+                    self._cond.wait()
+                    job = self._pick()
+                self._running += 1
+                self._lane_running[job.lane] += 1
+                self._lane_admitted[job.lane] += 1
+                self._used += job.cost
+                self._admitted += 1
+            _current.lane = job.lane
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        job.future.set_result(job.fn(*job.args, **job.kwargs))
+                    except BaseException as e:
+                        job.future.set_exception(e)
+            finally:
+                _current.lane = None
+                with self._cond:
+                    self._running -= 1
+                    self._lane_running[job.lane] -= 1
+                    self._used -= job.cost
+                    self._completed += 1
+                    self._completed_bytes += job.nbytes
+                    self._cond.notify_all()
+
+    # ---------- 状态 ----------
+
+    def snapshot(self):
+        with self._cond:
+            now = time.time()
+            heads = [q[0] for q in self._pending.values() if q]
+            oldest = min((j.submitted for j in heads), default=None)
+            return {
+                "max_workers": self.max_workers,
+                "reserved_interactive": self._reserved(),
+                "budget_mb": round(self.budget / _MB),
+                "used_mb": round(self._used / _MB),
+                "running": self._running,
+                "pending": sum(len(q) for q in self._pending.values()),
+                "head_wait_sec": round(now - oldest, 1) if oldest else 0.0,
+                "admitted": self._admitted,
+                "completed": self._completed,
+                "completed_bytes": self._completed_bytes,
+                "overtakes": self._overtakes,
+                "lanes": {
+                    lane: {
+                        "weight": INGEST_LANES[lane],
+                        "pending": len(self._pending[lane]),
+                        "running": self._lane_running[lane],
+                        "admitted": self._lane_admitted[lane],
+                        "head_wait_sec": round(now - self._pending[lane][0].submitted, 1) if self._pending[lane] else 0.0,
+                    }
+                    for lane in INGEST_LANES
+                },
+            }
+
+
+class StageGate:
+    """单个阶段的可调并发上限。进入阶段前 acquire，超过上限的线程排队等待"""
+
+    def __init__(self, stage, limit):
+        self.stage = stage
+        self.limit = limit
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._urgent_waiting = 0
+        self._completed = 0
+        self._units = 0
+        self._busy_secs = 0.0
+
+    @contextmanager
+    def hold(self, units=1):
+        # interactive 通道的任务排在其他通道之前进入阶段
+        urgent = current_lane() == "interactive"
+        with self._cond:
+            self._waiting += 1
+            self._urgent_waiting += urgent
+            while self._active >= self.limit or (not urgent and self._urgent_waiting):
+                self._cond.wait()
+            self._waiting -= 1
+            self._urgent_waiting -= urgent
+            self._active += 1
+            if urgent and not self._urgent_waiting:
+                self._cond.notify_all()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._completed += 1
+                self._units += max(int(units), 1)
+                self._busy_secs += time.perf_counter() - t0
+                self._cond.notify_all()
+
+    def set_limit(self, n):
+        with self._cond:
+            self.limit = max(1, int(n))
+            self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "active": self._active,
+                "waiting": self._waiting,
+                "completed": self._completed,
+                "units": self._units,
+                "busy_secs": round(self._busy_secs, 3),
+            }
+
+
+class _Knob:
+    """一个可调并发量的爬山状态：有排队且资源未饱和时加，加完吞吐下降则退回并暂停一个周期"""
+
+    def __init__(self, name, lo, hi, step, cpu_bound):
+        self.name = name
+        self.lo = lo
+        self.hi = hi
+        self.step = step
+        self.cpu_bound = cpu_bound
+        self.last_dir = 0
+        self.last_rate = None
+        self.last_total = None
+
+    def decide(self, limit, queued, total, elapsed, cpu, mem):
+        """返回 (新并发数, 原因, 本周期吞吐)；不调整时新并发数等于 limit"""
+        rate = None if self.last_total is None else (total - self.last_total) / max(elapsed, 1e-6)
+        self.last_total = total
+        prev_rate, prev_dir = self.last_rate, self.last_dir
+        self.last_rate, self.last_dir = rate, 0
+        step = self.step(limit) if callable(self.step) else self.step
+        if self.cpu_bound and cpu >= INGEST_CPU_HIGH and limit > self.lo:
+            self.last_dir = -1
+            return max(self.lo, limit - step), f"CPU {cpu:.0f}% ≥ {INGEST_CPU_HIGH}%", rate
+        if self.name == "workers" and mem >= INGEST_MEM_HIGH and limit > self.lo:
+            self.last_dir = -1
+            return max(self.lo, limit - step), f"内存 {mem:.0f}% ≥ {INGEST_MEM_HIGH}%", rate
+        if prev_dir > 0 and rate is not None and prev_rate and rate < prev_rate * (1 - INGEST_ADAPT_TOLERANCE):
+            self.last_dir = -1
+            return max(self.lo, limit - step), f"加并发后吞吐下降 {prev_rate:.2f} → {rate:.2f}/s", rate
+        if queued > 0 and limit < self.hi and prev_dir >= 0:
+            self.last_dir = 1
+            return min(self.hi, limit + step), f"排队 {queued}，吞吐 {rate or 0:.2f}/s", rate
+        return limit, None, rate
+
+
+class ConcurrencyController:
+    """周期性调整文件级并发与各阶段并发，最近的调整决策保存在内存中供查询"""
+
+    def __init__(self, scheduler, stage_limits=None):
+        self.scheduler = scheduler
+        limits = INGEST_STAGE_LIMITS if stage_limits is None else stage_limits
+        self.gates = {stage: StageGate(stage, init) for stage, (lo, init, hi) in limits.items()}
+        self._knobs = {"workers": _Knob("workers", INGEST_WORKERS_MIN, INGEST_WORKERS_MAX,
+                                        lambda n: max(1, n // 4), cpu_bound=True)}
+        for stage, (lo, init, hi) in limits.items():
+            self._knobs[stage] = _Knob(stage, lo, hi, 1, cpu_bound=stage in INGEST_CPU_STAGES)
+        self.decisions = deque(maxlen=200)
+        self.last_sample = {}
+        self._last_tick = None
+        self._thread = None
+
+    def _resources(self):
+        try:
+            import psutil
+
+            return psutil.cpu_percent(interval=None), psutil.virtual_memory().percent
+        except Exception:
+            return 0.0, 0.0
+
+    def tick(self):
+        """执行一次观测与调整，返回本次的调整列表"""
+        now = time.time()
+        elapsed = now - self._last_tick if self._last_tick else INGEST_ADAPT_INTERVAL
+        self._last_tick = now
+        cpu, mem = self._resources()
+        sched = self.scheduler.snapshot()
+        sample = {"ts": now, "cpu_percent": cpu, "mem_percent": mem, "workers": {}, "stages": {}}
+        changes = []
+
+        def apply(name, limit, queued, total, setter, bucket):
+            new, reason, rate = self._knobs[name].decide(limit, queued, total, elapsed, cpu, mem)
+            bucket.update({"limit": new, "queued": queued, "rate_per_sec": round(rate, 3) if rate is not None else None})
+            if new != limit:
+                setter(new)
+                change = {"ts": now, "target": name, "from": limit, "to": new, "reason": reason}
+                changes.append(change)
+                self.decisions.append(change)
+                logger.info(f"入库并发调整: {name} {limit} → {new}（{reason}）")
+
+        # 文件级吞吐按完成字节数计（混合大小的文件比按个数更稳定）
+        apply("workers", sched["max_workers"], sched["pending"], sched["completed_bytes"],
+              self.scheduler.set_max_workers, sample["workers"])
+        for stage, gate in self.gates.items():
+            g = gate.snapshot()
+            sample["stages"][stage] = {"active": g["active"]}
+            apply(stage, g["limit"], g["waiting"], g["units"], gate.set_limit, sample["stages"][stage])
+        self.last_sample = sample
+        return changes
+
+    def _loop(self):
+        self._resources()  # 首次 cpu_percent 返回 0，先取一次作为基准
+        while True:
+            time.sleep(INGEST_ADAPT_INTERVAL)
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"入库并发调整失败: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="ingest-adapt", daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def snapshot(self):
+        return {
+            "adaptive": self._thread is not None,
+            "interval_sec": INGEST_ADAPT_INTERVAL,
+            "scheduler": self.scheduler.snapshot(),
+            "bounds": {name: [k.lo, k.hi] for name, k in self._knobs.items()},
+            "stages": {stage: gate.snapshot() for stage, gate in self.gates.items()},
+            "last_sample": self.last_sample,
+            "decisions": list(self.decisions)[-50:],
+        }
+
+
+_scheduler = None
+_controller = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """进程内共享的入库调度器（首次调用时按 INGEST_ADAPTIVE 启动并发控制线程）"""
+    global _scheduler, _controller
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                sched = IngestScheduler()
+                _controller = ConcurrencyController(sched)
+                if INGEST_ADAPTIVE:
+                    _controller.start()
+                _scheduler = sched
+                logger.info(f"入库调度器: 并发 {sched.max_workers}，内存预算 {sched.budget / _MB:.0f}MB，"
+                            f"自适应 {'开启' if INGEST_ADAPTIVE else '关闭'}")
+    return _scheduler
+
+
+def get_controller():
+    get_scheduler()
+    return _controller
+
+
+@contextmanager
+def stage_slot(stage, units=1):
+    """占用一个阶段并发名额；未配置上限的阶段直接放行"""
+    gate = get_controller().gates.get(stage)
+    if gate is None:
+        yield
+        return
+    with gate.hold(units):
+        yield
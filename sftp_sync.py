@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""SFTP 增量同步：递归遍历远端目录，多连接并行下载，边下载边入库；按 (路径, 大小, mtime) 清单跳过未变文件
+
+远端文件只读一遍：小文件读入内存并同时计算 md5；大文件/音视频边读边算 md5、边分片上传到 S3 临时 key、边写临时文件。
+每轮同步是一个入库批次：各文件的阶段推进写入入库日志，失败文件（含内存中的小文件）登记到重试队列。
+"""
+
+import os
+import stat
+import hashlib
+import time
+import uuid
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import paramiko
+
+from config import (
+    S3_CONFIG,
+    TEMP_DIR,
+    ARCHIVE_EXTS,
+    MEDIA_EXTS,
+    SFTP_CONNECTIONS,
+    SFTP_MAX_PENDING,
+    SFTP_SKIP_HIDDEN,
+    SFTP_INMEMORY_MAX_MB,
+    SFTP_READ_CHUNK,
+)
+from database import (
+    get_sftp_manifest,
+    upsert_sftp_manifest,
+    insert_task_stat,
+    insert_stage_stats,
+    create_ingest_job,
+    add_journal_entries,
+    journal_stage,
+    finish_ingest_job,
+)
+from etl import process_pipeline, raw_object_key, log_upload_throughput
+from ingest_retry import record_failure
+from ingest_lease import OWNER, lease_deadline
+from s3_utils import get_s3_client, promote_staged_object, S3StreamUploader
+from entity_extractor import submit_entity_extraction
+from scheduler import get_scheduler, estimate_memory, lane_for_source, check_lane
+
+logger = logging.getLogger(__name__)
+
+# whisper/ffmpeg 只接受文件路径，这类文件直接写临时文件，避免内存缓冲后再落盘一次
+_PATH_ONLY_EXTS = set(MEDIA_EXTS)
+
+
+def _open_sftp(host, port, user, password):
+    tr = paramiko.Transport((host, int(port)))
+    tr.connect(username=user, password=password)
+    return tr, paramiko.SFTPClient.from_transport(tr)
+
+
+class _SFTPPool:
+    """每个下载线程独占一条 SFTP 连接（独立 Transport，加解密不互相争用）"""
+
+    def __init__(self, host, port, user, password):
+        self._args = (host, port, user, password)
+        self._local = threading.local()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        sftp = getattr(self._local, "sftp", None)
+        if sftp is None:
+            tr, sftp = _open_sftp(*self._args)
+            self._local.sftp = sftp
+            with self._lock:
+                self._all.append(tr)
+        return sftp
+
+    def reset(self):
+        # 连接出错后丢弃，下次 get 重连
+        sftp = getattr(self._local, "sftp", None)
+        if sftp is not None:
+            try:
+                sftp.get_channel().get_transport().close()
+            except Exception:
+                pass
+        self._local.sftp = None
+
+    def close_all(self):
+        with self._lock:
+            for tr in self._all:
+                try:
+                    tr.close()
+                except Exception:
+                    pass
+            self._all.clear()
+
+
+def fetch_remote(sftp, remote, size):
+    """流式读取远端文件一次，返回 (md5, s3_uri 或 None, bytes 或 None, 临时文件路径 或 None, 上传统计)"""
+    name = posixpath.basename(remote)
+    ext = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+    in_memory = size <= SFTP_INMEMORY_MAX_MB * 1024 * 1024 and ext not in _PATH_ONLY_EXTS
+    # 小文件留在内存，由 process_pipeline 按 hash 做 HEAD-before-PUT；大文件边读边传到临时 key，
+    # 读完得到 hash 后再提升为内容寻址 key（已存在则丢弃）。压缩包自身不上传，成员各自上传
+    bucket = S3_CONFIG["raw_bucket"]
+    s3_client = get_s3_client() if not in_memory and ext not in ARCHIVE_EXTS else None
+    uploader = S3StreamUploader(s3_client, bucket, f"raw/staging/{uuid.uuid4().hex}") if s3_client else None
+
+    h = hashlib.md5()
+    buf = bytearray() if in_memory else None
+    local_path = None if in_memory else os.path.join(TEMP_DIR, f"{uuid.uuid4().hex[:8]}_{name}")
+    out = None
+    try:
+        if local_path:
+            out = open(local_path, "wb")
+        with sftp.open(remote, "rb") as fh:
+            # 流水线预取，避免每块一次往返
+            fh.prefetch(size)
+            while True:
+                chunk = fh.read(SFTP_READ_CHUNK)
+                if not chunk:
+                    break
+                h.update(chunk)
+                if uploader:
+                    uploader.write(chunk)
+                if out:
+                    out.write(chunk)
+                else:
+                    buf += chunk
+        if out:
+            out.close()
+            out = None
+    except Exception:
+        if out:
+            out.close()
+        if local_path and os.path.exists(local_path):
+            os.remove(local_path)
+        if uploader:
+            uploader.abort()
+        raise
+
+    f_hash = h.hexdigest()
+    s3_uri, upload_stats = None, {}
+    if uploader and uploader.complete():
+        upload_stats = {"upload_bytes": uploader.bytes, "upload_secs": uploader.elapsed}
+        final_key = raw_object_key(f_hash, ext)
+        try:
+            promote_staged_object(s3_client, bucket, uploader.key, final_key)
+            s3_uri = f"s3://{bucket}/{final_key}"
+        except Exception as e:
+            logger.warning(f"S3 对象提升失败，交由入库管道重新上传: {e}")
+    return f_hash, s3_uri, (bytes(buf) if buf is not None else None), local_path, upload_stats
+
+
+def walk_remote(sftp, root):
+    """递归遍历远端目录（显式栈，不受递归深度限制），逐个产出 (remote_path, size, mtime)"""
+    stack = [root.rstrip("/") or "/"]
+    while stack:
+        d = stack.pop()
+        try:
+            entries = sftp.listdir_attr(d)
+        except IOError as e:
+            logger.warning(f"SFTP 列目录失败: {d}, {e}")
+            continue
+        for a in entries:
+            if SFTP_SKIP_HIDDEN and a.filename.startswith("."):
+                continue
+            p = posixpath.join(d, a.filename)
+            if stat.S_ISDIR(a.st_mode or 0):
+                stack.append(p)
+            elif stat.S_ISREG(a.st_mode or 0):
+                yield p, a.st_size or 0, int(a.st_mtime or 0)
+
+
+def sync_sftp(host, port, user, password, path, models, tbl_text, tbl_image, tbl_files,
+              progress_callback=None, force=False, lane=None):
+    """增量同步一个 SFTP 目录树。force=True 时忽略清单全部重新拉取；lane 为入库优先级通道（缺省 bulk）。
+    返回统计 dict：listed/unchanged/ingested/skipped/failed/count 及 skipped_names、errors
+    """
+    start = time.time()
+    source = f"{user}@{host}:{port}"
+    manifest = {} if force else get_sftp_manifest(source)
+    stats = {"listed": 0, "unchanged": 0, "queued": 0, "done": 0, "ingested": 0, "skipped": 0,
+             "failed": 0, "count": 0, "cache_hits": 0, "cache_misses": 0,
+             "upload_bytes": 0, "upload_secs": 0.0}
+    skipped_names, errors, stage_rows = [], [], []
+    lock = threading.Lock()
+    lane = check_lane(lane or lane_for_source("sftp"))
+    scheduler = get_scheduler()
+    # 限制"下载中 + 已下载待入库"的文件数，内存缓冲与临时目录占用有上限
+    slots = threading.BoundedSemaphore(SFTP_CONNECTIONS + SFTP_MAX_PENDING)
+    pool = _SFTPPool(host, port, user, password)
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    job_id = uuid.uuid4().hex[:12]
+    create_ingest_job(job_id, "sftp", [], lane=lane, owner=OWNER, lease_until=lease_deadline())
+
+    def journal_key(remote):
+        # 入库日志按远端地址记录（小文件只在内存中，没有本地路径）
+        return f"sftp://{source}{remote}"
+
+    def report(msg):
+        if progress_callback:
+            with lock:
+                done, total = stats["done"], stats["queued"]
+            progress_callback(done, max(total, 1), msg)
+
+    def fail(remote, msg, error_type="", local_path=None, data=None):
+        journal_stage(job_id, journal_key(remote), "failed", error_msg=msg[:500])
+        record_failure(local_path, posixpath.basename(remote), {"msg": msg, "error_type": error_type},
+                       source="sftp", data=data)
+        with lock:
+            stats["failed"] += 1
+            stats["done"] += 1
+            errors.append(f"{remote}: {msg}")
+        report(f"失败: {posixpath.basename(remote)}")
+
+    def finish(remote, res, f_hash, upload_stats, size, mtime, fetch_secs, local_path=None, data=None):
+        name = posixpath.basename(remote)
+        ext = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+        if res["status"] == "error":
+            fail(remote, res["msg"], res.get("error_type") or "", local_path=local_path, data=data)
+            return
+        journal_stage(job_id, journal_key(remote), "committed", file_hash=res.get("file_hash"))
+        # ok 与 skipped（内容已入库）都记入清单，下次同步直接跳过
+        upsert_sftp_manifest(source, remote, size, mtime, res.get("file_hash"))
+        if res["status"] == "ok" and res.get("text_head"):
+            submit_entity_extraction(res["text_head"], res["file_hash"])
+        with lock:
+            stats["done"] += 1
+            stats["count"] += res["count"]
+            stats["cache_hits"] += res.get("cache_hits", 0)
+            stats["cache_misses"] += res.get("cache_misses", 0)
+            stats["upload_bytes"] += upload_stats.get("upload_bytes", 0)
+            stats["upload_secs"] += upload_stats.get("upload_secs", 0)
+            # download：读远端 + 边读边算 hash/分片上传（大文件）的总耗时
+            stage_rows.extend(res.get("stages", []))
+            stage_rows.append((f_hash, ext, "download", round(fetch_secs, 4), size, 1))
+            if res["status"] == "ok":
+                stats["ingested"] += 1
+            else:
+                stats["skipped"] += 1
+                skipped_names.append(name)
+        report(f"入库: {name}")
+
+    def ingest(remote, local_path, data, f_hash, s3_uri, upload_stats, size, mtime, fetch_secs):
+        """提交调度器后立即返回，入库完成回调里记清单、日志与统计，清理临时文件并释放名额"""
+        name = posixpath.basename(remote)
+        key = journal_key(remote)
+
+        def on_stage(stage, file_hash=None, s3_uri=None):
+            journal_stage(job_id, key, stage, file_hash=file_hash, s3_uri=s3_uri)
+
+        def settle(res):
+            try:
+                # 失败时 record_failure 把临时文件移入 FAILED_DIR（内存数据落盘）保留待重试
+                finish(remote, res, f_hash, upload_stats, size, mtime, fetch_secs, local_path=local_path, data=data)
+            finally:
+                if local_path and os.path.exists(local_path):
+                    os.remove(local_path)
+                slots.release()
+
+        def on_done(fut):
+            try:
+                res = fut.result()
+            except Exception as e:
+                res = {"success": False, "msg": str(e), "count": 0, "status": "error", "error_type": type(e).__name__}
+            settle(res)
+
+        try:
+            fut = scheduler.submit(process_pipeline, local_path, name, models, tbl_text, tbl_image, tbl_files,
+                                   data=data, f_hash=f_hash, s3_uri=s3_uri, on_stage=on_stage,
+                                   cost=estimate_memory(local_path, name, size=size), nbytes=size, lane=lane)
+        except Exception as e:
+            settle({"success": False, "msg": str(e), "count": 0, "status": "error", "error_type": type(e).__name__})
+            return
+        fut.add_done_callback(on_done)
+
+    def download(remote, size, mtime):
+        t0 = time.perf_counter()
+        try:
+            f_hash, s3_uri, data, local_path, upload_stats = fetch_remote(pool.get(), remote, size)
+        except Exception as e:
+            pool.reset()
+            slots.release()
+            fail(remote, f"下载失败 {e}", type(e).__name__)
+            return
+        ingest(remote, local_path, data, f_hash, s3_uri, upload_stats, size, mtime, time.perf_counter() - t0)
+
+    tr = None
+    try:
+        tr, sftp = _open_sftp(host, port, user, password)
+        with ThreadPoolExecutor(max_workers=SFTP_CONNECTIONS) as download_pool:
+            for remote, size, mtime in walk_remote(sftp, path):
+                with lock:
+                    stats["listed"] += 1
+                if manifest.get(remote) == (size, mtime):
+                    with lock:
+                        stats["unchanged"] += 1
+                    continue
+                slots.acquire()
+                with lock:
+                    stats["queued"] += 1
+                add_journal_entries(job_id, [(journal_key(remote), posixpath.basename(remote))])
+                download_pool.submit(download, remote, size, mtime)
+                report(f"下载: {posixpath.basename(remote)}")
+    except Exception as e:
+        errors.append(str(e))
+        logger.error(f"SFTP 同步失败: {source}{path}, {e}")
+    finally:
+        if tr:
+            tr.close()
+        pool.close_all()
+        # 收回全部名额，即等所有已提交文件的完成回调跑完
+        for _ in range(SFTP_CONNECTIONS + SFTP_MAX_PENDING):
+            slots.acquire()
+        finish_ingest_job(job_id)
+
+    dur = time.time() - start
+    log_upload_throughput("sftp", stats["upload_bytes"], stats["upload_secs"])
+    task_id = insert_task_stat("sftp", stats["queued"], stats["count"], dur,
+                               embed_cache_hits=stats["cache_hits"], embed_cache_misses=stats["cache_misses"],
+                               upload_bytes=stats["upload_bytes"], upload_secs=stats["upload_secs"])
+    insert_stage_stats(task_id, stage_rows)
+    logger.info(
+        f"SFTP 同步完成: {source}{path}, 扫描 {stats['listed']}，未变 {stats['unchanged']}，"
+        f"入库 {stats['ingested']}，跳过 {stats['skipped']}，失败 {stats['failed']}，耗时 {dur:.1f}s"
+    )
+    stats["skipped_names"] = skipped_names
+    stats["errors"] = errors
+    stats["duration"] = dur
+    return stats
@@ -83,3 +83,62 @@ def get_task_trend(days=7):
     finally:
         if conn:
             conn.close()
+
+
+def _percentile(sorted_vals, q):
+    """线性插值分位数；sorted_vals 已升序"""
+    if not sorted_vals:
+        return 0.0
+    k = (len(sorted_vals) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+
+def get_stage_breakdown(days=7, by_doc_type=True):
+    """近 N 天各阶段单文件耗时分布：p50/p95、总耗时、吞吐。
+    by_doc_type=True 时同时给出按 doc_type 细分的行；doc_type 为 "*" 的行是该阶段全部类型的汇总
+    """
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        rows = conn.execute(
+            """SELECT stage, COALESCE(doc_type, ''), duration, COALESCE(bytes, 0), COALESCE(rows, 0)
+               FROM task_stage_stats WHERE created_at >= date('now', 'localtime', ?)""",
+            (f"-{days} days",),
+        ).fetchall()
+    except Exception as e:
+        import logging
+        logging.error(f"获取分阶段统计失败: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+    groups = {}
+    for stage, doc_type, dur, nbytes, nrows in rows:
+        keys = [(stage, "*")] + ([(stage, doc_type)] if by_doc_type else [])
+        for key in keys:
+            g = groups.setdefault(key, ([], [0, 0]))
+            g[0].append(dur or 0.0)
+            g[1][0] += nbytes
+            g[1][1] += nrows
+
+    result = []
+    for (stage, doc_type), (durs, (nbytes, nrows)) in groups.items():
+        durs.sort()
+        total = sum(durs)
+        result.append({
+            "stage": stage,
+            "doc_type": doc_type,
+            "files": len(durs),
+            "p50_sec": round(_percentile(durs, 0.5), 4),
+            "p95_sec": round(_percentile(durs, 0.95), 4),
+            "total_sec": round(total, 3),
+            "mb_per_sec": round(nbytes / 1024 / 1024 / total, 2) if nbytes and total else 0.0,
+            "rows_per_sec": round(nrows / total, 1) if nrows and total else 0.0,
+        })
+    # 每个阶段汇总行在前，阶段按总耗时降序（瓶颈排在最上面）
+    stage_total = {r["stage"]: r["total_sec"] for r in result if r["doc_type"] == "*"}
+    result.sort(key=lambda r: (-stage_total.get(r["stage"], 0), r["stage"], r["doc_type"] != "*", -r["total_sec"]))
+    return result
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""测试公共设置：仓库根目录加入 sys.path，SQLite 库放到临时目录（需在导入 config 前设置）"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp = tempfile.mkdtemp(prefix="dataverse-test-")
+os.environ.setdefault("DB_PATH", os.path.join(_tmp, "user_data.db"))
+os.environ.setdefault("EMBED_CACHE_PATH", os.path.join(_tmp, "embed_cache.db"))
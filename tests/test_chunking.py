@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""增量切片 iter_split_segments 与整体 split_text 结果一致（按任意大小分段喂入）"""
+
+import random
+
+import pytest
+
+pytest.importorskip("lancedb")
+
+import models_loader as ml  # noqa: E402
+
+
+def _stream(splitter, text, block, meta=""):
+    segs = [(text[i:i + block], meta) for i in range(0, len(text), block)]
+    return [c for c, _ in ml.iter_split_segments(splitter, segs)]
+
+
+@pytest.mark.parametrize("block", [1, 3, 7, 50])
+def test_blank_line_run_before_restart(block):
+    # 上一切片留作重叠的只是纯空白片段（连续空行），续切时也要带上它，否则合并结果会偏移
+    splitter = ml.get_text_splitter(20, 4)
+    text = "\ncd efg \n\n\n\nefg efg cd \n\n\nab "
+    assert splitter.split_text(text) == ["cd efg", "efg efg cd", "ab"]
+    assert _stream(splitter, text, block) == splitter.split_text(text)
+
+
+def test_long_log_lines():
+    splitter = ml.get_text_splitter(500, 50)
+    rng = random.Random(0)
+    text = "\n".join(f"2026-01-01 12:00:{i % 60:02d} INFO worker-{i % 7} request id={rng.randint(0, 10 ** 9)}"
+                     for i in range(3000))
+    assert _stream(splitter, text, 4096) == splitter.split_text(text)
+
+
+def test_oversized_piece_without_separators():
+    splitter = ml.get_text_splitter(100, 10)
+    text = "intro\n\n" + "y" * 450 + "\n\nword " * 40
+    for block in (1, 64, 333):
+        assert _stream(splitter, text, block) == splitter.split_text(text)
+
+
+def test_random_texts_match_split_text():
+    rng = random.Random(11)
+    words = ["alpha", "beta", "gamma", "日志", "delta", "x" * 30, "  ", "\t"]
+    for _ in range(300):
+        size = rng.choice([50, 100, 200, 500])
+        splitter = ml.get_text_splitter(size, rng.choice([0, 5, size // 5, size // 2]))
+        parts = []
+        for _ in range(rng.randint(5, 400)):
+            r = rng.random()
+            if r < 0.06:
+                parts.append("\n\n" * rng.randint(1, 3))
+            elif r < 0.14:
+                parts.append("\n")
+            elif r < 0.16:
+                parts.append("\n \n")
+            elif r < 0.17:
+                parts.append("y" * rng.randint(size, 3 * size))
+            else:
+                parts.append(rng.choice(words) + (" " if rng.random() < 0.8 else ""))
+        text = "".join(parts)
+        block = rng.choice([1, 7, 64, 333, 1000])
+        assert _stream(splitter, text, block) == splitter.split_text(text), (size, block, text)
+
+
+def test_meta_change_flushes_buffer():
+    splitter = ml.get_text_splitter(50, 5)
+    pages = [("page one text " * 8, "Page 1"), ("page two " * 3, "Page 2")]
+    out = list(ml.iter_split_segments(splitter, pages))
+    expected = [(c, meta) for text, meta in pages for c in splitter.split_text(text)]
+    assert out == expected
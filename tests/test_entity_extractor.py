@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""实体抽取：对本地 LLM 桩服务（benchmarks/llm_stub_server.py）验证 429/503 重试、Retry-After、长连接复用与结果缓存"""
+
+import os
+import sys
+import time
+import types
+import threading
+import importlib.util
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import database
+import entity_extractor as ee
+
+_STUB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "llm_stub_server.py")
+
+
+def _load_stub():
+    spec = importlib.util.spec_from_file_location("llm_stub_server", _STUB)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+class _Script:
+    """替代桩服务的 random：按脚本依次决定每个请求是否失败、返回哪个状态码"""
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.current = None
+
+    def random(self):
+        self.current = self.statuses.pop(0) if self.statuses else None
+        return 0.0 if self.current else 1.0
+
+    def choice(self, options):
+        return self.current
+
+    def uniform(self, a, b):
+        return 1.0
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    database.init_db()
+    mod = _load_stub()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), mod.Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(ee, "DEEPSEEK_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    sleeps = []
+    monkeypatch.setattr(ee, "time", types.SimpleNamespace(time=time.time, sleep=sleeps.append))
+    ee._drop_connection()
+
+    def script(*statuses):
+        mod.Handler.fail_rate = 1.0 if statuses else 0.0
+        monkeypatch.setattr(mod, "random", _Script(statuses))
+
+    yield types.SimpleNamespace(stats=mod._stats, sleeps=sleeps, script=script)
+    ee._drop_connection()
+    server.shutdown()
+    server.server_close()
+
+
+def test_retry_after_header_is_honoured(stub):
+    stub.script(429)
+    assert ee._extract_single("Alpha met Beta") == [("Alpha", "TERM"), ("Beta", "TERM")]
+    assert stub.stats["requests"] == 2 and stub.stats["failed"] == 1
+    # 桩服务 429 带 Retry-After: 0.2，等待时间按其 ±20% 抖动，而不是退避基数
+    assert len(stub.sleeps) == 1 and 0.16 <= stub.sleeps[0] <= 0.24
+
+
+def test_503_uses_exponential_backoff(stub, monkeypatch):
+    monkeypatch.setattr(ee, "ENTITY_BACKOFF_BASE", 0.01)
+    stub.script(503, 503)
+    assert ee._extract_single("Gamma") == [("Gamma", "TERM")]
+    assert stub.stats["requests"] == 3
+    assert [round(s / 0.01) for s in stub.sleeps] == [1, 2]
+
+
+def test_gives_up_after_max_retries(stub, monkeypatch):
+    monkeypatch.setattr(ee, "ENTITY_BACKOFF_BASE", 0.0)
+    stub.script(*[503] * (ee.ENTITY_MAX_RETRIES + 1))
+    with pytest.raises(RuntimeError):
+        ee._extract_single("Delta")
+    assert stub.stats["requests"] == ee.ENTITY_MAX_RETRIES + 1
+
+
+def test_keep_alive_connection_is_reused(stub):
+    stub.script()
+    before = stub.stats["connections"]
+    for word in ("Epsilon", "Zeta", "Theta"):
+        ee._extract_single(word)
+    assert stub.stats["connections"] - before == 1
+
+
+def test_entity_cache_skips_repeated_text(stub):
+    stub.script()
+    text = f"Kappa and “示例项目” {time.time()}"
+    ee._process_jobs([("hash-a", text)])
+    requests = stub.stats["requests"]
+    ee._process_jobs([("hash-b", text)])
+    assert stub.stats["requests"] == requests
+    expected = {("Kappa", "TERM"), ("示例项目", "NAME")}
+    for h in ("hash-a", "hash-b"):
+        assert {(e["entity_name"], e["entity_type"]) for e in database.get_file_entities(h)} >= expected
+
+
+def test_multi_document_batch_is_one_request(stub):
+    stub.script()
+    before = stub.stats["requests"]
+    ee._process_jobs([(f"hash-m{i}", f"Omega{i} {time.time()}") for i in range(3)])
+    assert stub.stats["requests"] - before == 1
+    assert [e["entity_name"] for e in database.get_file_entities("hash-m2")] == ["Omega2"]
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""S3 前缀同步：对 moto server 验证 StartAfter 断点续列与按 ETag 清单跳过未变对象"""
+
+import hashlib
+
+import pytest
+
+pytest.importorskip("moto.server")  # moto[server]
+pytest.importorskip("lancedb")
+pytest.importorskip("pdf2image")
+
+from moto.server import ThreadedMotoServer  # noqa: E402
+
+import database  # noqa: E402
+import s3_sync  # noqa: E402
+from s3_utils import make_s3_client  # noqa: E402
+
+_KEYS = [f"docs/{c}.txt" for c in "abcde"]
+
+
+@pytest.fixture(scope="module")
+def endpoint():
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f"http://{host}:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def bucket(endpoint, request):
+    database.init_db()
+    name = request.node.name.replace("_", "-")[:40]
+    client = make_s3_client(endpoint, "test", "test")
+    client.create_bucket(Bucket=name)
+    for key in _KEYS:
+        client.put_object(Bucket=name, Key=key, Body=f"content of {key}".encode())
+    return name, client
+
+
+@pytest.fixture
+def ingested(monkeypatch):
+    """替换入库管道，只记录被处理的对象名"""
+    names = []
+
+    def fake_pipeline(local_path, name, *args, data=None, on_stage=None, **kwargs):
+        names.append(name)
+        return {"success": True, "msg": "OK", "count": 1, "status": "ok",
+                "file_hash": hashlib.md5(data or b"").hexdigest()}
+
+    monkeypatch.setattr(s3_sync, "process_pipeline", fake_pipeline)
+    return names
+
+
+def _sync(endpoint, name, **kwargs):
+    return s3_sync.sync_s3_prefix(name, "docs/", None, None, None, None, endpoint_url=endpoint,
+                                  access_key_id="test", secret_access_key="test", **kwargs)
+
+
+def test_resumes_from_start_after_checkpoint(endpoint, bucket, ingested, monkeypatch):
+    name, _ = bucket
+    monkeypatch.setattr(s3_sync, "S3_SYNC_PAGE_SIZE", 2)
+    real_client = s3_sync.make_s3_client
+
+    class Interrupted:
+        """第二页列举时中断，模拟同步进程中途退出"""
+
+        def __init__(self, client):
+            self._client = client
+            self.pages = 0
+
+        def __getattr__(self, attr):
+            return getattr(self._client, attr)
+
+        def list_objects_v2(self, **kwargs):
+            self.pages += 1
+            if self.pages == 2:
+                raise ConnectionError("listing interrupted")
+            return self._client.list_objects_v2(**kwargs)
+
+    monkeypatch.setattr(s3_sync, "make_s3_client", lambda *a: Interrupted(real_client(*a)))
+    stats = _sync(endpoint, name)
+    assert stats["errors"] and sorted(ingested) == ["a.txt", "b.txt"]
+    source = f"{endpoint}/{name}/docs/"
+    assert database.get_s3_sync_checkpoint(source) == "docs/b.txt"
+
+    monkeypatch.setattr(s3_sync, "make_s3_client", real_client)
+    ingested.clear()
+    stats = _sync(endpoint, name)
+    assert not stats["errors"]
+    assert sorted(ingested) == ["c.txt", "d.txt", "e.txt"]
+    assert stats["listed"] == 3
+    assert database.get_s3_sync_checkpoint(source) is None
+
+
+def test_manifest_skips_unchanged_etags(endpoint, bucket, ingested):
+    name, client = bucket
+    stats = _sync(endpoint, name)
+    assert stats["ingested"] == len(_KEYS) and len(ingested) == len(_KEYS)
+
+    ingested.clear()
+    stats = _sync(endpoint, name)
+    assert ingested == [] and stats["unchanged"] == len(_KEYS)
+
+    client.put_object(Bucket=name, Key="docs/c.txt", Body=b"changed content")
+    stats = _sync(endpoint, name)
+    assert ingested == ["c.txt"] and stats["unchanged"] == len(_KEYS) - 1
+
+    ingested.clear()
+    stats = _sync(endpoint, name, force=True)
+    assert sorted(ingested) == sorted(k.rsplit("/", 1)[1] for k in _KEYS)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""load_transcriber：后端选择，以及两种后端在分段/时间戳输出上的一致性（桩模型，不加载真实 Whisper）"""
+
+import sys
+import types
+
+import numpy as np
+import pytest
+
+pytest.importorskip("lancedb")
+pytest.importorskip("pdf2image")
+
+import models_loader  # noqa: E402
+import extractors  # noqa: E402
+
+SR = 16000
+# 桩模型按音频长度"转录"，两种后端对同一段音频给出相同的分段
+_SEGMENTS = [(0.0, 1.5, " hello"), (1.5, 3.0, " world")]
+
+
+def _stub_segments(audio):
+    n = len(audio) / SR if not isinstance(audio, str) else 3.0
+    return [(s, min(e, n), f"{t}{n:.1f}") for s, e, t in _SEGMENTS if s < n]
+
+
+class _OpenAIModel:
+    def transcribe(self, audio, **kwargs):
+        segs = [{"start": s, "end": e, "text": t} for s, e, t in _stub_segments(audio)]
+        return {"text": "".join(s["text"] for s in segs), "segments": segs, "language": "zh"}
+
+
+class _FasterModel:
+    def __init__(self, size, device, compute_type, cpu_threads, local_files_only=False):
+        self.args = (size, device, compute_type, cpu_threads)
+
+    def transcribe(self, audio, language=None, beam_size=None):
+        segs = (types.SimpleNamespace(start=s, end=e, text=t) for s, e, t in _stub_segments(audio))
+        return segs, types.SimpleNamespace(language="zh")
+
+
+@pytest.fixture
+def stub_backends(monkeypatch):
+    whisper = types.ModuleType("whisper")
+    whisper.load_model = lambda name: _OpenAIModel()
+    faster = types.ModuleType("faster_whisper")
+    faster.WhisperModel = _FasterModel
+    monkeypatch.setitem(sys.modules, "whisper", whisper)
+    monkeypatch.setitem(sys.modules, "faster_whisper", faster)
+
+
+def test_backend_selection(stub_backends):
+    openai = models_loader.load_transcriber("openai", "base")
+    assert openai.backend == "openai" and openai.spec == ("openai", "base")
+    faster = models_loader.load_transcriber("faster", "small", cpu_threads=2)
+    assert faster.backend == "faster" and faster.spec == ("faster", "small")
+    assert faster.model.args == ("small", "cpu", models_loader.WHISPER_COMPUTE_TYPE, 2)
+    with pytest.raises(ValueError):
+        models_loader.load_transcriber("bogus")
+
+
+def test_faster_falls_back_when_not_installed(stub_backends, monkeypatch):
+    monkeypatch.setitem(sys.modules, "faster_whisper", None)  # import 时抛 ImportError
+    model = models_loader.load_transcriber("faster", "base")
+    assert model.backend == "openai" and model.spec == ("openai", "base")
+
+
+def test_transcribe_output_parity(stub_backends):
+    audio = np.zeros(int(2.5 * SR), dtype=np.float32)
+    a = models_loader.load_transcriber("openai").transcribe(audio)
+    b = models_loader.load_transcriber("faster").transcribe(audio)
+    assert a == b
+    assert [(s["start"], s["end"]) for s in a["segments"]] == [(0.0, 1.5), (1.5, 2.5)]
+
+
+def test_audio_segment_timestamps_parity(stub_backends, monkeypatch):
+    # 静音 2s + 语音 4s + 静音 3s + 语音 2s：两种后端的分段转录产出（文本与时间戳）一致
+    t = np.arange(4 * SR) / SR
+    tone = (0.3 * np.sin(2 * np.pi * 220 * t) * 32767).astype(np.int16)
+    silence = np.zeros(3 * SR, dtype=np.int16)
+    pcm = np.concatenate([silence[:2 * SR], tone, silence, tone[:2 * SR]])
+    blocks = [pcm[i:i + 5 * SR] for i in range(0, len(pcm), 5 * SR)]
+    monkeypatch.setattr(extractors, "iter_pcm_blocks", lambda path: iter(blocks))
+    monkeypatch.setattr(extractors, "AUDIO_TRANSCRIBE_WORKERS", 1)
+    out = {backend: list(extractors.iter_audio_segments("clip.wav", models_loader.load_transcriber(backend)))
+           for backend in ("openai", "faster")}
+    assert out["openai"] == out["faster"]
+    assert out["openai"] and all(meta.count(":") == 4 for _, meta in out["openai"])
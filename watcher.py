@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""目录监听入库：文件落到共享目录后数秒内自动入库
+
+- Linux 上有 inotify_simple 时用 inotify 事件驱动，否则定时轮询扫描
+- 去抖：文件大小/mtime 持续 WATCH_DEBOUNCE_SEC 不变才视为写完
+- 就绪文件攒批后在后台线程交给 batch_process_local_files，处理期间继续读取事件
+- inotify 事件队列溢出时立即全量扫描，另按 WATCH_RESCAN_INTERVAL 定期兜底扫描
+- 已处理文件按 (path, size, mtime, hash) 记录在 SQLite，重启后不重复入库；
+  只有 mtime 变化（如 touch、重新拷贝同一内容）时重新算 hash，内容相同则只更新状态
+
+用法:
+    python watcher.py /mnt/share            # 或设置环境变量 WATCH_DIR
+    python watcher.py /mnt/share --poll     # 强制轮询（NFS/SMB 挂载上 inotify 收不到远端写入）
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+
+from config import (
+    WATCH_DIR,
+    WATCH_DEBOUNCE_SEC,
+    WATCH_POLL_INTERVAL,
+    WATCH_BATCH_MAX,
+    WATCH_BATCH_WAIT,
+    WATCH_MAX_INFLIGHT_BATCHES,
+    WATCH_RESCAN_INTERVAL,
+    WATCH_IGNORE_SUFFIXES,
+)
+from database import calculate_file_hash, get_watch_state, upsert_watch_state
+
+logger = logging.getLogger(__name__)
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+
+def _ignored(name):
+    return name.startswith(".") or name.endswith(WATCH_IGNORE_SUFFIXES)
+
+
+class DirectoryWatcher:
+    def __init__(self, root, models, tbl_text, tbl_image, tbl_files, use_inotify=True):
+        self.root = os.path.abspath(root)
+        self.models = models
+        self.tables = (tbl_text, tbl_image, tbl_files)
+        self.use_inotify = use_inotify and INotify is not None and sys.platform.startswith("linux")
+        self.state = get_watch_state(self.root)  # path -> (size, mtime, file_hash)
+        self.pending = {}  # path -> (size, mtime, 最近一次变化时间)
+        self.ready = []  # [(path, size, mtime)]
+        self.ready_since = None
+        self.inflight = set()  # 已提交、尚未处理完的文件
+        self._batches = []  # 后台批次线程
+        self._lock = threading.Lock()  # 保护 state / inflight（批次线程回调中会修改）
+        self._inotify = None
+        self._wd_paths = {}
+
+    # ---------- 发现文件 ----------
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime
+
+    def _unchanged(self, path, size, mtime):
+        with self._lock:
+            prev = self.state.get(path)
+        if not prev:
+            return False
+        if prev[0] == size and prev[1] == mtime:
+            return True
+        # 大小没变、mtime 变了：比对 hash，内容相同只更新状态
+        if prev[0] == size and prev[2]:
+            try:
+                if calculate_file_hash(path) == prev[2]:
+                    upsert_watch_state(path, size, mtime, prev[2])
+                    with self._lock:
+                        self.state[path] = (size, mtime, prev[2])
+                    return True
+            except OSError:
+                pass
+        return False
+
+    def _consider(self, path):
+        if _ignored(os.path.basename(path)) or not os.path.isfile(path):
+            return
+        st = self._stat(path)
+        if st is None:
+            return
+        with self._lock:
+            if path in self.inflight:
+                return  # 处理完成后记录状态；期间被改写的文件由下一次扫描/事件重新发现
+            known = self.state.get(path)
+        if known and (known[0], known[1]) == st:
+            return
+        prev = self.pending.get(path)
+        if prev is None or (prev[0], prev[1]) != st:
+            self.pending[path] = (st[0], st[1], time.time())
+
+    def _scan(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            for f in filenames:
+                self._consider(os.path.join(dirpath, f))
+
+    # ---------- inotify ----------
+
+    def _add_watch(self, d):
+        mask = (inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO | inotify_flags.CREATE
+                | inotify_flags.MODIFY | inotify_flags.DELETE_SELF)
+        try:
+            wd = self._inotify.add_watch(d, mask)
+            self._wd_paths[wd] = d
+        except OSError as e:
+            logger.warning(f"添加 inotify 监听失败: {d}, {e}")
+
+    def _watch_tree(self, top):
+        for dirpath, dirnames, _ in os.walk(top):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            self._add_watch(dirpath)
+
+    def _read_events(self, timeout):
+        rescan = False
+        for ev in self._inotify.read(timeout=int(timeout * 1000)):
+            if ev.mask & inotify_flags.IGNORED:
+                self._wd_paths.pop(ev.wd, None)  # 目录已删除，监听被内核移除
+                continue
+            if ev.mask & inotify_flags.Q_OVERFLOW or ev.wd not in self._wd_paths:
+                # 事件队列溢出（wd=-1）或未知监听：期间的事件已丢失，全量扫描补上
+                rescan = True
+                continue
+            d = self._wd_paths.get(ev.wd)
+            if d is None or not ev.name:
+                continue
+            path = os.path.join(d, ev.name)
+            if ev.mask & inotify_flags.ISDIR:
+                if ev.mask & (inotify_flags.CREATE | inotify_flags.MOVED_TO) and not ev.name.startswith("."):
+                    # 新目录：加监听并扫描（监听建立前写入的文件不会有事件）
+                    self._watch_tree(path)
+                    for dirpath, _, filenames in os.walk(path):
+                        for f in filenames:
+                            self._consider(os.path.join(dirpath, f))
+                continue
+            self._consider(path)
+        if rescan:
+            logger.warning("inotify 事件丢失（队列溢出或未知监听），执行全量扫描")
+            self._scan()
+
+    # ---------- 去抖与攒批 ----------
+
+    def _promote_settled(self):
+        now = time.time()
+        for path, (size, mtime, changed_at) in list(self.pending.items()):
+            st = self._stat(path)
+            if st is None:
+                del self.pending[path]
+                continue
+            if st != (size, mtime):
+                self.pending[path] = (st[0], st[1], now)
+                continue
+            if now - changed_at < WATCH_DEBOUNCE_SEC:
+                continue
+            del self.pending[path]
+            if self._unchanged(path, size, mtime):
+                continue
+            self.ready.append((path, size, mtime))
+            if self.ready_since is None:
+                self.ready_since = now
+
+    def _flush(self, force=False):
+        self._batches = [t for t in self._batches if t.is_alive()]
+        while self.ready:
+            if not force and len(self.ready) < WATCH_BATCH_MAX and time.time() - self.ready_since < WATCH_BATCH_WAIT:
+                return
+            if len(self._batches) >= WATCH_MAX_INFLIGHT_BATCHES:
+                return
+            batch, self.ready = self.ready[:WATCH_BATCH_MAX], self.ready[WATCH_BATCH_MAX:]
+            self.ready_since = time.time() if self.ready else None
+            meta = {p: (size, mtime) for p, size, mtime in batch}
+            with self._lock:
+                self.inflight.update(meta)
+            t = threading.Thread(target=self._process_batch, args=(meta,), name="watch-batch", daemon=True)
+            t.start()
+            self._batches.append(t)
+
+    def _process_batch(self, meta):
+        """后台线程：处理一批文件并记录状态，主循环同时继续读取事件"""
+        from etl import batch_process_local_files
+
+        def on_result(item, res):
+            path = item[0]
+            size, mtime = meta[path]
+            # 入库期间文件又被改写则不记录，等下一轮
+            if self._stat(path) != (size, mtime):
+                return
+            # 失败也记状态，避免每轮扫描反复提交；重试由重试队列负责，文件再被改写时会重新入库
+            f_hash = res.get("file_hash")
+            upsert_watch_state(path, size, mtime, f_hash)
+            with self._lock:
+                self.state[path] = (size, mtime, f_hash)
+
+        logger.info(f"目录监听: 提交 {len(meta)} 个文件入库")
+        try:
+            succ, skip, dur, _ = batch_process_local_files(
+                [(p, os.path.basename(p)) for p in meta], self.models, *self.tables, result_callback=on_result,
+                source="watch",
+            )
+            logger.info(f"目录监听: 本批完成，成功 {succ}，跳过 {skip}，耗时 {dur:.1f}s")
+        except Exception as e:
+            logger.error(f"目录监听: 批次处理失败: {e}")
+        finally:
+            with self._lock:
+                self.inflight.difference_update(meta)
+
+    # ---------- 主循环 ----------
+
+    def run(self, stop_event=None):
+        stop_event = stop_event or threading.Event()
+        logger.info(f"开始监听目录: {self.root}（{'inotify' if self.use_inotify else '轮询'}）")
+        if self.use_inotify:
+            self._inotify = INotify()
+            self._watch_tree(self.root)
+        # 启动时全量扫描一次，已记录且 (size, mtime) 未变化的文件直接跳过
+        self._scan()
+        last_scan = time.time()
+        try:
+            while not stop_event.is_set():
+                if self.use_inotify:
+                    waiting = self.pending or self.ready
+                    self._read_events(WATCH_POLL_INTERVAL if not waiting else min(WATCH_POLL_INTERVAL, 0.5))
+                    rescan_every = WATCH_RESCAN_INTERVAL
+                else:
+                    stop_event.wait(WATCH_POLL_INTERVAL)
+                    rescan_every = WATCH_POLL_INTERVAL
+                if time.time() - last_scan >= rescan_every:
+                    self._scan()
+                    last_scan = time.time()
+                self._promote_settled()
+                self._flush()
+            self._promote_settled()
+            while self.ready or self._batches:
+                self._flush(force=True)
+                if self._batches:
+                    self._batches[0].join()
+        finally:
+            if self._inotify is not None:
+                self._inotify.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="监听目录，新文件自动入库")
+    parser.add_argument("root", nargs="?", default=WATCH_DIR, help="监听目录（默认取 WATCH_DIR）")
+    parser.add_argument("--poll", action="store_true", help="强制使用轮询")
+    args = parser.parse_args()
+    if not args.root:
+        parser.error("请指定监听目录或设置 WATCH_DIR")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    from database import init_db
+    from models_loader import load_models_cached, get_lancedb_tables
+    from ingest_retry import start_retry_loop
+
+    init_db()
+    models = load_models_cached()
+    tbl_text, tbl_image, tbl_files = get_lancedb_tables()
+    start_retry_loop(lambda: (models, tbl_text, tbl_image, tbl_files))
+    watcher = DirectoryWatcher(args.root, models, tbl_text, tbl_image, tbl_files, use_inotify=not args.poll)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()